@@ -67,15 +67,23 @@ Attributes:
 
 """
 ################################################################################
+import os
 import re
 import argparse
+import tempfile
+import traceback
+import multiprocessing
 
+from concurrent.futures     import ProcessPoolExecutor, as_completed
+
+from pathlib                import Path
 from filecache              import FCPath
 from pdslogger              import PdsLogger
 
 import metadata_tools.util as util
 import metadata_tools.defs as defs
 import metadata_tools.label_support as lab
+import metadata_tools.sidecar_support as sidecar
 
 ##########################################################################################
 # Logger management
@@ -134,21 +142,132 @@ def get_common_args(host=None):
     gr.add_argument('--labels', '-l', nargs='*', type=str, metavar='labels',
                     default=False, 
                     help='''If given, labels are generated for existing files.''')
+    gr.add_argument('--volume_jobs', type=int, metavar='volume_jobs',
+                    default=1, 
+                    help='''Maximum number of volumes processed concurrently.''')
+    gr.add_argument('--sidecar', action='store_true',
+                    help='''If given, a columnar binary sidecar (.npy) is written 
+                            alongside each table.''')
 
     # Return parser
     return parser
 
+################################################################################
+# Volume scheduler
+################################################################################
+
+#===============================================================================
+def _run_volume(process, kwargs):
+    """Process a single volume, capturing any failure.
+
+    Args:
+        process (function): Module-level function that processes a volume.
+        kwargs (dict): Keyword arguments to pass to the process function.
+
+    Returns:
+        tuple: (result, error, trace), where result is the value returned by the
+               process function, or None if it failed; error is the repr of the
+               exception raised, or None; and trace is its formatted traceback,
+               or None.
+    """
+    try:
+        return (process(**kwargs), None, None)
+    except Exception as e:
+        return (None, repr(e), traceback.format_exc())
+
+#===============================================================================
+def process_volumes(volumes, process, max_volumes=1):
+    """Process a set of volumes, dispatching whole volumes to a bounded pool 
+    of worker processes.
+
+    Each volume is processed independently; a failure is logged with its 
+    traceback and does not affect the other volumes.  A summary of the 
+    completed and failed volumes is logged at the end.
+
+    Args:
+        volumes (list): 
+            Tuples (volume_id, kwargs), where kwargs is the dictionary of
+            keyword arguments to pass to the process function for that volume.
+        process (function): 
+            Module-level function that processes a single volume.
+        max_volumes (int, optional): 
+            Maximum number of volumes processed concurrently.  If 1, the volumes
+            are processed in this process, one after another.
+
+    Returns:
+        dict: Values returned by the process function, keyed by volume ID, for
+              each volume that was completed.
+    """
+    logger = get_logger()
+
+    nvols = len(volumes)
+    results = {}
+    failures = {}
+
+    #-------------------------------------------------
+    # Record the outcome for one volume
+    #-------------------------------------------------
+    def finish(volume_id, result=None, error=None, trace=None):
+        done = len(results) + len(failures) + 1
+        if error is None:
+            results[volume_id] = result
+            logger.info('Completed %s (%d/%d)' % (volume_id, done, nvols))
+        else:
+            if trace:
+                logger.error(trace)
+            failures[volume_id] = error
+            logger.error('Failed %s (%d/%d): %s' % (volume_id, done, nvols, error))
+
+    # Process the volumes one after another
+    if not max_volumes or max_volumes <= 1 or nvols <= 1:
+        for (volume_id, kwargs) in volumes:
+            finish(volume_id, *_run_volume(process, kwargs))
+
+    # Otherwise, dispatch the volumes to a pool of worker processes
+    else:
+        with ProcessPoolExecutor(max_workers=max_volumes,
+                                 mp_context=multiprocessing.get_context('fork')) \
+                                                                    as executor:
+            futures = {executor.submit(_run_volume, process, kwargs): volume_id
+                                                for (volume_id, kwargs) in volumes}
+            for future in as_completed(futures):
+                volume_id = futures[future]
+
+                # The worker returns the traceback of a failed volume; only a 
+                # worker that dies is reported here
+                try:
+                    outcome = future.result()
+                except Exception as e:
+                    finish(volume_id, error=repr(e), trace=traceback.format_exc())
+                    continue
+                finish(volume_id, *outcome)
+
+    # Summarize
+    if nvols:
+        logger.info('Volumes completed: %d/%d' % (len(results), nvols))
+    if failures:
+        logger.error('Volumes failed: %s' % ', '.join(sorted(failures)))
+
+    # Return the results in the order of the volumes
+    return {volume_id: results[volume_id] for (volume_id, _) in volumes
+                                          if volume_id in results}
+
 ################################################################################
 # Table class
 ################################################################################
 class Table(object):
     """Class describing a single table for a single volume.
+
+    By default, rows accumulate in memory until write() is called.  In 
+    streaming mode, rows are appended to a temporary file each time flush() is
+    called and released, and write() moves the completed file into place.
     """
 
     #===========================================================================
     def __init__(self, output_dir=None, 
                     volume_id=None, level=None, qualifier=None, prefix=None, 
-                    suffix=None, use_global_template=False):
+                    suffix=None, use_global_template=False, sidecar=False,
+                    stream=False):
         """Constructor for a table object.
 
         Args:
@@ -162,12 +281,25 @@ class Table(object):
             use_global_template (bool): 
                 If True, the label template is to be found in the global template
                 directory.
+            sidecar (bool): 
+                If True, a columnar binary sidecar is written with the table.
+            stream (bool): 
+                If True, rows are written to the output as they are flushed 
+                rather than held until the table is written.
             
         """
         self.volume_id = volume_id
         self.level = level
         self.qualifier = qualifier
         self.use_global_template = use_global_template
+        self.sidecar = sidecar
+        self.stream = stream
+
+        # Summary of the rows written, from which the label is made
+        self.summary = lab.TableSummary()
+
+        self.stream_file = None
+        self.temp_path = None
 
         if not output_dir:
             return
@@ -179,7 +311,116 @@ class Table(object):
 
         self.rows = []
 
-     #===============================================================================
+    #===============================================================================
+    def take_rows(self):
+        """Remove and return the rows accumulated so far.
+
+        Returns:
+            list: Rows accumulated since the last call.
+        """
+        rows = self.rows
+        self.rows = []
+        return rows
+
+    #===============================================================================
+    def extend_rows(self, rows):
+        """Append rows previously returned by take_rows().
+
+        Args:
+            rows (list): Rows to append.
+
+        Returns:
+            None.
+        """
+        self.rows += rows
+
+    #===============================================================================
+    def parse_rows(self, lines):
+        """Convert lines read from an existing table to rows for extend_rows().
+
+        Args:
+            lines (list): Formatted lines, with no terminators.
+
+        Returns:
+            list: Rows.
+        """
+        return list(lines)
+
+    #===============================================================================
+    def flush(self):
+        """In streaming mode, write the accumulated rows and release them.
+
+        Returns:
+            None.
+        """
+        if not self.stream:
+            return
+
+        rows = self.rows
+        self.rows = []
+        self._append(rows)
+
+    #===============================================================================
+    def _append(self, lines):
+        """Append formatted lines to the temporary output file, opening it if
+        necessary.
+
+        Args:
+            lines (list): Formatted lines, with no terminators.
+
+        Returns:
+            None.
+        """
+        logger = get_logger()
+
+        if not lines:
+            return
+
+        # Open a temporary file beside the local copy of the table
+        if self.stream_file is None:
+            logger.info("Writing", self.filename)
+            local_path = Path(util.expandvars(self.filename).get_local_path())
+            local_path.parent.mkdir(parents=True, exist_ok=True)
+            (fd, self.temp_path) = tempfile.mkstemp(dir=local_path.parent, 
+                                                    prefix='.' + local_path.name + '.', 
+                                                    suffix='.tmp')
+            self.stream_file = os.fdopen(fd, 'w', encoding='utf-8', newline='')
+
+        self.stream_file.write('\r\n'.join(lines) + '\r\n')
+        self._count(lines)
+
+    #===============================================================================
+    def _close(self):
+        """Finish a streamed table, moving the temporary file into place.
+
+        Returns:
+            bool: True if the table was written; False if it has no rows.
+        """
+        if self.stream_file is None:
+            return False
+
+        self.stream_file.close()
+        self.stream_file = None
+
+        filename = util.expandvars(self.filename)
+        os.replace(self.temp_path, filename.get_local_path())
+        self.temp_path = None
+        filename.upload()
+        return True
+
+    #===============================================================================
+    def _count(self, lines):
+        """Add written lines to the summary of the table.
+
+        Args:
+            lines (list): Formatted lines, with no terminators.
+
+        Returns:
+            None.
+        """
+        self.summary.add(lines)
+
+    #===============================================================================
     def write(self, labels_only=False):
         """Write a table and its label.
 
@@ -193,18 +434,37 @@ class Table(object):
         logger = get_logger()
         
         if not labels_only:
-            if self.rows == []:
-                return
+            # Finish a streamed table
+            if self.stream:
+                self.flush()
+                if not self._close():
+                    return
+
+            # Otherwise write the table
+            else:
+                if self.rows == []:
+                    return
 
-            # Write table
-            logger.info("Writing:", self.filename)
-            util.write_txt_file(self.filename, self.rows)
+                logger.info("Writing:", self.filename)
+                util.write_txt_file(self.filename, self.rows)
+                self._count(self.rows)
 
         # Write label
         table_type = self.qualifier
         if self.level:
             table_type += '_' + self.level
-        lab.create(self.filename, 
-                   table_type=table_type, use_global_template=self.use_global_template)
+        if labels_only:
+            lab.create(self.filename, 
+                       table_type=table_type, use_global_template=self.use_global_template)
+
+        # Describe the table from its summary rather than by reading it
+        else:
+            lab.create(self.filename, 
+                       table_type=table_type, use_global_template=self.use_global_template,
+                       summary=self.summary)
+
+        # Write sidecar
+        if self.sidecar:
+            sidecar.write_sidecar(self.filename)
 
 ################################################################################
\ No newline at end of file
@@ -2,40 +2,98 @@
 # cumulative_support.py - Code for cumulative index files
 ################################################################################
 import host_config as config
+import os
+import json
+import shutil
 import fnmatch
+import hashlib
+import tempfile
+import time
 
 import metadata_tools as meta
 import metadata_tools.util as util
 import metadata_tools.label_support as lab
+import metadata_tools.sidecar_support as sidecar
 import metadata_tools.geometry_support as geom
 import metadata_tools.index_support as idx
+import metadata_tools.query_support as query
+
+import metadata_tools.defs as defs
 
 from filecache import FCPath
 
+# Local directory for cached lists of volumes
+WALK_CACHE_DIR = defs.CACHE_DIR / 'walks'
+
+# Seconds after which a cached list of volumes is no longer reused
+WALK_CACHE_MAX_AGE = 24 * 3600
+
 #===============================================================================
-def _cat_rows(volume_tree, cumulative_dir, volume_glob, table, *,
-              exclude=None, volume=None):
-    """Creates the cumulative files for a collection of volumes.
+def _tree_stamp(volume_tree):
+    """Stamp identifying the state of the top-level directories of a tree.
+
+    Adding, removing, or replacing a top-level directory, or an entry of one of
+    them, changes the stamp of a local tree.  Remote directories have no 
+    modification times, so only their names contribute.
+
+    Args:
+        volume_tree (FCPath): Root of the tree containing the volumes.
+
+    Returns:
+        list: [name, is_dir, mtime] for each top-level entry, sorted by name.
+    """
+    stamp = []
+    for (path, metadata) in volume_tree.iterdir_metadata():
+        metadata = metadata or {}
+        stamp.append([path.name, metadata.get('is_dir'), metadata.get('mtime')])
+    return sorted(stamp, key=lambda item: item[0])
+
+#===============================================================================
+def _find_volumes(volume_tree, cumulative_dir, volume_glob, *,
+                  exclude=None, volume=None, walk_cache=False):
+    """Find the volumes in a tree and the files in each, in a single walk.
 
     Args:
         volume_tree (str, Path, or FCPath): Root of the tree containing the volumes.
         cumulative_dir (str, Path, or FCPath): 
             Directory in which the cumulative files will reside.
         volume_glob (str): Glob pattern for volume identification.
-        table (geom.Table or idx.Index): Table object.
         exclude (list, optional): List of volumes to exclude.
-        volume (str, optional): If given, only this volume is processed.
+        volume (str, optional): If given, only this volume is found.
+        walk_cache (bool, optional): 
+            If True, the volumes found by an earlier walk of the same tree are
+            reused, and the volumes found by a new walk are saved.  A saved 
+            walk is not reused if the top-level directories of the tree have 
+            changed or it is older than WALK_CACHE_MAX_AGE.
+
+    Returns:
+        list: Tuple (root, files) for each volume, in walk order, where root is
+              the FCPath of the volume directory and files is the list of file
+              names it contains.
     """
     logger = meta.get_logger()
 
-    table_type = table.qualifier
-    if table.level:
-        table_type += '_' + table.level
-    ext = '.csv' if table_type=='inventory' else '.tab'
+    # Reuse the volumes found by an earlier walk
+    if walk_cache:
+        key = repr((volume_tree.as_posix(), cumulative_dir.name, volume_glob, 
+                    exclude, volume))
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        cache_path = WALK_CACHE_DIR / (digest[:12] + '_' + volume_tree.name + '_walk.json')
+        stamp = _tree_stamp(volume_tree)
+        try:
+            with open(cache_path) as f:
+                walk = json.load(f)
+            if (walk['stamp'] == stamp and 
+                time.time() - walk['time'] < WALK_CACHE_MAX_AGE):
+                logger.info('Reading volume list', cache_path)
+                return [(FCPath(root), files) for (root, files) in walk['volumes']]
+            logger.info('Volume list is out of date', cache_path)
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
 
-    # Walk the input tree, adding lines for each found volume
-    logger.info('Building Cumulative %s table' % table_type)
-    content = []
+    # Walk the input tree, recording each found volume
+    logger.info('Finding volumes in', volume_tree)
+    volumes = []
     for root, dirs, files in volume_tree.walk(top_down=True):
         # __skip directory will not be scanned, so it's safe for test results
         if '__skip' in root.as_posix():
@@ -66,28 +124,445 @@ def _cat_rows(volume_tree, cumulative_dir, volume_glob, table, *,
         if fnmatch.filter([vol], volume_glob):
             if not volume or vol == volume:
                 if vol != cumulative_dir.name:
-                    volume_id = config.get_volume_id(root)
-                    cumulative_id = config.get_volume_id(cumulative_dir)
+                    volumes.append((root, sorted(files)))
+
+    # Save the volumes for a later run
+    if walk_cache:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        walk = {'stamp': stamp, 'time': time.time(),
+                'volumes': [(root.as_posix(), files) for (root, files) in volumes]}
+        with open(cache_path, 'w') as f:
+            json.dump(walk, f)
+
+    return volumes
+
+#===============================================================================
+def _cat_rows(volumes, cumulative_dir, table, *, sidecars=False, incremental=False,
+              verify_segments=False):
+    """Creates the cumulative files for a collection of volumes.
+
+    Args:
+        volumes (list): 
+            Tuple (root, files) for each volume, as returned by _find_volumes().
+        cumulative_dir (str, Path, or FCPath): 
+            Directory in which the cumulative files will reside.
+        table (geom.Table or idx.Index): Table object.
+        sidecars (bool, optional): 
+            If True, a columnar binary sidecar is written for the cumulative 
+            table, concatenated from the volume sidecars where possible.
+        incremental (bool, optional): 
+            If True, the segments of the existing cumulative table are reused
+            for volumes whose tables are unchanged.
+        verify_segments (bool, optional):
+            If True, the bytes of each reused segment are verified against their
+            digest.
+
+    Returns:
+        tuple: (cumulative_file, segments, reused), where cumulative_file is the
+               FCPath of the cumulative table, or None if it was not written; 
+               segments is the list of its segments, as returned by 
+               _concatenate(); and reused contains, for each segment, the 
+               segment of the previous cumulative table it was reused from, or 
+               None.
+    """
+    logger = meta.get_logger()
+
+    table_type = table.qualifier
+    if table.level:
+        table_type += '_' + table.level
+    ext = '.csv' if table_type=='inventory' else '.tab'
+
+    # Find each volume containing the table
+    logger.info('Building Cumulative %s table' % table_type)
+    table_files = []
+    cumulative_id = config.get_volume_id(cumulative_dir)
+    for (root, files) in volumes:
+        vol = root.parts[-1]
+
+        # Check existence of table
+        table_name = '%s_%s' % (vol, table_type) + ext
+        if table_name not in files:
+            continue
+        table_file = root / table_name
+        volume_id = config.get_volume_id(root)
+
+        cumulative_file = FCPath(table_file.as_posix().replace(volume_id, cumulative_id))
+        table_files.append(table_file)
+
+    if not table_files:
+        return (None, [], [])
+
+    # Copy the table files to the cumulative table
+    logger.info('Writing cumulative file %s.' % cumulative_file)
+    (segments, reused) = _concatenate(table_files, cumulative_file, 
+                                      incremental=incremental, 
+                                      verify=verify_segments)
+
+    # Describe the cumulative table from the summaries of its segments
+    summary = lab.TableSummary()
+    for segment in segments:
+        summary.merge(lab.TableSummary.from_dict(segment['summary']))
+    if not summary:
+        return (None, [], [])
+
+    # Write label
+    logger.info('Writing cumulative label.')
+    lab.create(cumulative_file, 
+               table_type=table_type.upper(), use_global_template=table.use_global_template,
+               summary=summary)
+
+    # Write sidecar, carrying forward the rows of reused segments and parsing 
+    # the cumulative table only if necessary
+    if sidecars:
+        old_array = None
+        if any(old and old['sidecar'] for old in reused):
+            try:
+                old_array = sidecar.read_sidecar(cumulative_file)
+            except (FileNotFoundError, ValueError):
+                pass
+
+        sources = []
+        for (table_file, old) in zip(table_files, reused):
+            if (old and old['sidecar'] and old_array is not None and
+                old['row'] + old['records'] <= len(old_array)):
+                sources.append(old_array[old['row']:old['row'] + old['records']])
+            else:
+                sources.append(table_file)
+
+        if not sidecar.concatenate_sidecars(sources, cumulative_file):
+            sidecar.write_sidecar(cumulative_file)
+
+    # The query index, if any, is rewritten by the caller
+    for segment in segments:
+        segment['sidecar'] = sidecars
+        segment['query'] = False
+
+    if incremental:
+        _write_segments(cumulative_file, segments)
+
+    return (cumulative_file, segments, reused)
+
+#===============================================================================
+def _concatenate(table_files, cumulative_file, *, incremental=False, 
+                 verify=False, chunk_size=2**24):
+    """Concatenate volume tables into a cumulative table, and record the 
+    segment of the cumulative table copied from each.
+
+    When the table is rebuilt incrementally, the segments saved with the 
+    existing cumulative table are matched to the volume tables, and reused if
+    the volume table is unchanged and the segment still holds the bytes it was
+    copied from.  The leading segments up to the first changed, new, or removed
+    volume table are kept in place; later reused segments are copied from the 
+    existing cumulative table.  Unchanged volume tables are never read.  Each 
+    segment carries a summary of its rows, from which the cumulative table is
+    labeled without reading it.
+
+    The segments are known to hold their bytes if the size and stamp of the 
+    cumulative table are those saved with the segments.  Otherwise, the first
+    and last rows of each segment are compared with those it was copied with.
+    Optionally, all the bytes of each segment are compared with its digest 
+    instead, which reads nearly the whole table.
+
+    The segments file of the existing table is removed; the caller saves the 
+    new segments with _write_segments() once the table and the files derived
+    from it are complete.
+
+    Args:
+        table_files (list): Paths to the volume tables, in order.
+        cumulative_file (FCPath): Path to the cumulative table.
+        incremental (bool, optional): 
+            If True, the segments of the existing cumulative table are reused
+            for volume tables that are unchanged.
+        verify (bool, optional): 
+            If True, the bytes of each reused segment are verified against its
+            digest.
+        chunk_size (int, optional): Number of bytes to copy at a time.
+
+    Returns:
+        tuple: (segments, reused), where segments contains a dictionary for 
+               each volume table with "file", "stamp", "offset", "row", 
+               "nbytes", "records", "record_bytes", "digest", "ends", and 
+               "summary", 
+               the latter as saved by TableSummary.to_dict(); reused contains,
+               for each, the segment of the existing table it was reused from,
+               or None.
+    """
+    logger = meta.get_logger()
+
+    segments_path = _get_segments_path(cumulative_file)
+    local_path = cumulative_file.get_local_path()
+
+    # Match the volume tables to the existing segments
+    (old_segments, unchanged) = (_read_segments(cumulative_file) if incremental
+                                 else ({}, False))
+    if segments_path.exists():
+        segments_path.unlink()
+
+    plan = []
+    for table_file in table_files:
+        stamp = json.loads(json.dumps(util.file_stamp(table_file)))
+        segment = old_segments.get(table_file.as_posix())
+        if not segment or stamp is None or segment['stamp'] != stamp:
+            segment = None
+        plan.append((table_file, stamp, segment))
 
-                    # Check existence of table
-                    try:
-                        table_file = list(root.glob('%s_%s' % (vol, table_type)+ext))[0]
-                    except IndexError:
+    # Verify the bytes of each segment to be reused, reading only its first
+    # and last rows unless full verification is requested
+    if (verify or not unchanged) and any(segment for (_, _, segment) in plan):
+        with open(local_path, 'rb') as f:
+            for (i, (table_file, stamp, segment)) in enumerate(plan):
+                if not segment:
+                    continue
+                if verify:
+                    if _segment_digest(f, segment, chunk_size) == segment['digest']:
                         continue
+                    logger.warn('Segment does not match its digest', table_file)
+                else:
+                    if _segment_ends(f, segment) == segment['ends']:
+                        continue
+                    logger.warn('Segment does not match its first and last rows',
+                                table_file)
+                plan[i] = (table_file, stamp, None)
+
+    # Keep the leading unchanged segments in place
+    offset = 0
+    keep = 0
+    for (_, _, segment) in plan:
+        if not segment or segment['offset'] != offset:
+            break
+        offset += segment['nbytes']
+        keep += 1
+
+    reused = [segment for (_, _, segment) in plan]
+    if incremental:
+        logger.info('Reusing %d of %d segments; keeping %d in place' % 
+                    (sum(1 for segment in reused if segment), len(plan), keep))
+
+    segments = [dict(segment) for segment in reused[:keep]]
+
+    #-------------------------------------------------
+    # Copy the remaining segments to a file starting 
+    # at a given offset in the cumulative table
+    #-------------------------------------------------
+    def copy_segments(f, base, old=None):
+        for (table_file, stamp, segment) in plan[keep:]:
+            start = base + f.tell()
+
+            # Copy an unchanged segment from the existing cumulative table
+            if segment:
+                old.seek(segment['offset'])
+                remaining = segment['nbytes']
+                while remaining:
+                    chunk = old.read(min(remaining, chunk_size))
+                    f.write(chunk)
+                    remaining -= len(chunk)
+                segments.append(dict(segment, offset=start))
+                continue
+
+            # Copy a new or changed volume table, summarizing its rows
+            summary = lab.TableSummary()
+            (records, record_bytes, nbytes, digest) = \
+                util.append_txt_file(table_file, f, chunk_size=chunk_size,
+                                     summary=summary)
+            segments.append({'file': table_file.as_posix(), 'stamp': stamp, 
+                             'offset': start, 'nbytes': nbytes, 
+                             'records': records, 'record_bytes': record_bytes, 
+                             'digest': digest, 'summary': summary.to_dict()})
+
+    # Write the cumulative table after the kept segments
+    if any(reused[keep:]):
+        with tempfile.TemporaryFile(dir=os.path.dirname(local_path)) as tmp:
+            with open(local_path, 'rb') as old:
+                copy_segments(tmp, offset, old=old)
+
+            tmp.seek(0)
+            with open(local_path, 'r+b') as f:
+                f.truncate(offset)
+                f.seek(offset)
+                shutil.copyfileobj(tmp, f, chunk_size)
+    else:
+        with open(local_path, 'r+b' if keep else 'wb') as f:
+            f.truncate(offset)
+            f.seek(offset)
+            copy_segments(f, 0)
+
+    # Record the first and last rows of the new segments
+    with open(local_path, 'rb') as f:
+        for segment in segments:
+            if 'ends' not in segment:
+                segment['ends'] = _segment_ends(f, segment)
+
+    cumulative_file.upload()
+
+    _number_rows(segments)
+    return (segments, reused)
+
+#===============================================================================
+def _segment_digest(f, segment, chunk_size=2**24):
+    """SHA-1 hex digest of the bytes of a segment of a cumulative table.
+
+    Args:
+        f (file): Binary file object of the cumulative table.
+        segment (dict): Segment dictionary with "offset" and "nbytes".
+        chunk_size (int, optional): Number of bytes to read at a time.
+
+    Returns:
+        str: Digest of the bytes.
+    """
+    sha1 = hashlib.sha1()
+    f.seek(segment['offset'])
+    remaining = segment['nbytes']
+    while remaining:
+        chunk = f.read(min(remaining, chunk_size))
+        if not chunk:
+            break
+        sha1.update(chunk)
+        remaining -= len(chunk)
+    return sha1.hexdigest()
+
+#===============================================================================
+def _segment_ends(f, segment):
+    """SHA-1 hex digest of the first and last rows of a segment of a cumulative
+    table.
+
+    The longest row of the segment bounds the bytes read at each end.
+
+    Args:
+        f (file): Binary file object of the cumulative table.
+        segment (dict): Segment dictionary with "offset", "nbytes", and 
+                        "record_bytes".
+
+    Returns:
+        str: Digest of the bytes.
+    """
+    size = min(segment['record_bytes'], segment['nbytes'])
+    sha1 = hashlib.sha1()
+    f.seek(segment['offset'])
+    sha1.update(f.read(size))
+    f.seek(segment['offset'] + segment['nbytes'] - size)
+    sha1.update(f.read(size))
+    return sha1.hexdigest()
+
+#===============================================================================
+def _number_rows(segments):
+    """Record the first row of each segment of a cumulative table.
+
+    Args:
+        segments (list): Segment dictionaries in table order, updated in place
+                         with "row".
+
+    Returns:
+        None.
+    """
+    row = 0
+    for segment in segments:
+        segment['row'] = row
+        row += segment['records']
+
+#===============================================================================
+def _get_segments_path(cumulative_file):
+    """Path of the JSON file recording the segments of a cumulative table.
+
+    Args:
+        cumulative_file (FCPath): Path to the cumulative table.
+
+    Returns:
+        FCPath: Path to the segments file.
+    """
+    return cumulative_file.with_name(cumulative_file.stem + '_segments.json')
+
+#===============================================================================
+def _read_segments(cumulative_file):
+    """Read the segments of an existing cumulative table.
+
+    Args:
+        cumulative_file (FCPath): Path to the cumulative table.
+
+    Returns:
+        tuple: (segments, unchanged), where segments contains the segment 
+               dictionaries keyed by volume table path, empty if the segments 
+               file is missing or invalid, or does not describe the cumulative 
+               table; and unchanged is True if the cumulative table has the 
+               stamp saved with the segments.
+    """
+    logger = meta.get_logger()
+
+    segments_path = _get_segments_path(cumulative_file)
+    try:
+        saved = json.loads(segments_path.read_text())
+        (stamp, segments) = (saved['stamp'], saved['segments'])
+        local_path = cumulative_file.retrieve()
+    except (FileNotFoundError, ValueError, KeyError, TypeError):
+        return ({}, False)
+
+    # The segments must cover the table exactly, and describe their rows
+    if sum(segment['nbytes'] for segment in segments) != os.path.getsize(local_path):
+        logger.warn('Segments do not match cumulative table', cumulative_file)
+        return ({}, False)
+
+    if any('summary' not in segment or 'ends' not in segment 
+           for segment in segments):
+        return ({}, False)
+
+    _number_rows(segments)
+    for segment in segments:
+        segment.setdefault('sidecar', False)
+        segment.setdefault('query', False)
 
-                    # Copy table file to cumulative index
-                    cumulative_file = FCPath(table_file.as_posix().replace(volume_id, cumulative_id))
-                    lines = util.read_txt_file(table_file)
-                    content += lines
+    unchanged = stamp is not None and \
+                stamp == json.loads(json.dumps(util.file_stamp(cumulative_file)))
+    return ({segment['file']: segment for segment in segments}, unchanged)
 
-    # Write table and label
-    if content:
-        logger.info('Writing cumulative file %s.' % cumulative_file)
-        util.write_txt_file(cumulative_file, content)
+#===============================================================================
+def _write_segments(cumulative_file, segments):
+    """Save the segments of a cumulative table.
+
+    The stamp of the cumulative table is saved with them, so that they can be 
+    reused without reading the table while it is unchanged.
+
+    Args:
+        cumulative_file (FCPath): Path to the cumulative table.
+        segments (list): Segment dictionaries, as returned by _concatenate().
+
+    Returns:
+        None.
+    """
+    saved = {'stamp': util.file_stamp(cumulative_file), 'segments': segments}
+    _get_segments_path(cumulative_file).write_text(json.dumps(saved, indent=1))
+
+#===============================================================================
+def _write_query_index(cumulative_file, index_file, segments, reused):
+    """Write the query index of a cumulative table, carrying forward the keys
+    of the rows of reused segments from the existing index.
 
-        logger.info('Writing cumulative label.')
-        lab.create(cumulative_file, 
-                   table_type=table_type.upper(), use_global_template=table.use_global_template)
+    Args:
+        cumulative_file (FCPath): Path to the cumulative table.
+        index_file (FCPath): 
+            Path to the cumulative supplemental index, for event times.
+        segments (list): Segments of the table, as returned by _concatenate().
+        reused (list): 
+            Segment of the previous table each segment was reused from, or None.
+
+    Returns:
+        None.
+    """
+    old_rows = None
+    if any(old and old['query'] for old in reused):
+        old_rows = query.read_query_rows(cumulative_file)
+
+    parts = []
+    for (segment, old) in zip(segments, reused):
+        part = {'offset': segment['offset'], 'nbytes': segment['nbytes']}
+        if (old and old['query'] and old_rows is not None and 
+            old['row'] + old['records'] <= len(old_rows['OFFSET'])):
+            rows = slice(old['row'], old['row'] + old['records'])
+            part['rows'] = {key: values[rows] for (key, values) in old_rows.items()}
+            part['rows']['OFFSET'] = part['rows']['OFFSET'] - old['offset']
+        parts.append(part)
+
+    query.write_query_index(cumulative_file, index_file, parts=parts)
+    for segment in segments:
+        segment['query'] = True
 
 #===============================================================================
 def get_args(host=None, exclude=None):
@@ -110,6 +585,20 @@ def get_args(host=None, exclude=None):
     gr.add_argument('--exclude', '-e', nargs='*', type=str, metavar='exclude',
                     default=exclude, 
                     help='''List of volumes to exclude.''')
+    gr.add_argument('--walk_cache', action='store_true', 
+                    help='''Reuse the list of volumes found by an earlier run
+                            on the same tree, rather than walking the tree.''')
+    gr.add_argument('--incremental', action='store_true', 
+                    help='''Update the existing cumulative tables, reading only
+                            the volume tables that are new or have changed.''')
+    gr.add_argument('--verify_segments', action='store_true', 
+                    help='''With --incremental, verify every byte of the reused 
+                            segments of the cumulative tables against their 
+                            digests, rather than only their first and last rows
+                            when the tables have changed.''')
+    gr.add_argument('--query_index', action='store_true', 
+                    help='''Write query indexes for the cumulative body and ring 
+                            summary tables.''')
 
     # Return parser
     return parser
@@ -137,22 +626,35 @@ def create_cumulative_indexes(host=None, exclude=None):
     # Build volume glob
     volume_glob = util.get_volume_glob(volume_tree.name)
 
+    # Find the volumes once for all tables
+    volumes = _find_volumes(volume_tree, cumulative_dir, volume_glob, 
+                            exclude=exclude, volume=volume, 
+                            walk_cache=args.walk_cache)
+
     # Build the cumulative tables
-    _cat_rows(volume_tree, cumulative_dir, volume_glob, geom.SkyTable(level='summary'),
-              exclude=exclude, volume=volume)
-    _cat_rows(volume_tree, cumulative_dir, volume_glob, geom.SkyTable(level='detailed'),
-              exclude=exclude, volume=volume)
-    _cat_rows(volume_tree, cumulative_dir, volume_glob, geom.BodyTable(level='summary'),
-              exclude=exclude, volume=volume)
-    _cat_rows(volume_tree, cumulative_dir, volume_glob, geom.BodyTable(level='detailed'),
-              exclude=exclude, volume=volume)
-    _cat_rows(volume_tree, cumulative_dir, volume_glob, geom.RingTable(level='summary'),
-              exclude=exclude, volume=volume)
-    _cat_rows(volume_tree, cumulative_dir, volume_glob, geom.RingTable(level='detailed'),
-              exclude=exclude, volume=volume)
-    _cat_rows(volume_tree, cumulative_dir, volume_glob, geom.InventoryTable(),
-              exclude=exclude, volume=volume)
-    _cat_rows(volume_tree, cumulative_dir, volume_glob, idx.IndexTable(qualifier='supplemental'),
-              exclude=exclude, volume=volume)
+    tables = [geom.SkyTable(level='summary'),
+              geom.SkyTable(level='detailed'),
+              geom.BodyTable(level='summary'),
+              geom.BodyTable(level='detailed'),
+              geom.RingTable(level='summary'),
+              geom.RingTable(level='detailed'),
+              geom.InventoryTable(),
+              idx.IndexTable(qualifier='supplemental')]
+    results = {}
+    for table in tables:
+        results[(table.qualifier, table.level)] = \
+            _cat_rows(volumes, cumulative_dir, table, sidecars=args.sidecar, 
+                      incremental=args.incremental, 
+                      verify_segments=args.verify_segments)
+
+    # Write the query indexes, taking event times from the supplemental index
+    if args.query_index:
+        index_file = results[('supplemental', 'index')][0]
+        for key in [('body', 'summary'), ('ring', 'summary')]:
+            (cumulative_file, segments, reused) = results[key]
+            if cumulative_file:
+                _write_query_index(cumulative_file, index_file, segments, reused)
+                if args.incremental:
+                    _write_segments(cumulative_file, segments)
     
-################################################################################
\ No newline at end of file
+################################################################################
@@ -1,6 +1,7 @@
 ################################################################################
 # defs.py: Definitions
 ################################################################################
+import os
 import sys
 from pathlib                import Path
 
@@ -15,6 +16,9 @@ BODYX = "bodyx"                     # Placeholder for an arbitrary body to be
                                     # filled in by replacement_dict()
 NAME_LENGTH = 12
 
+# Local directory for cached metadata, e.g., meshgrids, journals, and labels
+CACHE_DIR = Path(os.environ.get('METADATA_CACHE', '~/.cache/metadata_tools')).expanduser()
+
 # Maintain a list of translations for target names
 TRANSLATIONS = {}
 
@@ -1,12 +1,25 @@
 ################################################################################
 # geometry_support.py - Tools for generating geometry tables.
 ################################################################################
+import os
 import oops
+import json
+import cspyce
 import julian
 import numpy as np
 import traceback
 import warnings
 import fnmatch
+import hashlib
+import inspect
+import pickle
+import shutil
+import socket
+import time
+import tempfile
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
 
 import metadata_tools as meta
 import metadata_tools.util as util
@@ -14,6 +27,7 @@ import metadata_tools.defs as defs
 import metadata_tools.columns as col
 
 from filecache import FCPath
+from pathlib import Path
 
 import host_config as config
 
@@ -117,22 +131,589 @@ ALT_FORMAT_DICT = {
 DEFAULT_BODIES_TABLE = \
     util.convert_default_bodies_table(config.DEFAULT_BODIES_TABLE, config.SCLK_BASES)
 
+# Local directories for cached meshgrids and journals
+MESHGRID_CACHE_DIR = defs.CACHE_DIR / 'meshgrids'
+JOURNAL_DIR = defs.CACHE_DIR / 'journals'
+
+# Angular margin in radians added to the inventory prefilter cone, covering
+# light-time and aberration, which the prefilter ignores
+PREFILTER_MARGIN = 0.01
+
+# Angular margin in radians added to the disks tested by the occlusion stage,
+# and relative margin added to the separations of bodies, covering light-time
+# and aberration
+OCCLUSION_MARGIN = 1.e-3
+
+# Seconds between checks of an empty daemon job queue
+DAEMON_POLL_INTERVAL = 1.
+
+# Volume options that a daemon job may override
+DAEMON_JOB_OPTIONS = ['selection', 'first', 'sampling', 'jobs', 'occlusion', 
+                      'sidecar', 'resume', 'incremental', 'stream', 'labels_only']
+
 ################################################################################
-# Record class
+# MaskCache class
 ################################################################################
-class Record(object):
-    """Class describing a single geometry record, i.e., a single row in a table.
+class MaskCache(object):
+    """Class describing a cache of excluded-pixel masks for a single observation.
+
+    Masks are keyed on a normalized description, so that equivalent requests 
+    from different tables and processing levels share the same mask.
     """
 
     #===========================================================================
-    def __init__(self, observation, volume_id, meshgrids, level):
-        """Constructor for a geometry record.
+    def __init__(self, backplane, primary, occlusion=None):
+        """Constructor for a MaskCache object.
+
+        Args:
+            backplane (oops.Backplane): Backplane for the observation.
+            primary (str): Name of primary body, uppercase, e.g., "SATURN".
+            occlusion (Occlusion, optional): 
+                If given, masks are derived from its occlusion rasters rather
+                than from the backplane.
+        """
+        self.backplane = backplane
+        self.primary = primary
+        self.occlusion = occlusion
+        self.masks = {}
+        self.hits = 0
+        self.misses = 0
+
+    #===============================================================================
+    def key(self, target, mask_desc, blocker=None, ignore_shadows=False):
+        """Normalized cache key for a mask.
+
+        Codes that cannot affect the mask are removed, e.g., "R" if the primary
+        is not Saturn, "M" if there is no blocker, and the shadower and face 
+        codes if shadows are ignored.
+
+        Args:
+            target (str): The name of the target surface.
+            mask_desc (tuple): (masker, shadower, face); see 
+                Record._construct_excluded_mask().
+            blocker (str, optional): Name of the body used for "M" codes.
+            ignore_shadows (bool, optional): 
+                True to ignore any shadower or face constraints.
+
+        Returns:
+            tuple: (target, masker, shadower, face, blocker).
+        """
+        if target == blocker:
+            blocker = None
+
+        # Keep only the codes that apply
+        codes = 'P'
+        if self.primary == "SATURN":
+            codes += 'R'
+        if blocker is not None:
+            codes += 'M'
+
+        (masker, shadower, face) = mask_desc
+        masker = ''.join(sorted(set(masker) & set(codes)))
+        if ignore_shadows:
+            shadower = ''
+            face = ''
+        else:
+            shadower = ''.join(sorted(set(shadower) & set(codes)))
+            face = ''.join(sorted(set(face) & set('DN')))
+
+        if 'M' not in masker + shadower:
+            blocker = None
+
+        return (target, masker, shadower, face, blocker)
+
+    #===============================================================================
+    def get(self, target, mask_desc, blocker=None, ignore_shadows=False):
+        """Return the excluded mask, constructing it if necessary.
+
+        Args:
+            target (str): The name of the target surface.
+            mask_desc (tuple): (masker, shadower, face); see 
+                Record._construct_excluded_mask().
+            blocker (str, optional): Name of the body used for "M" codes.
+            ignore_shadows (bool, optional): 
+                True to ignore any shadower or face constraints.
+
+        Returns:
+            numpy.array or bool: Excluded mask.
+        """
+        key = self.key(target, mask_desc, 
+                       blocker=blocker, ignore_shadows=ignore_shadows)
+        if key in self.masks:
+            self.hits += 1
+            return self.masks[key]
+
+        self.misses += 1
+        (target, masker, shadower, face, blocker) = key
+        if self.occlusion is not None:
+            mask = self.occlusion.excluded_mask(
+                            target, (masker, shadower, face), 
+                            blocker=blocker, ignore_shadows=ignore_shadows)
+        else:
+            mask = Record._construct_excluded_mask(
+                            self.backplane, target, self.primary, 
+                            (masker, shadower, face), 
+                            blocker=blocker, ignore_shadows=ignore_shadows)
+        self.masks[key] = mask
+        return mask
+
+################################################################################
+# Occlusion class
+################################################################################
+class Occlusion(object):
+    """Class describing the occlusion and shadowing geometry of a single 
+    observation.
+
+    A single batched pass tests every meshgrid ray against the apparent disks
+    of all the surfaces in the observation, yielding a coverage raster of the 
+    surfaces that each ray may intercept.  Exact ranges are computed only for 
+    surfaces whose coverage overlaps that of a target, and a nearest-surface 
+    raster is then formed from those ranges in one comparison.  Likewise, one
+    batched test of the body positions as seen from the Sun finds the bodies 
+    that can shadow each target, and the exact shadow masks are computed only 
+    for those pairs.
+
+    The tests are conservative, so every mask is identical to that of 
+    Record._construct_excluded_mask(); only the backplane calculations that 
+    cannot affect a mask are skipped.
+    """
+
+    #===========================================================================
+    def __init__(self, backplane, primary, bodies=[], blocker=None):
+        """Constructor for an Occlusion object.
+
+        Args:
+            backplane (oops.Backplane): Backplane for the observation.
+            primary (str): Name of primary body, uppercase, e.g., "SATURN".
+            bodies (list, optional): Names of the bodies in the field of view.
+            blocker (str, optional): 
+                Name of the body that may block or shadow other bodies.
+        """
+        self.backplane = backplane
+        self.primary = primary
+        self.shape = backplane.shape
+
+        # Surfaces that can obscure or shadow a target, then the other bodies
+        names = []
+        if primary:
+            names += [primary]
+            if primary == "PLUTO":
+                names += ["CHARON"]
+            if primary == "SATURN":
+                names += ["SATURN_MAIN_RINGS"]
+        if blocker:
+            names += [blocker]
+        names += bodies
+        self.surfaces = [name for (i, name) in enumerate(names) 
+                                if name not in names[:i] and oops.Body.exists(name)]
+
+        # Surface IDs, as used in the nearest-surface rasters; 0 is the sky.
+        # Other surfaces, e.g., targets such as "SATURN:RING", are given IDs as
+        # needed.
+        self.ids = {name: i+1 for (i, name) in enumerate(self.surfaces)}
+
+        # Coverage raster, ranges, nearest-surface rasters, and shadow masks,
+        # computed as needed
+        self._coverage = None
+        self.ranges = {}
+        self.nearest_ids = {}
+        self.shadows = {}
+        self._shadowers = None
+
+    #===============================================================================
+    @staticmethod
+    def _outer_radius(body):
+        """Radius of a sphere enclosing the surface of a body.
+
+        Args:
+            body (oops.Body): Body.
+
+        Returns:
+            float: Radius in km; None if the surface is not an ellipsoid.
+        """
+        if not isinstance(body.surface, oops.surface.Ellipsoid):
+            return None
+        return max(body.radius, np.max(body.surface.radii))
+
+    #===============================================================================
+    def _bounded(self):
+        """Surfaces whose extent is bounded, with their bodies and outer radii.
+
+        Returns:
+            list: Tuples (index, body, radius) for each surface in self.surfaces
+                  that is enclosed by a sphere about its body center.
+        """
+        bounded = []
+        for (i, name) in enumerate(self.surfaces):
+            body = oops.Body.lookup(name)
+            radius = Occlusion._outer_radius(body)
+            if radius is not None:
+                bounded.append((i, body, radius))
+        return bounded
+
+    #===============================================================================
+    def coverage(self):
+        """Raster of the surfaces that each meshgrid ray may intercept.
+
+        The apparent disk of every bounded surface is tested against the line
+        of sight of every pixel in one pass, at the time of each pixel.  Each 
+        disk is expanded by OCCLUSION_MARGIN, which covers light-time and 
+        aberration.  Unbounded surfaces, e.g., rings, cover every pixel.
+
+        Returns:
+            numpy.array: 
+                Boolean array of shape backplane.shape + (number of surfaces,),
+                True where the ray of a pixel may intercept a surface.
+        """
+        if self._coverage is not None:
+            return self._coverage
+
+        nsurfs = len(self.surfaces)
+        coverage = np.ones(self.shape + (nsurfs,), dtype='bool')
+        self._coverage = coverage
+
+        bounded = self._bounded()
+        if not bounded:
+            return coverage
+
+        # Lines of sight in J2000, and the distinct times of the pixels
+        obs_event = self.backplane.obs_event.wrt_ssb(derivs=False)
+        los = np.broadcast_to(obs_event.neg_arr_ap.unit().vals, self.shape + (3,))
+        (times, inverse) = np.unique(np.broadcast_to(obs_event.time.vals, 
+                                                     self.shape),
+                                     return_inverse=True)
+
+        # Body positions relative to the observer at each time
+        multipath = oops.path.MultiPath([body.path for (_, body, _) in bounded],
+                                        origin=self.backplane.obs.path, 
+                                        frame=oops.Frame.J2000)
+        pos = multipath.event_at_time(times[:, np.newaxis]).pos.vals
+        ranges = np.sqrt(np.sum(pos**2, axis=-1))
+        radii = np.array([radius for (_, _, radius) in bounded])
+
+        # Cosine of the angular radius of each disk at each time; 
+        # -1 if the observer is inside the enclosing sphere
+        with np.errstate(divide='ignore', invalid='ignore'):
+            angles = np.arcsin(np.minimum(radii / ranges, 1.)) + OCCLUSION_MARGIN
+            limits = np.where(ranges > radii, np.cos(np.minimum(angles, np.pi)), -1.)
+            centers = pos / ranges[..., np.newaxis]
+
+        # Test every ray against every disk at its own time
+        inverse = inverse.reshape(self.shape)
+        cosines = np.sum(los[..., np.newaxis, :] * centers[inverse], axis=-1)
+        indices = [i for (i, _, _) in bounded]
+        coverage[..., indices] = cosines >= limits[inverse]
+
+        return coverage
+
+    #===============================================================================
+    def _id(self, name):
+        """ID of a surface, assigning a new one if necessary."""
+        if name not in self.ids:
+            self.ids[name] = len(self.ids) + 1
+        return self.ids[name]
+
+    #===============================================================================
+    def footprint(self, name):
+        """Pixels whose rays may intercept a surface.
+
+        Args:
+            name (str): Surface key.
+
+        Returns:
+            numpy.array or bool: 
+                Boolean mask; True if the surface is not one of self.surfaces.
+        """
+        if name not in self.surfaces:
+            return True
+        return self.coverage()[..., self.ids[name] - 1]
+
+    #===============================================================================
+    def overlaps(self, name1, name2):
+        """True if the rays of any pixel may intercept both surfaces.
+
+        Args:
+            name1 (str): Surface key.
+            name2 (str): Surface key.
+
+        Returns:
+            bool: True if the footprints overlap.
+        """
+        return bool(np.any(self.footprint(name1) & self.footprint(name2)))
+
+    #===============================================================================
+    def range(self, name):
+        """Distance to a surface at each pixel, infinite where it is not 
+        intercepted.
+
+        Args:
+            name (str): Surface key.
+
+        Returns:
+            numpy.array: Distances in km.
+        """
+        if name not in self.ranges:
+            distance = self.backplane.distance(name)
+            vals = np.broadcast_to(distance.vals, self.shape)
+            mask = np.broadcast_to(distance.mask, self.shape)
+            self.ranges[name] = np.where(mask, np.inf, vals)
+
+        return self.ranges[name]
+
+    #===============================================================================
+    def nearest(self, names=None):
+        """Nearest-surface raster.
+
+        Args:
+            names (list, optional): 
+                Surface keys to consider, in order of precedence where their 
+                ranges are equal; default is all of self.surfaces.
+
+        Returns:
+            numpy.array: 
+                ID of the nearest intercepted surface at each pixel; 0 where
+                none is intercepted.
+        """
+        if names is None:
+            names = self.surfaces
+        key = tuple(names)
+        if key in self.nearest_ids:
+            return self.nearest_ids[key]
+
+        ids = np.zeros(self.shape, dtype='int')
+        if names:
+            ranges = np.array([self.range(name) for name in names])
+            nearest = np.argmin(ranges, axis=0)
+            surface_ids = np.array([self._id(name) for name in names])
+            ids = np.where(np.isfinite(np.min(ranges, axis=0)), 
+                           surface_ids[nearest], 0)
+
+        self.nearest_ids[key] = ids
+        return ids
+
+    #===============================================================================
+    def in_back(self, target, maskers):
+        """Mask where the target is behind any of the given surfaces.
+
+        Only maskers whose footprints overlap that of the target are ranged.
+
+        Args:
+            target (str): Surface key of the target.
+            maskers (list): Surface keys of the obscuring surfaces.
+
+        Returns:
+            numpy.array: Boolean mask.
+        """
+        maskers = [name for name in maskers if name != target and 
+                                               self.overlaps(target, name)]
+        if not maskers:
+            return np.zeros(self.shape, dtype='bool')
+
+        # The target takes precedence where ranges are equal, because it is not
+        # behind a surface at the same distance
+        ids = self.nearest([target] + maskers)
+        return np.isfinite(self.range(target)) & (ids != self._id(target))
+
+    #===============================================================================
+    def shadowers(self):
+        """Bodies that cannot shadow each target.
+
+        The positions of all bounded bodies relative to the Sun are found in 
+        one batched call, each at the midtime of the observation less its 
+        light time to the observer.  A body can shadow another only if their 
+        disks, as seen from the Sun, overlap and the shadower is not entirely
+        farther from the Sun.  Each enclosing sphere is expanded by the motion
+        of the bodies during the exposure and the light travel time between 
+        them, and by OCCLUSION_MARGIN times their separation.
+
+        Returns:
+            dict: 
+                Set of the names of the bodies that cannot shadow a target, 
+                keyed by target name.
+        """
+        if self._shadowers is not None:
+            return self._shadowers
+
+        self._shadowers = {}
+        bounded = self._bounded()
+        if len(bounded) < 2 or not oops.Body.exists('SUN'):
+            return self._shadowers
+
+        names = [self.surfaces[i] for (i, _, _) in bounded]
+        paths = [body.path for (_, body, _) in bounded]
+        radii = np.array([radius for (_, _, radius) in bounded])
+
+        # Light time from each body to the observer
+        obs = self.backplane.obs
+        tmid = (obs.time[0] + obs.time[1]) / 2.
+        half_span = (obs.time[1] - obs.time[0]) / 2.
+        multipath = oops.path.MultiPath(paths, origin=obs.path, 
+                                        frame=oops.Frame.J2000)
+        ranges = np.sqrt(np.sum(multipath.event_at_time(tmid).pos.vals**2, axis=-1))
+        times = tmid - ranges / oops.C
+
+        # Positions and velocities relative to the Sun
+        multipath = oops.path.MultiPath(paths, origin=oops.Body.lookup('SUN').path,
+                                        frame=oops.Frame.J2000)
+        event = multipath.event_at_time(times)
+        pos = event.pos.vals
+        vel = event.vel.vals
+        dist = np.sqrt(np.sum(pos**2, axis=-1))
+        speed = np.sqrt(np.sum(vel**2, axis=-1))
+
+        # For each target i and shadower j, the distance either body may move
+        # from its computed position while a photon passes between them
+        separations = np.sqrt(np.sum((pos[np.newaxis] - pos[:, np.newaxis])**2, 
+                                     axis=-1))
+        relative = np.sqrt(np.sum((vel[np.newaxis] - vel[:, np.newaxis])**2, 
+                                  axis=-1))
+        delays = np.abs(times[np.newaxis] - times[:, np.newaxis]) + \
+                 2. * separations / oops.C
+        pads = relative * half_span + \
+               (relative + np.maximum(speed[np.newaxis], speed[:, np.newaxis])) * delays + \
+               OCCLUSION_MARGIN * separations
+
+        # Angular radii of the padded disks as seen from the Sun
+        target_radii = radii[:, np.newaxis] + pads
+        shadower_radii = radii[np.newaxis, :] + pads
+        with np.errstate(divide='ignore', invalid='ignore'):
+            target_angles = np.arcsin(np.minimum(target_radii / dist[:, np.newaxis], 1.))
+            shadower_angles = np.arcsin(np.minimum(shadower_radii / dist[np.newaxis, :],
+                                                   1.))
+            cosines = (pos @ pos.T) / (dist[:, np.newaxis] * dist[np.newaxis, :])
+        angles = np.arccos(np.clip(cosines, -1., 1.))
+
+        possible = ((angles <= target_angles + shadower_angles) &
+                    (dist[np.newaxis, :] - shadower_radii < 
+                     dist[:, np.newaxis] + target_radii)) | \
+                   (separations < target_radii + shadower_radii)
+
+        for (i, target) in enumerate(names):
+            self._shadowers[target] = {name for (j, name) in enumerate(names)
+                                                if not possible[i, j] and j != i}
+
+        return self._shadowers
+
+    #===============================================================================
+    def inside_shadow(self, target, shadowers):
+        """Mask where the target is in the shadow of any of the given surfaces.
+
+        The exact backplane masks are computed only for shadowers that can 
+        shadow the target.
+
+        Args:
+            target (str): Surface key of the target.
+            shadowers (list): Names of the shadowing surfaces.
+
+        Returns:
+            numpy.array: Boolean mask.
+        """
+        excluded = np.zeros(self.shape, dtype='bool')
+        for name in shadowers:
+            if name in self.shadowers().get(target, ()):
+                continue
+
+            key = (target, name)
+            if key not in self.shadows:
+                self.shadows[key] = self.backplane.where_inside_shadow(target, 
+                                                                       name).vals
+            excluded |= self.shadows[key]
+
+        return excluded
+
+    #===============================================================================
+    def excluded_mask(self, target, mask_desc, *, 
+                      blocker=None, ignore_shadows=False):
+        """Return a mask using the specified target, maskers and shadowers to
+        indicate excluded pixels.
+
+        This is a drop-in replacement for Record._construct_excluded_mask() 
+        using the coverage and nearest-surface rasters.
+
+        Args:
+            target (str): The name of the target surface.
+            mask_desc (tuple): (masker, shadower, face); see 
+                Record._construct_excluded_mask().
+            blocker (str, optional):
+                Optionally, the name of the body to use for any "M"
+                codes that appear in the mask_desc.
+            ignore_shadows (bool, optional):
+                True to ignore any shadower or face constraints; default
+                is False.
+
+        Returns:
+            numpy.array: Boolean bitmask containing the mask.
+        """
+        primary = self.primary
+
+        # Do not let a body block itself
+        if target == blocker:
+            blocker = None
+
+        if type(target) == str:
+            primary_name = target.split(':')[0]
+            if not oops.Body.exists(primary_name):
+                return True
+
+        (masker, shadower, face) = mask_desc
+
+        #-------------------------------------------------
+        # Select the surfaces corresponding to the codes
+        #-------------------------------------------------
+        def select(codes):
+            names = []
+            if "R" in codes and primary == "SATURN":
+                names += ["SATURN_MAIN_RINGS"]
+            if "P" in codes and primary:
+                names += [primary]
+                if primary == "PLUTO":
+                    names += ["CHARON"]
+            if "M" in codes and blocker is not None:
+                names += [blocker]
+            return names
+
+        # Handle maskers
+        excluded = self.in_back(target, select(masker))
+
+        if not ignore_shadows:
+
+            # Handle shadowers
+            excluded |= self.inside_shadow(target, select(shadower))
+
+            # Handle face selection
+            if "D" in face:
+                excluded |= self.backplane.where_antisunward(target).vals
+
+            if "N" in face:
+                excluded |= self.backplane.where_sunward(target).vals
+
+        # Match the return conventions of Record._construct_excluded_mask()
+        if np.any(excluded):
+            return excluded
+        return False
+
+################################################################################
+# Context class
+################################################################################
+class Context(object):
+    """Class describing the level-independent geometry of a single observation.
+
+    The backplane, the body inventory, and the primary/secondary lookup are 
+    computed once here and shared by the records for all processing levels.
+    """
+
+    #===========================================================================
+    def __init__(self, observation, volume_id, meshgrids, occlusion=False):
+        """Constructor for a geometry context.
 
         Args:
             observation (oops.Observation): OOPS Observation object.
             volume_id (str): Volume ID.
             meshgrids (dict): All meshgrids associated with this host.
-            level (str, optional): Processing level: 'summary' or 'detailed'.
+            occlusion (bool, optional): 
+                If True, excluded masks are derived from a single occlusion 
+                stage for all bodies rather than per-target backplane 
+                calculations.
         """
         self.observation = observation
 
@@ -140,26 +721,13 @@ class Record(object):
         sclk = observation.dict["SPACECRAFT_CLOCK_START_COUNT"] + '' 
         self.primary, self.secondaries = \
             util.get_primary(DEFAULT_BODIES_TABLE, sclk, config.SCLK_BASES)
-        self.level = level
-
-        # Level-specific column dictionaries
-        self.dicts = {'sky' : col.SKY_COLUMNS}
-        if level == 'summary':
-            self.dicts |= {
-                'sun'    : col.SUN_SUMMARY_COLUMNS,
-                'ring'   : col.RING_SUMMARY_DICT,
-                'body'   : col.BODY_SUMMARY_DICT,
-            }
-        else:
-            self.dicts |= {
-                'sun'    : col.SUN_DETAILED_COLUMNS,
-                'ring'   : col.RING_SUMMARY_DETAILED,
-                'body'   : col.BODY_SUMMARY_DETAILED
-            }
 
         # Set up planet-based geometry
         self.bodies = []
         self.blocker = None
+        self.rings_present = False
+        self.ring_tile_dict = None
+        self.body_tile_dict = None
 
         if self.primary:
             self.rings_present = col.BODIES[self.primary].ring_frame is not None    
@@ -172,19 +740,21 @@ class Record(object):
             self.target = defs.TRANSLATIONS[self.target]
 
         # Create the record prefix
-        filespec = observation.dict["FILE_SPECIFICATION_NAME"]
-        self.prefixes = ['"' + volume_id + '"',
-                         '"%-32s"' % filespec.replace(".IMG", ".LBL")]
+        self.prefixes = Context.get_prefixes(observation, volume_id)
         
         # Create the backplane
         meshgrid = self._meshgrid(observation, meshgrids)
         self.backplane = oops.backplane.Backplane(observation, meshgrid)
         
         # Build body list
-        body_names = col.BODIES.keys()
+        body_names = list(col.BODIES.keys())
         if self.target not in col.BODIES and oops.Body.exists(self.target):
             body_names += [self.target]
 
+        # Eliminate bodies that cannot be in the FOV
+        if body_names:
+            body_names = self._prefilter(observation, body_names, expand=config.EXPAND)
+
         # Inventory the bodies in the FOV
         if body_names:
             body_names = self.observation.inventory(body_names, expand=config.EXPAND, cache=False)
@@ -199,11 +769,87 @@ class Record(object):
             if self.target in self.bodies:
                 self.blocker = self.target
 
-            # Add a targeted irregular moon to the dictionaries if present
-            if self.target in self.bodies and self.target not in self.dicts['body'].keys():
-                self.dicts['body'][self.target] = util.replace(col.BODY_SUMMARY_COLUMNS,
-                                                         defs.BODYX, self.target)
-                self.body_tile_dict[self.target] = util.replace(col.BODY_TILES, col.BODYX, self.target)
+                # Add a targeted irregular moon to the tile dictionary if needed
+                if self.target not in self.body_tile_dict.keys():
+                    self.body_tile_dict[self.target] = \
+                        util.replace(col.BODY_TILES, col.BODYX, self.target)
+
+        # Set up the excluded-mask cache
+        self.occlusion = None
+        if occlusion:
+            self.occlusion = Occlusion(self.backplane, self.primary, 
+                                       bodies=self.bodies, blocker=self.blocker)
+        self.mask_cache = MaskCache(self.backplane, self.primary, 
+                                    occlusion=self.occlusion)
+
+    #===============================================================================
+    @staticmethod
+    def get_prefixes(observation, volume_id):
+        """Prefix columns identifying the rows for an observation.
+
+        Args:
+            observation (oops.Observation): Observation.
+            volume_id (str): Volume ID.
+
+        Returns:
+            list: Formatted volume ID and file specification.
+        """
+        filespec = observation.dict["FILE_SPECIFICATION_NAME"]
+        return ['"' + volume_id + '"',
+                '"%-32s"' % filespec.replace(".IMG", ".LBL")]
+
+    #===============================================================================
+    @staticmethod
+    def _prefilter(observation, body_names, expand=0.):
+        """Eliminate bodies whose disks cannot touch the field of view.
+
+        Body positions are computed geometrically for all candidates in one
+        batched call at the observation midtime.  A body survives if the angle
+        between its center and the FOV center does not exceed the angular radius
+        of the FOV plus that of the body, the expansion, and PREFILTER_MARGIN.
+
+        Args: 
+            observation (oops.Observation): OOPS Observation object.
+            body_names (list): Names of the candidate bodies.
+            expand (float, optional): Angle in radians by which to expand the FOV.
+
+        Returns: 
+            list: Names of the surviving bodies, in the original order.
+        """
+        logger = meta.get_logger()
+
+        bodies = [oops.Body.lookup(name) for name in body_names]
+
+        # Body positions in the camera frame
+        time = (observation.time[0] + observation.time[1]) / 2.
+        multipath = oops.path.MultiPath([body.path for body in bodies],
+                                        origin=observation.path, 
+                                        frame=observation.frame)
+        pos = multipath.event_at_time(time).pos.vals
+        ranges = np.sqrt(np.sum(pos**2, axis=-1))
+        radii = np.array([body.radius for body in bodies])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            radius_angles = np.arcsin(np.minimum(radii / ranges, 1.))
+            centers = pos / ranges[:, np.newaxis]
+
+        # Angular radius of the FOV about its center
+        fov = observation.fov
+        (nu, nv) = fov.uv_shape.vals
+        center = fov.los_from_uv(oops.Pair((nu/2., nv/2.))).unit().vals
+        corners = fov.los_from_uv(oops.Pair([(0., 0.), (nu, 0.), 
+                                             (0., nv), (nu, nv)])).unit().vals
+        fov_angle = np.max(np.arccos(np.clip(corners @ center, -1., 1.)))
+
+        # Keep bodies that may overlap the FOV, or that surround the observer
+        angles = np.arccos(np.clip(centers @ center, -1., 1.))
+        keep = (angles <= fov_angle + radius_angles + expand + PREFILTER_MARGIN) | \
+               np.logical_not(ranges > radii)
+
+        survivors = [name for (name, k) in zip(body_names, keep) if k]
+        logger.info('Inventory prefilter eliminated %d of %d bodies' % 
+                    (len(body_names) - len(survivors), len(body_names)))
+
+        return survivors
 
     #===============================================================================
     def _meshgrid(self, observation, meshgrids):
@@ -218,6 +864,60 @@ class Record(object):
         """
         return config.meshgrid(meshgrids, observation)
 
+################################################################################
+# Record class
+################################################################################
+class Record(object):
+    """Class describing a single geometry record, i.e., a single row in a table.
+
+    A record is a level-specific view on a shared Context.
+    """
+
+    #===========================================================================
+    def __init__(self, context, level):
+        """Constructor for a geometry record.
+
+        Args:
+            context (Context): Geometry context for the observation.
+            level (str, optional): Processing level: 'summary' or 'detailed'.
+        """
+        self.context = context
+        self.level = level
+
+        # Shared geometry
+        self.observation = context.observation
+        self.primary = context.primary
+        self.secondaries = context.secondaries
+        self.target = context.target
+        self.prefixes = context.prefixes
+        self.backplane = context.backplane
+        self.mask_cache = context.mask_cache
+        self.bodies = context.bodies
+        self.blocker = context.blocker
+        self.rings_present = context.rings_present
+        self.ring_tile_dict = context.ring_tile_dict
+        self.body_tile_dict = context.body_tile_dict
+
+        # Level-specific column dictionaries
+        self.dicts = {'sky' : col.SKY_COLUMNS}
+        if level == 'summary':
+            self.dicts |= {
+                'sun'    : col.SUN_SUMMARY_COLUMNS,
+                'ring'   : col.RING_SUMMARY_DICT,
+                'body'   : col.BODY_SUMMARY_DICT,
+            }
+        else:
+            self.dicts |= {
+                'sun'    : col.SUN_DETAILED_COLUMNS,
+                'ring'   : col.RING_SUMMARY_DETAILED,
+                'body'   : col.BODY_SUMMARY_DETAILED
+            }
+
+        # Add a targeted irregular moon to the dictionaries if present
+        if self.blocker and self.target not in self.dicts['body'].keys():
+            self.dicts['body'][self.target] = util.replace(col.BODY_SUMMARY_COLUMNS,
+                                                     defs.BODYX, self.target)
+
     #===============================================================================
     def add(self, qualifier, *,
                   name=None,target=None, tiles=[], tiling_min=100,
@@ -267,6 +967,10 @@ class Record(object):
                 necessary.
             no_mask (bool, optional): True to suppress the use of a mask.
             no_body (bool, optional): True to suppress body prefixes.
+
+        Returns:
+            tuple: (formats, rows), where formats is the list of column formats
+                   and rows is the list of rows returned by _prep_row().
         """
     
         # Get the column decsriptions
@@ -279,18 +983,11 @@ class Record(object):
                                 primary=self.primary, target=target,
                                 tiles=tiles, tiling_min=tiling_min, ignore_shadows=ignore_shadows,
                                 start_index=start_index, allow_zero_rows=allow_zero_rows, no_mask=no_mask, 
-                                no_body=no_body)
+                                no_body=no_body, mask_cache=self.mask_cache)
 
-        # Append the complete rows to the output
-        lines = []
-        for row in rows:
-            line = row[0]
-            for column in row[1:]:
-                line += ','
-                line += column
-            lines.append(line)
-
-        return lines
+        # Return the rows with their column formats
+        formats = [Record._column_format(column_desc) for column_desc in column_descs]
+        return (formats, rows)
     
     #===============================================================================
     @staticmethod
@@ -298,12 +995,13 @@ class Record(object):
                   primary=None, target=None, name_length=defs.NAME_LENGTH,
                   tiles=[], tiling_min=100, ignore_shadows=False,
                   start_index=1, allow_zero_rows=False, no_mask=False, 
-                  no_body=False):
-        """Generates the geometry and returns a list of lists of strings. The inner
-        list contains string representations for each column in one row of the
-        output file. These will be concatenated with commas between them and written
-        to the file. The outer list contains one list for each output row. The
-        number of output rows can be zero or more.
+                  no_body=False, mask_cache=None):
+        """Generates the geometry and returns a list of rows. Each row is a tuple
+        (prefix_columns, data_columns), where prefix_columns is a list of the
+        string prefixes for the row, and data_columns contains the numeric 
+        results for each column, as returned by _column_results(). The results are
+        formatted when the table is written. The number of output rows can be 
+        zero or more.
 
         The tiles argument supports detailed listings where a geometric region is
         broken down into separate subregions. If the tiles argument is empty (which
@@ -356,9 +1054,13 @@ class Record(object):
                 necessary.
             no_mask (bool, optional): True to suppress the use of a mask.
             no_body (bool, optional): True to suppress body prefixes.
+            mask_cache (MaskCache, optional): 
+                Cache of excluded masks shared across calls for this
+                observation.  If None, masks are constructed for this call
+                only.
 
         Returns:
-           list: String comprising the resulting rows.
+           list: Tuples (prefix_columns, data_columns) for the resulting rows.
         """
 
         # Handle option for multiple tile sets
@@ -367,9 +1069,13 @@ class Record(object):
             local_index = start_index
             for tile in tiles:
                 new_rows = Record._prep_row(prefixes, backplane, blocker, column_descs,
-                                            primary, target, name_length,
-                                            tile, tiling_min, ignore_shadows,
-                                            local_index, allow_zero_rows=True)
+                                            primary=primary, target=target, 
+                                            name_length=name_length,
+                                            tiles=tile, tiling_min=tiling_min, 
+                                            ignore_shadows=ignore_shadows,
+                                            start_index=local_index, 
+                                            allow_zero_rows=True, no_mask=no_mask, 
+                                            no_body=no_body, mask_cache=mask_cache)
                 rows += new_rows
                 local_index += len(tile) - 1
 
@@ -377,9 +1083,13 @@ class Record(object):
                 return rows
 
             return Record._prep_row(prefixes, backplane, blocker, column_descs,
-                                    primary, target, name_length,
-                                    [], tiling_min, ignore_shadows,
-                                    start_index, allow_zero_rows=False)
+                                    primary=primary, target=target, 
+                                    name_length=name_length,
+                                    tiles=[], tiling_min=tiling_min, 
+                                    ignore_shadows=ignore_shadows,
+                                    start_index=start_index, allow_zero_rows=False, 
+                                    no_mask=no_mask, no_body=no_body, 
+                                    mask_cache=mask_cache)
 
         # Handle a single set of tiles
         if tiles:
@@ -409,18 +1119,33 @@ class Record(object):
                 key = (mask_target,) + mask_desc
                 if key in excluded_mask_dict: continue
 
-                excluded_mask_dict[key] = \
-                    Record._construct_excluded_mask(
+                if mask_cache is not None:
+                    excluded_mask_dict[key] = \
+                        mask_cache.get(mask_target, mask_desc,
+                                       blocker=blocker, ignore_shadows=ignore_shadows)
+                else:
+                    excluded_mask_dict[key] = \
+                        Record._construct_excluded_mask(
                                 backplane, mask_target, primary, mask_desc,
                                 blocker=blocker, ignore_shadows=ignore_shadows)
-        # Initialize the list of rows
-
         # Interpret the subregion list
         if tiles:
             indices = range(1,len(tiles))
         else:
             indices = [0]
 
+        # Reduce each column over all tiles at once if the tiles are disjoint
+        segmented = {}
+        if tiles and excluded_mask_dict != {}:
+            labels = Record._label_tiles(subregion_masks)
+            if labels is not None:
+                for (i, column_desc) in enumerate(column_descs):
+                    results = Record._segmented_results(backplane, column_desc, 
+                                                        labels, len(tiles) - 1, 
+                                                        excluded_mask_dict)
+                    if results is not None:
+                        segmented[i] = results
+
         # For each subregion...
         for indx in indices:
 
@@ -445,9 +1170,18 @@ class Record(object):
             nothing_found = True
 
             # For each column...
-            for column_desc in column_descs:
+            for (i, column_desc) in enumerate(column_descs):
                 event_key = column_desc[0]
                 mask_desc = column_desc[1]
+                format = Record._column_format(column_desc)
+
+                # Use the segmented reduction if available
+                if i in segmented:
+                    (results, found) = segmented[i][indx]
+                    if found:
+                        nothing_found = False
+                    data_columns.append(results)
+                    continue
 
                 # Fill in the backplane array
                 if event_key[1] == defs.NULL:
@@ -457,8 +1191,7 @@ class Record(object):
 
                 # Make a shallow copy and apply the new masks
                 if excluded_mask_dict != {}:
-                    target = event_key[1]
-                    excluded = excluded_mask_dict[(target,) + mask_desc]
+                    excluded = excluded_mask_dict[(event_key[1],) + mask_desc]
                     values = values.mask_where(excluded)
                     if len(subregion_masks) > 1:
                         values = values.mask_where(subregion_masks[indx])
@@ -468,27 +1201,147 @@ class Record(object):
                 if not np.all(values.mask):
                     nothing_found = False
 
-                # Write the column using the specified format
-                if len(column_desc) > 2:
-                    format = ALT_FORMAT_DICT[(event_key[0], column_desc[2])]
-                else:
-                    format = FORMAT_DICT[event_key[0]]
-
-                data_columns.append(Record._formatted_column(values, format))
+                # Save the numeric results for this column
+                data_columns.append(Record._column_results(values, format))
 
             # Save the row if it was completed
             if len(data_columns) < len(column_descs): continue # hopeless error
             if nothing_found and (indx > 0 or allow_zero_rows): continue
-            rows.append(prefix_columns + data_columns)
+            rows.append((prefix_columns, data_columns))
 
         # Return something if we can
         if rows or allow_zero_rows:
             return rows
 
         return Record._prep_row(prefixes, backplane, blocker, column_descs,
-                                primary, target, name_length,
-                                [], 0, ignore_shadows, start_index,
-                                allow_zero_rows=False)
+                                primary=primary, target=target, 
+                                name_length=name_length,
+                                tiles=[], tiling_min=0, 
+                                ignore_shadows=ignore_shadows, 
+                                start_index=start_index, allow_zero_rows=False, 
+                                no_mask=no_mask, no_body=no_body, 
+                                mask_cache=mask_cache)
+
+    #===============================================================================
+    @staticmethod
+    def _column_format(column_desc):
+        """Look up the format for a column.
+
+        Args:
+            column_desc (tuple): Column description.
+
+        Returns:
+            tuple: Column format; see _formatted_column().
+        """
+        event_key = column_desc[0]
+        if len(column_desc) > 2:
+            return ALT_FORMAT_DICT[(event_key[0], column_desc[2])]
+        return FORMAT_DICT[event_key[0]]
+
+    #===============================================================================
+    @staticmethod
+    def _label_tiles(subregion_masks):
+        """Combine the tile masks into a single label raster.
+
+        Args:
+            subregion_masks (list): 
+                Boolean masks, True where excluded; the first is the global 
+                mask and the rest are the individual tiles.
+
+        Returns:
+            numpy.array: 
+                Integer raster containing the index of the tile that includes
+                each pixel, or 0 for no tile; None if the tiles overlap.
+        """
+        labels = np.zeros(np.shape(subregion_masks[0]), dtype='int')
+        for (indx, mask) in enumerate(subregion_masks[1:], start=1):
+            included = np.logical_not(mask)
+            if np.any(labels[included]):
+                return None
+            labels[included] = indx
+
+        return labels
+
+    #===============================================================================
+    @staticmethod
+    def _segmented_results(backplane, column_desc, labels, nlabels, 
+                           excluded_mask_dict):
+        """Returns the numeric value(s) of one column for every tile at once.
+
+        Each column is reduced once over the label raster rather than once per
+        tile.  The results are identical to those of _column_results() applied
+        to each tile separately.
+
+        Args:
+            backplane (oops.Backplane): Backplane for the observation.
+            column_desc (tuple): Column description.
+            labels (numpy.array): Label raster from _label_tiles().
+            nlabels (int): Number of tiles.
+            excluded_mask_dict (dict): Excluded masks keyed by (target,) + mask_desc.
+
+        Returns:
+            list: 
+                Tuples (results, found) indexed by tile, where found is True if
+                the tile contains any unmasked values; None if this column 
+                cannot be reduced this way.
+        """
+        event_key = column_desc[0]
+        mask_desc = column_desc[1]
+        (flag, number_of_values, column_width,
+        standard_format, overflow_format, null_value) = Record._column_format(column_desc)
+
+        # Mean values are left to the per-tile calculation
+        if number_of_values != 2 or event_key[1] == defs.NULL:
+            return None
+
+        values = backplane.evaluate(event_key)
+        if values.shape != labels.shape:
+            return None
+
+        # Convert from radians to degrees if necessary
+        if flag in ("DEG","360","-180"):
+            values = values * oops.DPR
+
+        # Locate the unmasked pixels in each tile
+        excluded = excluded_mask_dict[(event_key[1],) + mask_desc]
+        masked = values.mask | np.broadcast_to(excluded, labels.shape)
+        valid = np.logical_not(masked) & (labels > 0)
+
+        vals = values.vals[valid]
+        tile = labels[valid]
+        counts = np.bincount(tile, minlength=nlabels+1)
+        found = counts > 0
+
+        # Mod-360 ranges are taken over all values, as in _get_range_mod360()
+        if flag in ("360", "-180"):
+            if np.any(found):
+                alt_format = flag if flag == "-180" else None
+                range_mod360 = util._get_range_mod360(values, alt_format=alt_format)
+            mins = maxs = None
+
+        # Otherwise, reduce each tile's contiguous segment of sorted values
+        else:
+            order = np.argsort(tile, kind='stable')
+            vals = vals[order]
+            starts = np.cumsum(counts) - counts
+            mins = np.empty(nlabels+1)
+            maxs = np.empty(nlabels+1)
+            if np.any(found):
+                mins[found] = np.minimum.reduceat(vals, starts[found])
+                maxs[found] = np.maximum.reduceat(vals, starts[found])
+
+        # Assemble the results for each tile
+        segmented = []
+        for indx in range(nlabels+1):
+            if not found[indx]:
+                results = [null_value, null_value]
+            elif mins is None:
+                results = range_mod360
+            else:
+                results = [float(mins[indx]), float(maxs[indx])]
+            segmented.append((results, bool(found[indx])))
+
+        return segmented
 
     #===============================================================================
     @staticmethod
@@ -638,6 +1491,21 @@ class Record(object):
         Returns:
             str: Formatted column.
         """
+        return Record._format_results(Record._column_results(values, format), format)
+
+    #===============================================================================
+    @staticmethod
+    def _column_results(values, format):
+        """Returns the numeric value(s) for one column.
+
+        Args:
+            values (oops.Scalar): A Scalar of values with its applied mask.
+            format (tuple): Column format; see _formatted_column().
+
+        Returns:
+            list: The mean value or the minimum and maximum values, with null
+                  values where undefined.
+        """
 
         # Interpret the format
         (flag, number_of_values, column_width,
@@ -667,6 +1535,25 @@ class Record(object):
         else:
             results = [values.min().as_builtin(), values.max().as_builtin()]
 
+        return results
+
+    #===============================================================================
+    @staticmethod
+    def _format_results(results, format):
+        """Returns the formatted value(s) for one column as a string.
+
+        Args:
+            results (list): Values returned by _column_results().
+            format (tuple): Column format; see _formatted_column().
+
+        Returns:
+            str: Formatted column.
+        """
+
+        # Interpret the format
+        (flag, number_of_values, column_width,
+        standard_format, overflow_format, null_value) = format
+
         # Convert results to ISO
         if flag in ("ISO","iso"):
             if not isinstance(results[0], str):
@@ -711,6 +1598,314 @@ class Record(object):
 
         return ",".join(strings)
 
+################################################################################
+# GeometryTable class
+################################################################################
+class GeometryTable(meta.Table):
+    """Class describing a table of geometry rows.
+
+    Rows are stored as their string prefixes and the raw numeric results for
+    each column, in typed NumPy arrays.  All formatting is done when the table
+    is written, vectorized across rows.
+
+    Rows are grouped into blocks of consecutive rows sharing the same column
+    formats.  Each block is a dictionary containing:
+        "formats":  Format tuple for each value column; see 
+                    Record._formatted_column().
+        "prefixes": Prefix string for each row.
+        "values":   Float array (rows, value columns) of the numeric results.
+        "nulls":    Boolean array (rows, value columns), True where the result 
+                    is a string null value.
+        "count":    Number of rows in use.
+
+    Rows taken verbatim from an existing table are kept in blocks whose 
+    "formats" entry is None and whose "lines" entry holds the formatted rows.
+    """
+
+    #===========================================================================
+    def __init__(self, output_dir=None, **kwargs):
+        """Constructor for a GeometryTable object.
+
+        Args:
+            output_dir (str, Path, or FCPath): 
+                Directory in which to write the geometry files.
+            **kwargs: Keyword arguments passed to the Table constructor.
+        """
+        super().__init__(output_dir, **kwargs)
+        self.blocks = []
+
+    #===============================================================================
+    def add_rows(self, formats, rows):
+        """Add the rows returned by Record.add().
+
+        Args:
+            formats (list): Format tuple for each column.
+            rows (list): Tuples (prefix_columns, data_columns).
+
+        Returns:
+            None.
+        """
+        for (prefix_columns, data_columns) in rows:
+            value_formats = []
+            numbers = []
+            for (format, results) in zip(formats, data_columns):
+                value_formats += [format] * len(results)
+                numbers += results
+            block = self._get_block(tuple(value_formats))
+
+            # Grow the arrays as needed
+            count = block['count']
+            if count == len(block['values']):
+                block['values'] = np.resize(block['values'], 
+                                            (2*count, len(value_formats)))
+                block['nulls'] = np.resize(block['nulls'], 
+                                           (2*count, len(value_formats)))
+
+            # Save the row
+            for (j, number) in enumerate(numbers):
+                null = isinstance(number, str)
+                block['nulls'][count, j] = null
+                block['values'][count, j] = np.nan if null else np.ravel(number)[0]
+            block['prefixes'].append(','.join(prefix_columns))
+            block['count'] = count + 1
+
+    #===============================================================================
+    def _get_block(self, formats):
+        """Return the block for a new row with the given formats.
+
+        Args:
+            formats (tuple): Format tuple for each value column.
+
+        Returns:
+            dict: The last block if its formats match; otherwise a new block.
+        """
+        if self.blocks and self.blocks[-1]['formats'] == formats:
+            return self.blocks[-1]
+
+        block = {'formats' : formats,
+                 'prefixes': [],
+                 'values'  : np.empty((16, len(formats)), dtype='float'),
+                 'nulls'   : np.zeros((16, len(formats)), dtype='bool'),
+                 'count'   : 0}
+        self.blocks.append(block)
+        return block
+
+    #===============================================================================
+    def take_rows(self):
+        """Remove and return the rows accumulated so far.
+
+        Returns:
+            list: Blocks accumulated since the last call.
+        """
+        blocks = self.blocks
+        self.blocks = []
+        for block in blocks:
+            if block['formats'] is None:
+                continue
+            count = block['count']
+            block['values'] = block['values'][:count]
+            block['nulls'] = block['nulls'][:count]
+        return blocks
+
+    #===============================================================================
+    def extend_rows(self, blocks):
+        """Append rows previously returned by take_rows() or parse_rows().
+
+        Args:
+            blocks (list): Blocks to append.
+
+        Returns:
+            None.
+        """
+        for block in blocks:
+            last = self.blocks[-1] if self.blocks else None
+            if last is None or last['formats'] != block['formats']:
+                self.blocks.append(block)
+                continue
+
+            # Merge formatted lines
+            if block['formats'] is None:
+                last['lines'] += block['lines']
+                last['count'] += block['count']
+                continue
+
+            # Grow the arrays as needed
+            count = last['count']
+            new_count = count + block['count']
+            if new_count > len(last['values']):
+                size = max(new_count, 2*count)
+                last['values'] = np.resize(last['values'], 
+                                           (size, len(block['formats'])))
+                last['nulls'] = np.resize(last['nulls'], 
+                                          (size, len(block['formats'])))
+
+            # Merge the rows
+            last['values'][count:new_count] = block['values'][:block['count']]
+            last['nulls'][count:new_count] = block['nulls'][:block['count']]
+            last['prefixes'] += block['prefixes']
+            last['count'] = new_count
+
+    #===============================================================================
+    def parse_rows(self, lines):
+        """Convert lines read from an existing table to rows for extend_rows().
+
+        Args:
+            lines (list): Formatted lines, with no terminators.
+
+        Returns:
+            list: Blocks.
+        """
+        if not lines:
+            return []
+        return [{'formats': None, 'lines': list(lines), 'count': len(lines)}]
+
+    #===============================================================================
+    def format_rows(self):
+        """Format all rows.
+
+        Rows containing a value that cannot be formatted within its column 
+        width are logged and omitted.
+
+        Returns:
+            list: Formatted rows.
+        """
+        logger = meta.get_logger()
+
+        lines = []
+        for block in self.blocks:
+            count = block['count']
+            if count == 0:
+                continue
+
+            # Formatted lines are written as they are
+            if block['formats'] is None:
+                lines += block['lines']
+                continue
+
+            rows = np.array(block['prefixes'], dtype='object')
+            failed = np.zeros(count, dtype='bool')
+            for (j, format) in enumerate(block['formats']):
+                (strings, errors) = \
+                    GeometryTable._format_values(block['values'][:count, j], 
+                                                 block['nulls'][:count, j], format)
+                for (i, message) in errors.items():
+                    logger.warn('%s: %s' % (block['prefixes'][i], message))
+                    failed[i] = True
+                rows = rows + ',' + strings
+
+            lines += list(rows[np.logical_not(failed)])
+
+        return lines
+
+    #===============================================================================
+    def flush(self):
+        """In streaming mode, format and write the accumulated rows and release
+        them.
+
+        Returns:
+            None.
+        """
+        if not self.stream:
+            return
+
+        lines = self.format_rows()
+        self.blocks = []
+        self._append(lines)
+
+    #===============================================================================
+    @staticmethod
+    def _format_values(values, nulls, format):
+        """Format one value column for all rows.
+
+        Args:
+            values (np.ndarray): Numeric results.
+            nulls (np.ndarray): True where the result is a string null value.
+            format (tuple): Column format; see Record._formatted_column().
+
+        Returns:
+            tuple: (strings, errors), where strings is an object array of the
+                   formatted values, and errors is a dictionary of error 
+                   messages keyed by row index.
+        """
+        (flag, number_of_values, column_width,
+        standard_format, overflow_format, null_value) = format
+
+        errors = {}
+        strings = np.empty(len(values), dtype='object')
+
+        # Convert results to ISO
+        if flag in ("ISO","iso"):
+            strings[nulls] = standard_format % null_value
+            valid = np.logical_not(nulls)
+            if np.any(valid):
+                isos = julian.iso_from_tai(values[valid], digits=3)
+                strings[valid] = [standard_format % ('"'+str(iso)+'"') for iso in isos]
+            return (strings, errors)
+
+        # String nulls are written as such
+        if np.any(nulls):
+            strings[nulls] = standard_format % null_value
+        numeric = np.logical_not(nulls)
+        values = values[numeric]
+
+        # Replace NaN and infinity by the null value
+        if np.any(np.isnan(values)):
+            warnings.warn("NaN encountered")
+        if np.any(np.isinf(values)):
+            warnings.warn("infinity encountered")
+        values = np.where(np.isfinite(values), values, null_value)
+
+        # Write the formatted values
+        formatted = np.char.mod(standard_format, values).astype('object')
+
+        # Handle overflows
+        overflow = np.nonzero(np.char.str_len(formatted.astype('str')) > column_width)[0]
+        if len(overflow):
+            if overflow_format is None:
+                for i in overflow:
+                    errors[i] = "column overflow: " + formatted[i]
+            else:
+                alt = np.char.mod(overflow_format, values[overflow])
+                still = np.char.str_len(alt) > column_width
+                clipped = np.clip(values[overflow], -9.99e99, 9.99e99)
+                alt99 = np.char.mod(overflow_format, clipped)
+
+                for (k, i) in enumerate(overflow):
+                    string = alt[k]
+                    if still[k]:
+                        if len(alt99[k]) > column_width:
+                            errors[i] = "column overflow: " + string
+                        else:
+                            warnings.warn("column overflow: " + string +
+                                          " clipped to " + alt99[k])
+                            string = alt99[k]
+                        string = string[:column_width]
+                    formatted[i] = str(string)
+
+        strings[numeric] = formatted
+
+        # Map the error indices back to all rows
+        if errors:
+            rows = np.nonzero(numeric)[0]
+            errors = {rows[i]: message for (i, message) in errors.items()}
+
+        return (strings, errors)
+
+    #===============================================================================
+    def write(self, labels_only=False):
+        """Format and write the table and its label.
+
+        Args:
+            labels_only (bool, optional): 
+                If True, labels are generated for any existing geometry tables.
+
+        Returns:
+            None.
+        """
+        if not labels_only and not self.stream:
+            self.rows = self.format_rows()
+        super().write(labels_only=labels_only)
+
 ################################################################################
 # InventoryTable class
 ################################################################################
@@ -749,7 +1944,7 @@ class InventoryTable(meta.Table):
 ################################################################################
 """Class describing a sky geometry table.
 """
-class SkyTable(meta.Table):
+class SkyTable(GeometryTable):
     #===========================================================================
     def __init__(self, output_dir=None, **kwargs):
         """Constructor for a SkyTable object.
@@ -772,14 +1967,14 @@ class SkyTable(meta.Table):
         Returns:
             None.
         """
-        self.rows += record.add(self.qualifier, no_body=True)
+        self.add_rows(*record.add(self.qualifier, no_body=True))
 
 ################################################################################
 # SunTable class
 ################################################################################
 """Class describing a sun geometry table.
 """
-class SunTable(meta.Table):
+class SunTable(GeometryTable):
     #===========================================================================
     def __init__(self, output_dir=None, **kwargs):
         """Constructor for a SunTable object.
@@ -800,14 +1995,14 @@ class SunTable(meta.Table):
         Returns:
             None.
         """
-        self.rows += record.add(self.qualifier)#, no_body=True)###########
+        self.add_rows(*record.add(self.qualifier))#, no_body=True)###########
 
 ################################################################################
 # RingTable class
 ################################################################################
 """Class describing a ring geometry table.
 """
-class RingTable(meta.Table):
+class RingTable(GeometryTable):
     #===========================================================================
     def __init__(self, output_dir=None, **kwargs):
         """Constructor for a RingTable object.
@@ -832,7 +2027,7 @@ class RingTable(meta.Table):
         # Add record
         if record.primary:
             if record.rings_present:
-                self.rows += record.add(self.qualifier, name=record.primary)
+                self.add_rows(*record.add(self.qualifier, name=record.primary))
 
 #        # Add other rings
 #        for name in record.bodies
@@ -845,7 +2040,7 @@ class RingTable(meta.Table):
 ################################################################################
 """Class describing a body geometry table.
 """
-class BodyTable(meta.Table):
+class BodyTable(GeometryTable):
     #===========================================================================
     def __init__(self, output_dir=None, **kwargs):
         """Constructor for a BodyTable object.
@@ -854,28 +2049,250 @@ class BodyTable(meta.Table):
             output_dir (str, Path, or FCPath): 
                 Directory in which to write the geometry files.
         """
-        super().__init__(output_dir, qualifier='body', **kwargs)
+        super().__init__(output_dir, qualifier='body', **kwargs)
+
+    #===============================================================================
+    def add(self, record):
+        """Add a Body row.
+
+        Args:
+            record (Record): Record describing the row to add.
+
+        Returns:
+            None.
+        """
+
+        # Add primary body
+        if record.primary:
+            self.add_rows(*record.add(self.qualifier, name=record.primary, target=record.primary))
+
+        # Add other bodies
+        for name in record.bodies:
+            if name != record.primary:
+                self.add_rows(*record.add(self.qualifier, name=name, target=name))
+
+
+################################################################################
+# Journal class
+################################################################################
+class Journal(object):
+    """Class describing a crash-safe journal of the completed observations for
+    a single volume.
+
+    The journal is an append-only local file of pickled records.  The first 
+    record is a header identifying the run; each subsequent record contains the
+    rows added to each table for one observation.  Each record is flushed to 
+    disk as it is written, so at most the observation in progress is lost if 
+    the process dies.  A truncated final record is ignored.
+    """
+
+    #===========================================================================
+    def __init__(self, output_dir, volume_id, header):
+        """Constructor for a Journal object.
+
+        Args:
+            output_dir (str, Path, or FCPath): 
+                Directory in which the geometry files are written.  If local, 
+                the journal is kept there; otherwise it is kept in JOURNAL_DIR.
+            volume_id (str): Volume ID.
+            header (dict): 
+                Parameters identifying the run; a journal with a different
+                header is not resumed.
+        """
+        output_dir = FCPath(output_dir)
+        name = volume_id + '_journal.pickle'
+        if output_dir.is_local():
+            self.path = Path(output_dir.get_local_path()) / name
+        else:
+            digest = hashlib.sha1(output_dir.as_posix().encode()).hexdigest()
+            self.path = JOURNAL_DIR / (digest[:12] + '_' + name)
+
+        self.header = header
+        self.file = None
+
+    #===============================================================================
+    def read(self):
+        """Read the completed records.
+
+        Returns:
+            list: 
+                Records (index, processed, rows) for each completed observation,
+                or an empty list if there is no journal for this run.
+        """
+        logger = meta.get_logger()
+
+        if not self.path.exists():
+            return []
+
+        records = []
+        with open(self.path, 'rb') as f:
+            try:
+                if pickle.load(f) != self.header:
+                    logger.warn('Journal does not match this run; ignored', self.path)
+                    return []
+                while True:
+                    records.append(pickle.load(f))
+            except (EOFError, pickle.UnpicklingError):
+                pass
+
+        return records
+
+    #===============================================================================
+    def open(self, records=[]):
+        """Start the journal, retaining the given records.
+
+        Args:
+            records (list, optional): Records to retain from a previous run.
+
+        Returns:
+            None.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.path, 'wb')
+        pickle.dump(self.header, self.file)
+        for record in records:
+            pickle.dump(record, self.file)
+        self._flush()
+
+    #===============================================================================
+    def append(self, record):
+        """Append a record for one observation.
+
+        Args:
+            record (tuple): (index, processed, rows).
+
+        Returns:
+            None.
+        """
+        pickle.dump(record, self.file)
+        self._flush()
+
+    #===============================================================================
+    def _flush(self):
+        """Flush the journal to disk."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    #===============================================================================
+    def remove(self):
+        """Close and delete the journal.
+
+        Returns:
+            None.
+        """
+        if self.file:
+            self.file.close()
+            self.file = None
+        self.path.unlink(missing_ok=True)
+
+################################################################################
+# Manifest class
+################################################################################
+class Manifest(object):
+    """Class describing the manifest of inputs to the tables for a single 
+    volume.
+
+    The manifest is a JSON file written alongside the tables when they are 
+    generated incrementally.  It records a digest of the inputs common to all
+    observations, i.e., the loaded SPICE kernels, the column definition files,
+    the column formats, and the processing options, and a digest of the index 
+    row of each observation that was processed successfully.  When the tables
+    are regenerated, observations whose digests are unchanged are taken from 
+    the existing tables rather than recomputed.
+    """
+
+    #===========================================================================
+    def __init__(self, output_dir, volume_id):
+        """Constructor for a Manifest object.
+
+        Args:
+            output_dir (str, Path, or FCPath): 
+                Directory in which the geometry files are written.
+            volume_id (str): Volume ID.
+        """
+        self.path = FCPath(output_dir).joinpath(volume_id + '_manifest.json')
+
+    #===============================================================================
+    def read(self):
+        """Read the manifest.
+
+        Returns:
+            dict: 
+                Dictionary containing the input digest under "inputs" and the
+                observation digests, keyed by basename, under "observations"; 
+                None if there is no valid manifest.
+        """
+        logger = meta.get_logger()
+
+        if not self.path.exists():
+            return None
+
+        try:
+            return json.loads(self.path.read_text())
+        except ValueError:
+            logger.warn('Invalid manifest', self.path)
+            return None
+
+    #===============================================================================
+    def write(self, inputs, observations):
+        """Write the manifest.
+
+        Args:
+            inputs (str): Digest of the inputs common to all observations.
+            observations (dict): Observation digests keyed by basename.
+
+        Returns:
+            None.
+        """
+        logger = meta.get_logger()
+
+        logger.info('Writing manifest', self.path)
+        self.path.write_text(json.dumps({'inputs': inputs, 
+                                         'observations': observations}, indent=2))
 
     #===============================================================================
-    def add(self, record):
-        """Add a Body row.
+    @staticmethod
+    def input_digest(sampling, levels, occlusion):
+        """Digest of the inputs common to all observations.
 
         Args:
-            record (Record): Record describing the row to add.
+            sampling (int): Pixel sampling density.
+            levels (list): Processing levels.
+            occlusion (bool): True if masks are derived from an occlusion stage.
 
         Returns:
-            None.
+            str: Hexadecimal digest.
         """
+        kernels = sorted({os.path.basename(cspyce.kdata(i, 'ALL')[0]) 
+                                            for i in range(cspyce.ktotal('ALL'))})
 
-        # Add primary body
-        if record.primary:
-            self.rows += record.add(self.qualifier, name=record.primary, target=record.primary)
+        # The column definitions are identified by their source files, because
+        # the dictionaries built from them are modified during processing
+        columns = [(path.name, hashlib.sha1(path.read_bytes()).hexdigest())
+                        for path in [Path(col.__file__)] + 
+                                    sorted(defs.COLUMN_DIR.glob('COLUMNS_*.py'))]
 
-        # Add other bodies
-        for name in record.bodies:
-            if name != record.primary:
-                self.rows += record.add(self.qualifier, name=name, target=name)
+        return Manifest._digest((kernels, columns, FORMAT_DICT, ALT_FORMAT_DICT,
+                                 sampling, levels, occlusion))
 
+    #===============================================================================
+    @staticmethod
+    def observation_digest(observation):
+        """Digest of the index row for an observation.
+
+        Args:
+            observation (oops.Observation): Observation.
+
+        Returns:
+            str: Hexadecimal digest.
+        """
+        return Manifest._digest(sorted(observation.dict.items()))
+
+    #===============================================================================
+    @staticmethod
+    def _digest(inputs):
+        """Digest of the representation of an object."""
+        return hashlib.sha1(repr(inputs).encode()).hexdigest()
 
 ################################################################################
 # Suite class
@@ -886,7 +2303,9 @@ class Suite(object):
 
     #===========================================================================
     def __init__(self, input_dir, output_dir,
-                       selection='', glob=None, first=None, sampling=8):
+                       selection='', glob=None, first=None, sampling=8, jobs=1,
+                       occlusion=False, sidecar=False, resume=False, 
+                       incremental=False, stream=False):
         """Constructor for a geometry Suite object.
 
         Args:
@@ -901,6 +2320,23 @@ class Suite(object):
             first (bool, optional): 
                 If given, at most this many files are processed in each volume.
             sampling (int, optional): Pixel sampling density.
+            jobs (int, optional): 
+                Number of worker processes used to process the observations.
+            occlusion (bool, optional): 
+                If True, excluded masks are derived from a single occlusion 
+                stage per observation.
+            sidecar (bool, optional): 
+                If True, a columnar binary sidecar is written with each table.
+            resume (bool, optional): 
+                If True, observations completed by an interrupted run are 
+                restored from its journal rather than reprocessed.
+            incremental (bool, optional): 
+                If True, observations whose inputs are unchanged since the 
+                tables were last written are taken from the existing tables
+                rather than reprocessed.
+            stream (bool, optional): 
+                If True, rows are written to the tables as observations are 
+                completed rather than held until the end.
         """
         logger = meta.get_logger()
 
@@ -909,6 +2345,17 @@ class Suite(object):
         self.output_dir = FCPath(output_dir)
         self.glob = glob
         self.first = first
+        self.jobs = jobs if jobs else 1
+        self.occlusion = occlusion
+        self.sidecar = sidecar
+        self.resume = resume
+        self.incremental = incremental
+        self.stream = stream
+        self.sampling = sampling
+
+        # Excluded-mask cache statistics
+        self.mask_hits = 0
+        self.mask_misses = 0
     
         # Determine processing levels
         self.levels = []
@@ -940,15 +2387,17 @@ class Suite(object):
             logger.error(traceback.format_exc())
 
         # Initialize data tables
+        self.tables = [InventoryTable(output_dir, volume_id=self.volume_id, 
+                                      sidecar=self.sidecar, stream=self.stream)]
         for level in self.levels:
             self.add_tables(output_dir, level)
 
         # Initialize meshgrids
-        self.meshgrids = config.meshgrids(sampling)
+        self.meshgrids = get_meshgrids(sampling)
 
     #===============================================================================
     def add_tables(self, output_dir, level):
-        """Add a set of tables.
+        """Add the set of tables for a processing level.
 
         Args:
             output_dir (str, Path, or FCPath): 
@@ -958,29 +2407,33 @@ class Suite(object):
         Returns:
             None.
         """
-        self.tables = [
-            InventoryTable(output_dir, volume_id=self.volume_id),#, level=level),
-            SkyTable(output_dir, volume_id=self.volume_id, level=level),
-#            SunTable(output_dir, volume_id=self.volume_id, level=level),
-            RingTable(output_dir, volume_id=self.volume_id, level=level),
-            BodyTable(output_dir, volume_id=self.volume_id, level=level)
+        self.tables += [
+            SkyTable(output_dir, volume_id=self.volume_id, level=level, 
+                     sidecar=self.sidecar, stream=self.stream),
+#            SunTable(output_dir, volume_id=self.volume_id, level=level, 
+#                     sidecar=self.sidecar, stream=self.stream),
+            RingTable(output_dir, volume_id=self.volume_id, level=level, 
+                      sidecar=self.sidecar, stream=self.stream),
+            BodyTable(output_dir, volume_id=self.volume_id, level=level, 
+                      sidecar=self.sidecar, stream=self.stream)
             ]
 
     #===============================================================================
     def make_records(self, index):
         """Add a record for each processing level.
 
+        The records share a single geometry context, so the backplane and body
+        inventory are computed only once per observation.
+
         Args:
            index (int): Row index.
 
         Returns:
             list: One record for each processing level.
         """
-        records = []
-        for level in self.levels:
-            records.append(
-                Record(self.observations[index], self.volume_id, self.meshgrids, level))
-        return records
+        context = Context(self.observations[index], self.volume_id, self.meshgrids,
+                          occlusion=self.occlusion)
+        return [Record(context, level) for level in self.levels]
 
     #===============================================================================
     def add(self, records):
@@ -994,8 +2447,14 @@ class Suite(object):
             None.
         """
         for table in self.tables:
+            # Level-independent tables get one row per observation
+            if table.level is None:
+                if records:
+                    table.add(records[0])
+                continue
+
             for record in records:
-                if (record.level == table.level) | (table.level is None):
+                if record.level == table.level:
                     table.add(record)
 
     #===============================================================================
@@ -1012,6 +2471,250 @@ class Suite(object):
         for table in self.tables:
             table.write(labels_only=labels_only)
 
+    #===============================================================================
+    def process(self, index):
+        """Add the rows for a single observation to all tables.
+
+        Errors raised while processing the observation are logged and do not
+        propagate, so a failure affects only this observation.
+
+        Args:
+           index (int): Row index.
+
+        Returns:
+            bool: True if the observation was processed successfully.
+        """
+        logger = meta.get_logger()
+
+        # Print a log of progress
+        logger.info("%s  %s %4d/%4d" %
+                    (self.volume_id, self.observations[index].basename, 
+                     index+1, len(self.observations)))
+
+        # Continue processing even if cspice throws a runtime error
+        try:
+            # Construct the record for this observation
+            records = self.make_records(index)
+
+            # Update the tables
+            self.add(records)
+
+            # Accumulate the mask cache statistics
+            if records:
+                mask_cache = records[0].context.mask_cache
+                logger.debug('Mask cache: %d hits, %d misses' % 
+                             (mask_cache.hits, mask_cache.misses))
+                self.mask_hits += mask_cache.hits
+                self.mask_misses += mask_cache.misses
+            return True
+
+        # A RuntimeError is probably caused by missing spice data. There is
+        # probably nothing we can do.
+        except RuntimeError as e:
+            logger.warn(str(e))
+
+        # Other kinds of errors are genuine bugs. For now, we just log the
+        # problem, and jump over the image; we can deal with it later.
+        except (AssertionError, AttributeError, IndexError, KeyError,
+                LookupError, TypeError, ValueError):
+            logger.error(traceback.format_exc())
+
+        return False
+
+    #===============================================================================
+    def _create_parallel(self, indices, count=0):
+        """Process the observations using a pool of worker processes.
+
+        Each worker processes a slice of the observations and returns the rows
+        for each observation, which are collected in the results dictionary.
+        If a limit on the number of observations is given, the observations 
+        are dispatched in rounds of only as many as are needed to reach the 
+        limit, so the observations processed are those that would be processed
+        serially.
+
+        Args:
+            indices (list): Indices of the observations to process.
+            count (int, optional): Number of observations already processed.
+
+        Returns:
+            None.
+        """
+        # Workers are forked so that they inherit the observations and meshgrids
+        executor = ProcessPoolExecutor(max_workers=self.jobs, 
+                                       mp_context=multiprocessing.get_context('fork'),
+                                       initializer=_init_worker, initargs=(self,))
+
+        try:
+            while indices:
+                # Dispatch no more observations than are needed for the limit
+                if self.first:
+                    nobs = self.first - count
+                    if nobs <= 0:
+                        break
+                else:
+                    nobs = len(indices)
+
+                count += self._dispatch(executor, indices[:nobs])
+                indices = indices[nobs:]
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    #===============================================================================
+    def _dispatch(self, executor, indices):
+        """Process a set of observations using a pool of worker processes and 
+        merge their rows in observation order.
+
+        Args:
+            executor (ProcessPoolExecutor): Pool of worker processes.
+            indices (list): Indices of the observations to process.
+
+        Returns:
+            int: Number of observations processed successfully.
+        """
+        # Slice the observations into chunks, several per worker
+        nobs = len(indices)
+        size = max(1, -(-nobs // (4*self.jobs)))
+        chunks = [indices[i:i+size] for i in range(0, nobs, size)]
+
+        # Merge the rows in observation order
+        count = 0
+        for (chunk, results) in zip(chunks, executor.map(_process_chunk, chunks)):
+            for (index, (processed, rows, (hits, misses))) in zip(chunk, results):
+                self.journal.append((index, processed, rows))
+                self.results[index] = (processed, rows)
+                self._merge()
+                self.mask_hits += hits
+                self.mask_misses += misses
+                count += processed
+
+        return count
+
+    #===============================================================================
+    def _open_journal(self):
+        """Open the journal, restoring the results for any journaled 
+        observations if resuming.
+
+        Returns:
+            int: Number of restored observations that were processed successfully.
+        """
+        logger = meta.get_logger()
+
+        header = {'volume_id': self.volume_id,
+                  'levels'   : self.levels,
+                  'sampling' : self.sampling,
+                  'occlusion': self.occlusion,
+                  'observations': hashlib.sha1('\n'.join(
+                        [obs.basename for obs in self.observations]).encode()).hexdigest()}
+        self.journal = Journal(self.output_dir, self.volume_id, header)
+
+        # Restore the journaled results
+        records = self.journal.read() if self.resume else []
+        count = 0
+        for (index, processed, rows) in records:
+            self.results[index] = (processed, rows)
+            count += processed
+        if records:
+            logger.info('%s resumed with %d observations from the journal' % 
+                        (self.volume_id, len(records)))
+
+        self.journal.open(records)
+        return count
+
+    #===============================================================================
+    def _splice(self, manifest):
+        """Restore the results for unchanged observations from the existing 
+        tables.
+
+        Rows are matched to observations by their prefix columns.
+
+        Args:
+            manifest (dict): Manifest written with the existing tables.
+
+        Returns:
+            int: Number of restored observations.
+        """
+        logger = meta.get_logger()
+
+        if manifest['inputs'] != self.inputs:
+            logger.info('%s inputs have changed; all observations are processed' %
+                        self.volume_id)
+            return 0
+
+        # Group the existing rows of each table by observation
+        grouped = []
+        for table in self.tables:
+            # A missing table has no rows, e.g., if no observation produced any
+            rows = {}
+            if table.filename.exists():
+                for line in util.read_txt_file(table.filename):
+                    key = ','.join(line.split(',')[:2])
+                    rows.setdefault(key, []).append(line)
+            grouped.append(rows)
+
+        # Restore the unchanged observations
+        count = 0
+        for (index, observation) in enumerate(self.observations):
+            if index in self.results:
+                continue
+            if manifest['observations'].get(observation.basename) != self.digests[index]:
+                continue
+
+            key = ','.join(Context.get_prefixes(observation, self.volume_id))
+            rows = [table.parse_rows(table_rows.get(key, [])) 
+                                for (table, table_rows) in zip(self.tables, grouped)]
+            self.results[index] = (True, rows)
+            count += 1
+
+        logger.info('%s restored %d of %d observations from the existing tables' %
+                    (self.volume_id, count, len(self.observations)))
+        return count
+
+    #===============================================================================
+    def _checkpoint(self, index, processed):
+        """Collect and journal the rows added to each table for one observation.
+
+        Args:
+            index (int): Row index.
+            processed (bool): True if the observation was processed successfully.
+
+        Returns:
+            None.
+        """
+        rows = [table.take_rows() for table in self.tables]
+        self.journal.append((index, processed, rows))
+        self.results[index] = (processed, rows)
+
+    #===============================================================================
+    def _merge(self, final=False):
+        """Add the collected rows to the tables in observation order.
+
+        The rows of each observation are added once those of all preceding 
+        observations have been added, and then released.  The tables are then
+        flushed.
+
+        Args:
+            final (bool, optional): 
+                If True, the rows of all remaining observations are added, 
+                skipping over any observations that were not processed.
+
+        Returns:
+            None.
+        """
+        while self.results:
+            if self.merged not in self.results:
+                if not final:
+                    break
+                self.merged = min(self.results)
+
+            (processed, rows) = self.results.pop(self.merged)
+            for (table, table_rows) in zip(self.tables, rows):
+                table.extend_rows(table_rows)
+            self.completed[self.merged] = processed
+            self.merged += 1
+
+        for table in self.tables:
+            table.flush()
+
     #===============================================================================
     def create(self, labels_only=False):
         """Process the volume and write a suite of geometry files.
@@ -1024,49 +2727,261 @@ class Suite(object):
             None
         """
         logger = meta.get_logger()
-        
+
         if not hasattr(self, 'observations'):
             return
 
         # Loop through the observations...
-        nobs = len(self.observations)
-        count = 0
         if not labels_only:
-            for i in range(nobs):
-                # Abort if count exceeds a specified limit
-                if self.first and count >= self.first:
-                    continue
+            # Results (processed, rows) keyed by observation index, awaiting
+            # addition to the tables
+            self.results = {}
+            self.merged = 0
+
+            # Success flags keyed by observation index, once added
+            self.completed = {}
+
+            # Restore completed and unchanged observations
+            self.inputs = Manifest.input_digest(self.sampling, self.levels, 
+                                                self.occlusion)
+            self.digests = [Manifest.observation_digest(observation) 
+                                            for observation in self.observations]
+            manifest = Manifest(self.output_dir, self.volume_id)
+            previous = manifest.read() if self.incremental else None
+
+            count = self._open_journal()
+            if previous:
+                count += self._splice(previous)
+
+            indices = [i for i in range(len(self.observations)) 
+                                                        if i not in self.results]
+            if self.jobs > 1 and len(indices) > 1:
+                self._create_parallel(indices, count)
+            else:
+                for i in indices:
+                    # Abort if count exceeds a specified limit
+                    if self.first and count >= self.first:
+                        continue
 
-                # Print a log of progress
-                logger.info("%s  %s %4d/%4d" %
-                            (self.volume_id, self.observations[i].basename, i+1, nobs))
+                    processed = self.process(i)
+                    self._checkpoint(i, processed)
+                    self._merge()
+                    count += processed
 
-                # Continue processing even if cspice throws a runtime error
-                try:
-                    # Construct the record for this observation
-                    records = self.make_records(i)
-    
-                    # Update the tables
-                    self.add(records)
-                    count += 1
-    
-                # A RuntimeError is probably caused by missing spice data. There is
-                # probably nothing we can do.
-                except RuntimeError as e:
-                    logger.warn(str(e))
+            self._merge(final=True)
 
-                # Other kinds of errors are genuine bugs. For now, we just log the
-                # problem, and jump over the image; we can deal with it later.
-                except (AssertionError, AttributeError, IndexError, KeyError,
-                        LookupError, TypeError, ValueError):
-                    logger.error(traceback.format_exc())
+        # Report the mask cache statistics
+        if self.mask_hits + self.mask_misses:
+            logger.info('%s mask cache: %d hits, %d misses' % 
+                        (self.volume_id, self.mask_hits, self.mask_misses))
 
         # Write tables and make labels
         self.write(labels_only=labels_only)
 
+        if not labels_only:
+            # Record the inputs of the successfully processed observations for
+            # the next incremental run
+            if self.incremental:
+                manifest.write(self.inputs, 
+                               {self.observations[index].basename: self.digests[index]
+                                    for (index, processed) in self.completed.items()
+                                    if processed})
+
+            # The journal is no longer needed once the tables are written
+            self.journal.remove()
+
         # Clean up
         config.cleanup()
 
+################################################################################
+# Meshgrid cache
+################################################################################
+
+
+# Meshgrids already loaded or computed in this process
+_MESHGRID_CACHE = {}
+
+#===============================================================================
+def get_meshgrids(sampling, cache_dir=None):
+    """Meshgrids for this host, cached in memory and on disk.
+
+    The meshgrids are computed once per host, sampling, and border, and saved 
+    in the cache directory.  Later processes, including workers, load them from
+    memory-mapped arrays rather than regenerating them.
+
+    Args:
+        sampling (int): Pixel sampling density.
+        cache_dir (str or Path, optional): 
+            Cache directory; default is MESHGRID_CACHE_DIR.
+
+    Returns:
+        dict: Meshgrids keyed by FOV mode, as returned by config.meshgrids().
+    """
+    logger = meta.get_logger()
+
+    key = _meshgrid_key(sampling)
+    if key in _MESHGRID_CACHE:
+        return _MESHGRID_CACHE[key]
+
+    directory = Path(cache_dir or MESHGRID_CACHE_DIR) / key
+    try:
+        meshgrids = _load_meshgrids(directory)
+    except (OSError, EOFError, ValueError, ImportError, AttributeError, 
+            TypeError, pickle.UnpicklingError) as e:
+        logger.warn('Cached meshgrids unreadable; rebuilding: %s' % e)
+        shutil.rmtree(directory, ignore_errors=True)
+        meshgrids = None
+
+    if meshgrids is None:
+        meshgrids = config.meshgrids(sampling)
+        try:
+            _save_meshgrids(directory, meshgrids)
+        except (OSError, pickle.PicklingError, TypeError, AttributeError) as e:
+            logger.warn('Meshgrids not cached: %s' % e)
+
+    _MESHGRID_CACHE[key] = meshgrids
+    return meshgrids
+
+#===============================================================================
+def _meshgrid_key(sampling):
+    """Cache key for the meshgrids of this host.
+
+    The key identifies the host, sampling, and border, along with a digest of
+    everything the meshgrids are built from: the OOPS version, the meshgrid 
+    function, any mode sizes defined by the host, and the source of the OOPS 
+    instrument modules that define the FOVs.
+
+    Args:
+        sampling (int): Pixel sampling density.
+
+    Returns:
+        str: Cache key.
+    """
+    host = Path(config.__file__).parent.name
+    border = getattr(config, 'BORDER', None)
+
+    sha = hashlib.sha1()
+    sha.update(str(getattr(oops, '__version__', '')).encode())
+    sha.update(inspect.getsource(config.meshgrids).encode())
+    sha.update(repr(sorted(getattr(config, 'MODE_SIZES', {}).items())).encode())
+
+    # FOVs are defined by the instrument modules the meshgrid function uses
+    modules = [value for value in config.meshgrids.__globals__.values()
+               if inspect.ismodule(value) and 
+                  value.__name__.startswith('oops.hosts.')]
+    for module in sorted(modules, key=lambda module: module.__name__):
+        try:
+            sha.update(inspect.getsource(module).encode())
+        except (OSError, TypeError):
+            sha.update(module.__name__.encode())
+
+    return '%s_s%s_b%s_%s' % (host, sampling, border, sha.hexdigest()[:12])
+
+#===============================================================================
+def _load_meshgrids(directory):
+    """Load cached meshgrids.
+
+    Args:
+        directory (Path): Cache directory for this key.
+
+    Returns:
+        dict: Meshgrids keyed by FOV mode, or None if not cached.
+
+    Raises:
+        Exception: If the cache entry is incomplete or cannot be unpickled.
+    """
+    index_path = directory / 'meshgrids.pickle'
+    if not index_path.exists():
+        return None
+
+    with open(index_path, 'rb') as f:
+        index = pickle.load(f)
+
+    meshgrids = {}
+    for (mode, (fov, center_uv, fov_keywords)) in index.items():
+        uv = np.load(directory / (mode + '.npy'), mmap_mode='r')
+        meshgrids[mode] = oops.Meshgrid(fov, oops.Pair(uv), center_uv=oops.Pair(center_uv), 
+                                        fov_keywords=fov_keywords)
+    return meshgrids
+
+#===============================================================================
+def _save_meshgrids(directory, meshgrids):
+    """Save meshgrids to the cache.
+
+    The files are written to a temporary directory, which is then renamed, so
+    that concurrent processes never see a partial cache entry.
+
+    Args:
+        directory (Path): Cache directory for this key.
+        meshgrids (dict): Meshgrids keyed by FOV mode.
+
+    Returns:
+        None.
+    """
+    directory.parent.mkdir(parents=True, exist_ok=True)
+    tempdir = Path(tempfile.mkdtemp(dir=directory.parent))
+    try:
+        index = {}
+        for (mode, meshgrid) in meshgrids.items():
+            np.save(tempdir / (mode + '.npy'), meshgrid.uv.vals)
+            index[mode] = (meshgrid.fov, meshgrid.center_uv.vals, meshgrid.fov_keywords)
+
+        with open(tempdir / 'meshgrids.pickle', 'wb') as f:
+            pickle.dump(index, f)
+
+        # Another process may have saved the same entry first
+        try:
+            tempdir.rename(directory)
+        except OSError:
+            if not directory.exists():
+                raise
+    finally:
+        shutil.rmtree(tempdir, ignore_errors=True)
+
+################################################################################
+# Worker process functions
+################################################################################
+
+# Suite processed by this worker process
+_WORKER_SUITE = None
+
+#===============================================================================
+def _init_worker(suite):
+    """Initialize a worker process.
+
+    Args:
+        suite (Suite): Suite inherited from the parent process.
+
+    Returns:
+        None.
+    """
+    global _WORKER_SUITE
+    _WORKER_SUITE = suite
+
+#===============================================================================
+def _process_chunk(indices):
+    """Process a slice of observations in a worker process.
+
+    Args:
+        indices (list): Indices of the observations to process.
+
+    Returns:
+        list: 
+            Tuples (processed, rows, stats), one per observation, where 
+            processed is True if the observation was processed successfully, 
+            rows is a list containing the new rows for each table in the suite,
+            and stats is a tuple (hits, misses) for the excluded-mask cache.
+    """
+    results = []
+    for i in indices:
+        processed = _WORKER_SUITE.process(i)
+        rows = [table.take_rows() for table in _WORKER_SUITE.tables]
+        stats = (_WORKER_SUITE.mask_hits, _WORKER_SUITE.mask_misses)
+        _WORKER_SUITE.mask_hits = _WORKER_SUITE.mask_misses = 0
+        results.append((processed, rows, stats))
+
+    return results
+
 
 ################################################################################
 # external functions
@@ -1112,6 +3027,28 @@ def get_args(host=None, selection=None, exclude=None, sampling=8):
     gr.add_argument('--sampling', '-s', type=int, metavar='sampling',
                     default=sampling, 
                     help='''Pixel sampling density.''')
+    gr.add_argument('--jobs', '-j', type=int, metavar='jobs',
+                    default=1, 
+                    help='''Number of worker processes used to process the 
+                            observations in each volume.''')
+    gr.add_argument('--resume', '-r', action='store_true',
+                    help='''Resume interrupted volumes from their journals rather 
+                            than reprocessing completed observations.''')
+    gr.add_argument('--incremental', action='store_true',
+                    help='''Reprocess only the observations whose inputs have 
+                            changed since the tables were last written, taking 
+                            the others from the existing tables.''')
+    gr.add_argument('--stream', action='store_true',
+                    help='''Write rows to the tables as observations are completed
+                            rather than holding them until the end.''')
+    gr.add_argument('--occlusion', action='store_true',
+                    help='''Derive the obscuring and shadowing masks from a single 
+                            occlusion stage per observation, skipping the 
+                            backplane calculations that cannot affect them.''')
+    gr.add_argument('--daemon', type=str, metavar='queue_dir',
+                    help='''Run as a daemon, keeping the kernels, column 
+                            definitions, and meshgrids loaded, and processing
+                            the volume jobs placed in this directory.''')
 
     # Return parser
     return parser
@@ -1141,8 +3078,6 @@ def process_tables(host=None,
     parser = get_args(host=host, selection=selection, exclude=exclude, sampling=sampling)
     args = parser.parse_args()
 
-    input_tree = FCPath(args.input_tree) 
-    output_tree = FCPath(args.output_tree) 
     volume = args.volume
     new_only = args.new_only is not False
     labels_only = args.labels is not False
@@ -1150,10 +3085,49 @@ def process_tables(host=None,
     if volume:
         new_only = False
 
+    # Serve jobs from a queue instead
+    if args.daemon:
+        serve(args, glob, Path(args.daemon), exclude=exclude, 
+              labels_only=labels_only)
+        return
+
+    volumes = _find_volumes(args, glob, exclude=exclude, volume=volume, 
+                            new_only=new_only, labels_only=labels_only)
+
+    # Build the meshgrids once so that volume workers inherit them
+    if volumes and not labels_only:
+        get_meshgrids(args.sampling)
+
+    # Process the volumes
+    meta.process_volumes(volumes, _process_volume, max_volumes=args.volume_jobs)
+
+#===============================================================================
+def _find_volumes(args, glob, exclude=None, volume=None, new_only=False, 
+                  labels_only=False):
+    """Find the volumes to process in the input tree.
+
+    Args:
+        args (argparse.Namespace): Parsed arguments.
+        glob (str): Glob pattern for index files.
+        exclude (list, optional): List of volumes to exclude.
+        volume (str, optional): If given, only this volume is found.
+        new_only (bool, optional): 
+            If True, volumes that already contain output files are skipped.
+        labels_only (bool, optional): 
+            If True, labels are generated for any existing geometry tables.
+
+    Returns:
+        list: Tuples (volume_id, kwargs), where kwargs is the dictionary of 
+              keyword arguments to pass to _process_volume().
+    """
+    input_tree = FCPath(args.input_tree) 
+    output_tree = FCPath(args.output_tree) 
+
     # Build volume glob
     vol_glob = util.get_volume_glob(input_tree.name)
 
-    # Walk the input tree, making indexes for each found volume
+    # Walk the input tree, collecting the volumes to process
+    volumes = []
     for root, dirs, files in input_tree.walk():
         # __skip directory will not be scanned, so it's safe for test results
         if '__skip' in root.as_posix():
@@ -1190,10 +3164,221 @@ def process_tables(host=None,
                 if new_only & (list(outdir.glob('*_inventory.csv')) != []):
                     continue
 
-                # Process this volume
-                tables = Suite(indir, outdir, 
-                               selection=args.selection, glob=glob, first=args.first, 
-                               sampling=args.sampling)
-                tables.create(labels_only=labels_only)
+                # Queue this volume
+                volumes.append((vol, dict(input_dir=indir, output_dir=outdir, 
+                                          selection=args.selection, glob=glob, 
+                                          first=args.first, sampling=args.sampling, 
+                                          jobs=args.jobs, occlusion=args.occlusion,
+                                          sidecar=args.sidecar, resume=args.resume,
+                                          incremental=args.incremental, 
+                                          stream=args.stream,
+                                          labels_only=labels_only)))
+
+    return volumes
+
+#===============================================================================
+def serve(args, glob, queue_dir, exclude=None, labels_only=False):
+    """Process volume jobs from a queue directory until stopped.
+
+    The host configuration, column definitions, and meshgrids are loaded once,
+    so each job starts without that setup.  A job is a JSON file <name>.json
+    in the queue directory containing "volume" and, optionally, any of the 
+    options in DAEMON_JOB_OPTIONS, which override the command-line values,
+    e.g., {"volume": "GO_0017", "incremental": true}.  A job containing 
+    {"stop": true} stops the daemon.  Jobs should be written under another name
+    and renamed into place, so that they are never read partially written.
+
+    A job is claimed by renaming it to <name>.<host>-<pid>.running, so several
+    daemons can share a queue.  When it is finished, its result is written to 
+    <name>.done, a JSON file containing "volume", "status" ("completed" or 
+    "failed"), "tables" (the files written), "seconds", and "error".  A job 
+    that is not a valid JSON object fails with an error.  At startup, jobs 
+    left running by daemons on this host that no longer exist are returned to
+    the queue.
+
+    Args:
+        args (argparse.Namespace): Parsed arguments.
+        glob (str): Glob pattern for index files.
+        queue_dir (Path): Directory containing the jobs.
+        exclude (list, optional): List of volumes to exclude.
+        labels_only (bool, optional): 
+            If True, labels are generated for any existing geometry tables.
+
+    Returns:
+        None.
+    """
+    logger = meta.get_logger()
+
+    queue_dir.mkdir(parents=True, exist_ok=True)
+    _recover_jobs(queue_dir)
+    owner = _daemon_owner()
+
+    find = lambda volume=None: _find_volumes(args, glob, exclude=exclude, 
+                                             volume=volume, labels_only=labels_only)
+    volumes = dict(find())
+
+    # Warm the meshgrids
+    get_meshgrids(args.sampling)
+    logger.info('Serving jobs from', queue_dir)
+
+    while True:
+        jobs = sorted(queue_dir.glob('*.json'))
+        if not jobs:
+            time.sleep(DAEMON_POLL_INTERVAL)
+            continue
+
+        # Claim the next job unless another daemon has
+        job_path = jobs[0]
+        running_path = job_path.with_suffix('.%s.running' % owner)
+        try:
+            os.rename(job_path, running_path)
+        except FileNotFoundError:
+            continue
+
+        # Read the job, which must be a JSON object
+        error = None
+        try:
+            with open(running_path) as f:
+                job = json.load(f)
+        except ValueError as e:
+            error = 'Invalid JSON: %s' % e
+        else:
+            if not isinstance(job, dict):
+                error = 'Job is not a JSON object'
+
+        if not error and job.get('stop'):
+            os.remove(running_path)
+            logger.info('Stopping daemon')
+            return
+
+        if error:
+            logger.error('Invalid job %s: %s' % (job_path.name, error))
+            result = {'volume': None, 'status': 'failed', 'tables': [], 
+                      'seconds': 0., 'error': error}
+        else:
+            result = _serve_job(volumes, job, find)
+        with open(job_path.with_suffix('.done'), 'w') as f:
+            json.dump(result, f, indent=1)
+        os.remove(running_path)
+
+#===============================================================================
+def _daemon_owner():
+    """Name identifying this daemon in the names of the jobs it is running.
+
+    Returns:
+        str: <host>-<pid>, with any periods in the host name replaced.
+    """
+    return '%s-%d' % (socket.gethostname().replace('.', '_'), os.getpid())
+
+#===============================================================================
+def _recover_jobs(queue_dir):
+    """Return to the queue any jobs left running by daemons on this host 
+    that no longer exist.
+
+    Jobs running on other hosts cannot be checked and are left alone.
+
+    Args:
+        queue_dir (Path): Directory containing the jobs.
+
+    Returns:
+        list: Paths of the recovered jobs.
+    """
+    logger = meta.get_logger()
+
+    host = _daemon_owner().rpartition('-')[0]
+    recovered = []
+    for running_path in sorted(queue_dir.glob('*.running')):
+        (stem, _, owner) = running_path.stem.rpartition('.')
+        (owner_host, _, pid) = owner.rpartition('-')
+        if owner_host != host or not pid.isdigit():
+            continue
+
+        # Leave the jobs of running daemons
+        try:
+            os.kill(int(pid), 0)
+            continue
+        except ProcessLookupError:
+            pass
+        except PermissionError:
+            continue
+
+        job_path = running_path.with_name(stem + '.json')
+        try:
+            os.rename(running_path, job_path)
+        except FileNotFoundError:
+            continue
+        logger.warn('Recovered job', job_path)
+        recovered.append(job_path)
+
+    return recovered
+
+#===============================================================================
+def _serve_job(volumes, job, find):
+    """Process one daemon job.
+
+    Args:
+        volumes (dict): 
+            Keyword arguments for _process_volume() keyed by volume ID; updated
+            if the volume is new.
+        job (dict): Job description.
+        find (function): 
+            Function of a volume ID that finds the volume in the input tree, 
+            as a list of tuples (volume_id, kwargs).
+
+    Returns:
+        dict: Job result.
+    """
+    logger = meta.get_logger()
+
+    volume = job.get('volume')
+    result = {'volume': volume, 'status': 'failed', 'tables': [], 
+              'seconds': 0., 'error': None}
+    start = time.perf_counter()
+
+    # Look for a volume added since the daemon started
+    if volume and volume not in volumes:
+        volumes.update(find(volume))
+    if volume not in volumes:
+        result['error'] = 'Volume not found: %s' % volume
+        logger.error(result['error'])
+        return result
+
+    kwargs = dict(volumes[volume])
+    kwargs.update({key: job[key] for key in DAEMON_JOB_OPTIONS if key in job})
+
+    logger.info('Starting job for', volume)
+    try:
+        _process_volume(**kwargs)
+    except Exception as e:
+        logger.error(traceback.format_exc())
+        result['error'] = repr(e)
+    else:
+        result['status'] = 'completed'
+        output_dir = FCPath(kwargs['output_dir'])
+        result['tables'] = sorted(path.as_posix() 
+                                  for path in output_dir.glob(volume + '_*')
+                                  if path.suffix in ('.tab', '.csv', '.lbl'))
+
+    result['seconds'] = time.perf_counter() - start
+    logger.info('Finished job for %s: %s' % (volume, result['status']))
+    return result
+
+#===============================================================================
+def _process_volume(input_dir, output_dir, labels_only=False, **kwargs):
+    """Create geometry tables for a single volume.
+
+    Args:
+        input_dir (str, Path, or FCPath): Directory containing the volume.
+        output_dir (str, Path, or FCPath): Directory in which to write the tables.
+        labels_only (bool, optional): 
+            If True, labels are generated for any existing geometry tables.
+        **kwargs: Keyword arguments passed to the Suite constructor.
+
+    Returns:
+        None.
+    """
+    tables = Suite(input_dir, output_dir, **kwargs)
+    tables.create(labels_only=labels_only)
+
 
 ################################################################################
\ No newline at end of file
@@ -228,6 +228,31 @@ def cleanup():
 
 
 
+################################################################################
+# Index utilities (optional)
+################################################################################
+
+#===============================================================================
+def prefetch(label_path, label_dict):
+    """Read ahead the data, other than the label, needed by the key functions 
+    for a product.  When index labels are read ahead, this is called too.
+
+    Args:
+        label_path (str, Path, or FCPath): Path to the PDS label.
+        label_dict (dict): Dictionary containing the PDS label fields.
+
+    Returns: 
+        int: Number of bytes read.
+    """
+    image_path = FCPath(label_path).with_suffix('.IMG')
+    try:
+        viclab = util.read_vicar_label(image_path, prefetch=True)
+    except (FileNotFoundError, vicar.VicarError):
+        return 0
+
+    return viclab['LBLSIZE'] + viclab.get(('LBLSIZE', 1), 0)
+
+
 ################################################################################
 # Key functions (optional)
 ################################################################################
@@ -247,11 +272,9 @@ def key__product_creation_time(label_path, label_dict):
     label_path = FCPath(label_path)
     image_path = label_path.with_suffix('.IMG') 
 
-    # Read the VICAR label and take the latest DAT_TIM value
+    # Read the VICAR label, but not the image, and take the latest DAT_TIM value
     try:
-        local_path = image_path.retrieve()
-#        viclab = vicar.VicarLabel.from_file(local_path)
-        viclab = vicar.VicarLabel(local_path, strict=False)
+        viclab = util.read_vicar_label(image_path)
     except FileNotFoundError:
         raise FileNotFoundError(image_path)
     except vicar.VicarError as err:
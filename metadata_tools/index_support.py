@@ -1,20 +1,150 @@
 ################################################################################
 # index_support.py - Tools for generating index files
 ################################################################################
+import re
+import time
 import fortranformat as ff
 import fnmatch
 import warnings
+import threading
 import hosts.pds3 as pds3
 
 import metadata_tools as meta
 import metadata_tools.util as util
 import pdstable
 
+from collections            import deque
+from concurrent.futures     import ThreadPoolExecutor
 from filecache              import FCPath
 from pdstemplate.pds3table  import Pds3Table
 
 import host_config as config
 
+# Limits on the labels read ahead of the index writer: files per I/O thread, 
+# and total bytes of prefetched data
+PREFETCH_FILES_PER_THREAD = 4
+PREFETCH_BYTES = 256 * 2**20
+
+################################################################################
+# ColumnEncoder class
+################################################################################
+class ColumnEncoder(object):
+    """Class describing the compiled formatting of a single index column.
+
+    The Fortran format is parsed once, and the formatted width and data type
+    are determined once, when the encoder is constructed.  Formatted values 
+    are validated by matching a pattern for the data type.
+    """
+
+    DATA_TYPES = {'A':'CHARACTER', 
+                  'E':'ASCII_REAL', 
+                  'F':'ASCII_REAL', 
+                  'I':'ASCII_INTEGER'}
+
+    _REAL = re.compile(r' *[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)? *')
+    PATTERNS = {'A': re.compile(r'"[^"]*"'),
+                'E': _REAL,
+                'F': _REAL,
+                'I': re.compile(r' *[-+]?(0+|[1-9]\d*) *')}
+
+    #===========================================================================
+    def __init__(self, column_stub):
+        """Constructor for a ColumnEncoder object.
+
+        Args:
+            column_stub (dict): Column stub; see IndexTable._get_column_values().
+        """
+        self.name = column_stub['NAME']
+        self.format = column_stub['FORMAT'].strip('"')
+        self.count = column_stub['ITEMS'] if column_stub['ITEMS'] else 1
+
+        self.writer = ff.FortranRecordWriter('(' + self.format + ')')
+        self.quote = self.format[0] == 'A'
+        self.pattern = ColumnEncoder.PATTERNS[self.format[0]]
+        self.data_type = ColumnEncoder.DATA_TYPES[self.format[0]]
+
+        # Number of bytes required for a formatted value, including any quotes
+        try:
+            self.width = len(self._write('0'))
+        except TypeError:
+            self.width = len(self._write(0))
+
+    #===============================================================================
+    def _write(self, value):
+        """Format a single value using the Fortran format.
+
+        Args:
+            value (str): Value to format.
+
+        Returns:
+            str: formatted value.
+        """
+        result = self.writer.write([value])
+
+        # add double quotes to string formats
+        if self.quote:
+            result = '"' + result.strip().ljust(len(result)) + '"'
+
+        return result
+
+    #===============================================================================
+    def encode(self, value):
+        """Format a column.
+
+        Args:
+            value (str): Value to format, or a list of values for a column with
+                         multiple items.
+
+        Returns:
+            str: Formatted value.
+        """
+        # Split multiple elements into individual columns
+        if self.count > 1:
+            if not isinstance(value, (list,tuple)):
+               value = self.count * [value]
+            assert len(value) == self.count
+
+            return ','.join([self._encode_item(item) for item in value])
+
+        return self._encode_item(value)
+
+    #===============================================================================
+    def _encode_item(self, value):
+        """Format a single item.
+
+        Args:
+            value (str): Value to format.
+
+        Returns:
+            str: Formatted value.
+        """
+        logger = meta.get_logger()
+
+        # Clean up strings
+        if isinstance(value, str):
+            value = value.strip()
+            value = value.replace('\n', ' ')
+            while ('  ' in value):
+                value = value.replace('  ', ' ')
+            value = value.replace('"', '')
+
+        # Format the value
+        try:
+            result = self._write(value)
+        except TypeError:
+            logger.warn("Invalid format: %s %s %s" % (self.name, value, self.format))
+            result = self.width * "*"
+
+        if len(result) > self.width:
+            logger.warn("No second format: %s %s %s %s" % 
+                        (self.name, value, self.format, result))
+
+        # Validate the formatted value
+        if not self.pattern.fullmatch(result):
+            logger.warn('Format error for %s: %s' % (self.name, value))
+
+        return result
+
 ################################################################################
 # IndexTable class
 ################################################################################
@@ -23,7 +153,8 @@ class IndexTable(meta.Table):
     """
 
     #===========================================================================
-    def __init__(self, input_dir=None, output_dir=None, qualifier='', glob=None, **kwargs):
+    def __init__(self, input_dir=None, output_dir=None, qualifier='', glob=None, 
+                       io_threads=1, label_cache=False, **kwargs):
         """Constructor for an IndexTable object.
 
         Args:
@@ -36,6 +167,12 @@ class IndexTable(meta.Table):
                 Qualifying string identifying the type of index file to create, 
                 e.g., 'supplemental'.
             glob (str, optional): Glob pattern for index files.
+            io_threads (int, optional): 
+                Number of threads used to read labels, and any other files 
+                needed by the key functions, ahead of the index writer.
+            label_cache (bool, optional): 
+                If True, parsed labels are kept in an on-disk cache and reused
+                while the label files are unchanged.
         """
 
         # Initialize table, return if specific paths not given
@@ -47,11 +184,14 @@ class IndexTable(meta.Table):
         self.input_dir = FCPath(input_dir)
         self.output_dir = FCPath(output_dir)
         self.glob = glob
+        self.io_threads = io_threads if io_threads else 1
         self.usage = {}
         self.unused = set()
 
         # Get volume id
         self.volume_id = config.get_volume_id(self.input_dir)
+        self.label_cache = (util.LabelCache(self.input_dir, self.volume_id) 
+                                if label_cache else None)
 
         logger = meta.get_logger()
         s = ' '+qualifier if qualifier else ' primary'
@@ -73,14 +213,12 @@ class IndexTable(meta.Table):
             self.primary_index_path = self.output_dir/(primary_index_name + '.tab')
 
             try:
-                local_label_path = self.primary_index_label_path.retrieve()
-                local_path = self.primary_index_path.retrieve()
-                table = pdstable.PdsTable(local_label_path)
+                primary_row_dicts = self._get_cached('pdstable', 
+                                                     self.primary_index_path, 
+                                                     self._read_primary_index)
             except FileNotFoundError:
                 warnings.warn('Primary index file not found: %s.  Skipping' % self.primary_index_label_path)
                 return
-
-            primary_row_dicts = table.dicts_by_row()
             self.files = [FCPath(primary_row_dict['FILE_SPECIFICATION_NAME']) \
                                    for primary_row_dict in primary_row_dicts]
 
@@ -100,6 +238,17 @@ class IndexTable(meta.Table):
         pds3_table = Pds3Table(label_path, template, validate=False, numbers=True, formats=True)
         self.column_stubs = IndexTable._get_column_values(pds3_table)
 
+        # Resolve the key function and compile the format for each column
+        self.columns = [(column_stub, 
+                         IndexTable._get_key_function(column_stub['NAME']),
+                         ColumnEncoder(column_stub)) 
+                                for column_stub in self.column_stubs if column_stub]
+
+        # Time spent reading labels and determining each column's values
+        self.timing = {'(label)': 0.}
+        for (column_stub, key_fn, encoder) in self.columns:
+            self.timing[column_stub['NAME']] = 0.
+
     #===========================================================================
     def create(self, labels_only=False):
         """Create the index file for a single volume.
@@ -125,38 +274,52 @@ class IndexTable(meta.Table):
         # Build the index
         n = len(self.files)
         if not labels_only:
-            for i in range(n):
-                file = self.files[i]
-                name = file.name
-                root = file.parent
+            # Match the glob pattern
+            indices = [i for i in range(n) 
+                                if fnmatch.filter([self.files[i].name], self.glob)]
+            paths = [self.files[i] for i in indices]
+            util.partial_read_stats(reset=True)
+
+            # Key functions share the label cache
+            util.use_label_cache(self.label_cache)
+            try:
+                for (i, path, label) in zip(indices, paths, self._iter_labels(paths)):
+                    root = path.parent
 
-                # Match the glob pattern
-                file = fnmatch.filter([name], self.glob)[0]
-                if file == []:
-                 continue
+                    # Log volume ID and subpath
+                    subdir = util.get_volume_subdir(root, config.get_volume_id(root))
+                    logger.info('%s %4d/%4d  %s' % (self.volume_id, i+1, n, subdir/path.name))
 
-                # Log volume ID and subpath
-                subdir = util.get_volume_subdir(root, config.get_volume_id(root))
-                logger.info('%s %4d/%4d  %s' % (self.volume_id, i+1, n, subdir/name))
+                    # Make the index for this file
+                    self.add(root, path.name, label=label)
+            finally:
+                util.use_label_cache(None)
 
-                # Make the index for this file
-                self.add(root, file)
+            if self.label_cache:
+                logger.info('%s label cache: %d hits, %d misses' % 
+                            (self.volume_id, self.label_cache.hits, self.label_cache.misses))
+                self.label_cache.save()
 
             # Flag any unused columns
             for name in self.usage:
                 if not self.usage[name]:
                     self.unused.update({name})
 
+            self._report_timing()
+            self._report_partial_reads()
+
         # Write tables and make labels
         self.write(labels_only=labels_only)
  
     #===============================================================================
-    def add(self, root, name):
+    def add(self, root, name, label=None):
         """Write a single index file entry.
 
         Args:
             root (str): Top of the directory tree containing the volume.
             name (str): Name of PDS label.
+            label (dict, optional): 
+                Dictionary containing the PDS label fields, if already read.
 
         Returns:
             None.
@@ -164,40 +327,167 @@ class IndexTable(meta.Table):
 
         # Read the PDS3 label
         path = root/name
-        label = pds3.get_label(path.as_posix())
+        if label is None:
+            start = time.perf_counter()
+            label = self._get_label(path)
+            self.timing['(label)'] += time.perf_counter() - start
 
         # Write columns
-        first = True
-        line = ''
-        for column_stub in self.column_stubs:
-            if not column_stub:
-                continue
-
+        fields = []
+        for (column_stub, key_fn, encoder) in self.columns:
             # Add column name to usage dict if not already there
             name = column_stub['NAME']
             if not name in self.usage:
                 self.usage[name] = False
 
             # Get the value
-            value = self._index_one_value(column_stub, path, label)
+            start = time.perf_counter()
+            value = self._index_one_value(column_stub, key_fn, path, label)
+            self.timing[name] += time.perf_counter() - start
 
             # Write the value into the index
-            if not first:
-                line += ","
+            fields.append(encoder.encode(value))
+
+        self.rows += [','.join(fields)]
+
+    #===============================================================================
+    def _iter_labels(self, paths):
+        """Generate the label for each path, in order.
+
+        With more than one I/O thread, the labels, and any other data that the
+        host's prefetch() function reads for the key functions, are read ahead 
+        by a pool of threads.  At most PREFETCH_FILES_PER_THREAD labels per 
+        thread are in flight, and reading ahead pauses while the prefetched 
+        data awaiting the writer exceed PREFETCH_BYTES.  Reads in progress are
+        counted at the size of the largest read so far.
+
+        Args:
+            paths (list): Paths to the PDS labels.
+
+        Yields:
+            dict: Dictionary containing the PDS label fields.
+        """
+        # Read the labels one after another
+        if self.io_threads <= 1:
+            for path in paths:
+                start = time.perf_counter()
+                label = self._get_label(path)
+                self.timing['(label)'] += time.perf_counter() - start
+                yield label
+            return
+
+        # Bytes of prefetched data awaiting the writer, and the largest read
+        lock = threading.Lock()
+        inflight = [0]
+        largest = [0]
+
+        #-------------------------------------------------
+        # Read one label and its prefetched data, 
+        # replacing the estimate of its size
+        #-------------------------------------------------
+        def read(path, estimate):
+            (label, nbytes) = self._read_label(path)
+            with lock:
+                inflight[0] += nbytes - estimate
+                largest[0] = max(largest[0], nbytes)
+            return (label, nbytes)
+
+        # Read ahead, yielding the labels in order
+        window = PREFETCH_FILES_PER_THREAD * self.io_threads
+        with ThreadPoolExecutor(max_workers=self.io_threads) as executor:
+            pending = deque()
+            submitted = 0
+            for _ in paths:
+                while submitted < len(paths) and (not pending or 
+                        (len(pending) < window and inflight[0] < PREFETCH_BYTES)):
+                    with lock:
+                        estimate = largest[0]
+                        inflight[0] += estimate
+                    pending.append(executor.submit(read, paths[submitted], estimate))
+                    submitted += 1
+
+                # Time spent waiting for the label
+                start = time.perf_counter()
+                (label, nbytes) = pending.popleft().result()
+                self.timing['(label)'] += time.perf_counter() - start
+
+                yield label
+
+                with lock:
+                    inflight[0] -= nbytes
+
+    #===============================================================================
+    def _read_label(self, path):
+        """Read a label and read ahead any other data needed by the key functions.
+
+        Args:
+            path (FCPath): Path to the PDS label.
+
+        Returns:
+            tuple: (label, nbytes), where label is the dictionary containing the 
+                   PDS label fields and nbytes is the size of the data read ahead.
+        """
+        label = self._get_label(path)
+
+        nbytes = 0
+        if hasattr(config, 'prefetch'):
+            nbytes = config.prefetch(path, label)
+
+        return (label, nbytes)
+
+    #===============================================================================
+    def _get_label(self, path):
+        """Parsed PDS3 label, from the label cache if it is in use.
+
+        Args:
+            path (FCPath): Path to the PDS label.
+
+        Returns:
+            dict: Dictionary containing the PDS label fields.
+        """
+        return self._get_cached('pds3', path, 
+                                lambda path: pds3.get_label(path.as_posix()))
+
+    #===============================================================================
+    def _get_cached(self, kind, path, reader):
+        """Value read from a file, from the label cache if it is in use.
+
+        Args:
+            kind (str): Kind of value, e.g., "pds3".
+            path (FCPath): Path to the file.
+            reader (function): Function of the file path that reads the value.
+
+        Returns:
+            Value read from the file.
+        """
+        if self.label_cache:
+            return self.label_cache.get(kind, path, reader)
+        return reader(path)
 
-            fvalue = IndexTable._format_column(column_stub, value)
-            line += fvalue
+    #===============================================================================
+    def _read_primary_index(self, path):
+        """Read the rows of the primary index.
 
-            first = False
+        Args:
+            path (FCPath): Path to the primary index table.
 
-        self.rows += [line]
+        Returns:
+            list: Dictionary of the column values for each row.
+        """
+        local_label_path = self.primary_index_label_path.retrieve()
+        path.retrieve()
+        table = pdstable.PdsTable(local_label_path)
+        return table.dicts_by_row()
 
     #===============================================================================
-    def _index_one_value(self, column_stub, label_path, label_dict):
+    def _index_one_value(self, column_stub, key_fn, label_path, label_dict):
         """Determine value for one row of one column.
 
         Args:
             column_stub (dict): Column stub dictionary.
+            key_fn (function): 
+                Key function for the column, or None to take the value directly
+                from the label.
             label_path (str, Path, or FCPath): Path to the PDS label.
             label_dict (dict): Dictionary containing the PDS label fields.
 
@@ -206,22 +496,14 @@ class IndexTable(meta.Table):
         """
         nullval = column_stub['NULL_CONSTANT']
 
-        # Check for built-in key function
+        # Use the key function if there is one
         key = column_stub['NAME']
-        fn_name = 'key__' + key.lower()
-        try:
-            fn = globals()[fn_name]
-            value = fn(label_path, label_dict)
-
-        # Check for key function in index_config module
-        except KeyError:
-            try:
-                fn = getattr(config, fn_name)
-                value = fn(label_path, label_dict)
+        if key_fn:
+            value = key_fn(label_path, label_dict)
 
-            # If no key function, just take the value from the label
-            except AttributeError:
-                value = label_dict[key] if key in label_dict else nullval
+        # Otherwise, just take the value from the label
+        else:
+            value = label_dict[key] if key in label_dict else nullval
 
         # If a key function returned None, insert a NULL value.
         if value is None:
@@ -235,6 +517,67 @@ class IndexTable(meta.Table):
 
         return value
 
+    #===============================================================================
+    def _report_timing(self, max_columns=10):
+        """Log the time spent determining the values of the slowest columns.
+
+        Args:
+            max_columns (int, optional): Number of columns to report.
+
+        Returns:
+            None.
+        """
+        logger = meta.get_logger()
+
+        total = sum(self.timing.values())
+        if not total:
+            return
+
+        logger.info('%s index time: %.2f s' % (self.volume_id, total))
+        names = sorted(self.timing, key=self.timing.get, reverse=True)
+        for name in names[:max_columns]:
+            logger.info('  %-32s %8.2f s %5.1f%%' % 
+                        (name, self.timing[name], 100 * self.timing[name] / total))
+
+    #===============================================================================
+    def _report_partial_reads(self):
+        """Log the data read by header-only reads, compared with the full size of
+        the files read.
+
+        Returns:
+            None.
+        """
+        logger = meta.get_logger()
+
+        stats = util.partial_read_stats()
+        if not stats['files']:
+            return
+
+        logger.info('%s partial reads: %d files, %.1f KB read of %.1f KB' %
+                    (self.volume_id, stats['files'], stats['bytes'] / 1024, 
+                     stats['file_bytes'] / 1024))
+
+    #===============================================================================
+    @staticmethod
+    def _get_key_function(name):
+        """Resolve the key function for a column.
+
+        A built-in key function takes precedence over one defined in the host
+        configuration.
+
+        Args:
+            name (str): Column name.
+
+        Returns:
+            function: Key function, or None if the value is taken directly 
+                      from the label.
+        """
+        fn_name = 'key__' + name.lower()
+        if fn_name in globals():
+            return globals()[fn_name]
+
+        return getattr(config, fn_name, None)
+
     #===============================================================================
     @staticmethod
     def _get_column_values(pds3_table):
@@ -292,119 +635,6 @@ class IndexTable(meta.Table):
         
         return nullval
 
-    #===============================================================================
-    @staticmethod
-    def _format_value(value, format):
-        """Format a single value using a Fortran format code.
-
-        Args:
-            value (str): Value to format.
-            format (str): FORTRAN-style format code.
-
-        Returns:
-            str: formatted value.
-        """
-    
-        # format value
-        line = ff.FortranRecordWriter('(' + format + ')')
-        result = line.write([value])
-
-        # add double quotes to string formats
-        if format[0] == 'A':
-            result = '"' + result.strip().ljust(len(result)) + '"'
-    
-        return result
-
-    #===============================================================================
-    @staticmethod
-    def _format_parms(format):
-        """Determine len and type corresopnding to a given FORTRAN format code..
-
-        Args:
-            format (str): FORTRAN_style format code.
-        
-        Returns:
-            NamedTuple (width (int), data_type (str)): 
-                width     (int): Number of bytes required for a formatted value, 
-                          including any quotes.
-                data_type (str): Data type corresponding to the format code.
-        """
-    
-        data_types = {'A':'CHARACTER', 
-                      'E':'ASCII_REAL', 
-                      'F':'ASCII_REAL', 
-                      'I':'ASCII_INTEGER'}
-        try:
-            f = IndexTable._format_value('0', format)
-        except TypeError:
-            f = IndexTable._format_value(0, format)
-
-        width = len(f)
-        data_type = data_types[format[0]]
-    
-        return (width, data_type)
-
-    #===============================================================================
-    @staticmethod
-    def _format_column(column_stub, value, count=None):
-        """Format a column.
-
-        Args:
-            column_stub (list): Preprocessed column stub. 
-            value (str): Value to format.
-            count (int): Number of items to process.  If not given, the 'ITEMS'
-                         entry is used.
-
-        Returns:
-            str: Formatted value.
-        """
-        logger = meta.get_logger()
-
-        # Get value parameters
-        name = column_stub['NAME']
-        format = column_stub['FORMAT'].strip('"')
-        (width, data_type) =  IndexTable._format_parms(format)
-        if not count:
-            count = column_stub['ITEMS'] if column_stub['ITEMS'] else 1
-
-        # Split multiple elements into individual columns and process recursively
-        if count > 1:
-            if not isinstance(value, (list,tuple)):
-               value = count * [value]
-            assert len(value) == count
-
-            fmt_list = []
-            for item in value:
-                result = IndexTable._format_column(column_stub, item, count=1) 
-                fmt_list.append(result)
-            return ','.join(fmt_list)
-
-        # Clean up strings
-        if isinstance(value, str):
-            value = value.strip()
-            value = value.replace('\n', ' ')
-            while ('  ' in value):
-                value = value.replace('  ', ' ')
-            value = value.replace('"', '')
-
-        # Format the value
-        try:
-            result = IndexTable._format_value(value, format)
-        except TypeError:
-            logger.warn("Invalid format: %s %s %s" % (name, value, format))
-            result = width * "*"
-
-        if len(result) > width:
-            logger.warn("No second format: %s %s %s %s" % (name, value, format, result))
-
-        # Validate the formatted value
-        try:
-            test = eval(result)
-        except Exception:
-            logger.warn('Format error for %s: %s' % (name, value))
-
-        return result
-
 
 ################################################################################
 # Built-in key functions
@@ -467,6 +697,13 @@ def get_args(host=None, type=None):
                     default=type, 
                     help='''Type of index file to create, e.g., 
                             "supplemental".''')
+    gr.add_argument('--io_threads', type=int, metavar='io_threads',
+                    default=1, 
+                    help='''Number of threads used to read labels ahead of the 
+                            index writer.''')
+    gr.add_argument('--label_cache', action='store_true', 
+                    help='''Keep parsed labels in an on-disk cache, reusing them
+                            while the label files are unchanged.''')
 
     # Return parser
     return parser
@@ -499,7 +736,8 @@ def process_index(host=None, type='', glob=None):
     # Build volume glob
     vol_glob = util.get_volume_glob(input_tree.name)
 
-    # Walk the input tree, making indexes for each found volume
+    # Walk the input tree, collecting the volumes to process
+    volumes = []
     for root, dirs, files in input_tree.walk():
         # __skip directory will not be scanned, so it's safe for test results
         if '__skip' in root.as_posix():
@@ -514,7 +752,6 @@ def process_index(host=None, type='', glob=None):
         col = parts[-2]
         vol = parts[-1]
 
-        unused = None
         # Test whether this root is a volume
         if fnmatch.filter([vol], vol_glob):
             if not volume or vol == volume:
@@ -523,15 +760,39 @@ def process_index(host=None, type='', glob=None):
                     outdir = output_tree/col
                 outdir = output_tree/vol
 
-                # Process this volumne
-                index = IndexTable(indir, outdir, 
-                                   qualifier=args.type, volume_id=vol, glob=glob)
-                index.create(labels_only=labels_only)
+                # Queue this volume
+                volumes.append((vol, dict(input_dir=indir, output_dir=outdir, 
+                                          qualifier=args.type, volume_id=vol, 
+                                          glob=glob, sidecar=args.sidecar,
+                                          io_threads=args.io_threads,
+                                          label_cache=args.label_cache,
+                                          labels_only=labels_only)))
+
+    # Process the volumes
+    unused = meta.process_volumes(volumes, _process_volume, 
+                                  max_volumes=args.volume_jobs)
 
-                unused = index.unused if not unused else unused & index.unused
+    # Log a warning for any columns that never had non-null values
+    for (vol, _) in volumes:
+        if unused.get(vol):
+            logger.warn('Unused columns: %s', unused[vol])
 
-        # Log a warning for any columns that never had non-null values
-        if unused:
-            logger.warn('Unused columns: %s', unused)
+#===============================================================================
+def _process_volume(input_dir, output_dir, labels_only=False, **kwargs):
+    """Create the index file for a single volume.
+
+    Args:
+        input_dir (str, Path, or FCPath): Directory containing the volume.
+        output_dir (str, Path, or FCPath): Directory in which to write the index.
+        labels_only (bool, optional): 
+            If True, labels are generated for any existing index files.
+        **kwargs: Keyword arguments passed to the IndexTable constructor.
+
+    Returns:
+        set: Columns that never had non-null values.
+    """
+    index = IndexTable(input_dir, output_dir, **kwargs)
+    index.create(labels_only=labels_only)
+    return index.unused
 
 ################################################################################
\ No newline at end of file
@@ -1,26 +1,54 @@
 ################################################################################
 # label_support.py - Tools for generating metadata labels.
 ################################################################################
+import os
+import re
+import bisect
+
+from pathlib                import Path
 from filecache              import FCPath
-from pdstemplate            import PdsTemplate
-from pdstemplate.pds3table  import pds3_table_preprocessor
+from pdstemplate            import PdsTemplate, TemplateError
+from pdstemplate.pds3table  import Pds3Table
+from pdstemplate.asciitable import AsciiTable
 
 import metadata_tools as meta
 import metadata_tools.util as util
 import metadata_tools.defs as defs
 
+# Compiled templates and their PDS3 table analyses, keyed by the paths and 
+# modification times of the template and its included files, the working 
+# directory, and preprocessing
+_TEMPLATE_CACHE = {}
+
+# Options for the PDS3 table preprocessor
+_PDS3_OPTIONS = {'formats':True, 'numbers':True, 'validate':False}
+
+# Explicit $INCLUDE directives, whose files are merged into compiled templates
+_INCLUDE_REGEX = re.compile(r'\$INCLUDE\( *(\'[^\']+\'|"[^"]+") *\)')
+
 #===============================================================================
 def create(filepath, system=None, 
                      use_global_template=False,
-                     table_type=''):
+                     table_type='', 
+                     records=None, record_bytes=None, summary=None):
     """Creates a label for a given geometry table.
 
+    The template functions FILE_RECORDS, RECORD_BYTES, and ANALYZE_TABLE 
+    normally read the table.  If the table's statistics are provided by the 
+    caller, they are used instead.
+
     Args:
         filepath (str|Path|FCPath): Path to the local or remote geometry table.
         system (str): Name of system, for rings and moons.
         use_global_template (bool): 
             If True, the label template is to be found in the global template
         table_type (str, optional): BODY, RING, SKY, SUPPLEMENTAL_INDEX, INVENTORY.
+        records (int, optional): Number of records in the table.
+        record_bytes (int, optional): 
+            Length of the longest record, including the line terminator.
+        summary (TableSummary, optional): 
+            Summary of the table rows, accumulated as they were written.  If 
+            given, it also supplies the record count and length.
 
     Returns:
         None.
@@ -50,21 +78,404 @@ def create(filepath, system=None,
         template_name = util.get_template_name(filename, volume_id)
         template_path = FCPath('./templates/').resolve() / (template_name + '.lbl')
 
-    # Default preprocessor
-    preprocess = pds3_table_preprocessor
-    if 'inventory' in body:
-        preprocess = None
+    # Default preprocessing by the PDS3 table preprocessor
+    pds3 = 'inventory' not in body
 
     # Default template dictionary
+    (T, pds3_table) = _get_template(template_path, pds3)
     fields = {'VOLUME_ID'           : volume_id,
               'TABLE_TYPE'          : table_type}
+    fields.update(_table_functions(filepath, records=records, 
+                                   record_bytes=record_bytes, summary=summary,
+                                   pds3_table=pds3_table))
 
     # Generate label
-    T = PdsTemplate(template_path, crlf=True, 
-                    preprocess=preprocess, 
-                    kwargs={'formats':True, 'numbers':True, 'validate':False})
     T.write(fields, label_path=label_path, mode='repair')
     
     return
-    
+
+#===============================================================================
+def _get_template(template_path, pds3):
+    """Compiled template, reused from earlier calls if neither the template 
+    file nor any file it includes has changed.
+
+    Included templates are resolved relative to the working directory, so it is
+    part of the key.
+
+    Args:
+        template_path (FCPath): Path to the template.
+        pds3 (bool): True to apply the PDS3 table preprocessor.
+
+    Returns:
+        tuple: 
+            The compiled PdsTemplate, and the Pds3Table describing the template
+            if it was preprocessed; None otherwise.
+    """
+    local_path = Path(template_path.get_local_path()).resolve()
+    key = (_template_stamps(local_path), os.getcwd(), pds3)
+    if key in _TEMPLATE_CACHE:
+        return _TEMPLATE_CACHE[key]
+
+    # Keep the analysis made by the preprocessor, which the label functions use
+    pds3_tables = []
+    def pds3_table_preprocessor(labelpath, content, **kwargs):
+        pds3_tables.append(Pds3Table(labelpath, content, **kwargs))
+        return pds3_tables[-1].content
+
+    template = PdsTemplate(template_path, crlf=True, 
+                           preprocess=pds3_table_preprocessor if pds3 else None, 
+                           kwargs=_PDS3_OPTIONS if pds3 else {})
+
+    _TEMPLATE_CACHE[key] = (template, pds3_tables[-1] if pds3_tables else None)
+    return _TEMPLATE_CACHE[key]
+
+#===============================================================================
+def _template_stamps(local_path, stamps=None):
+    """Paths and modification times of a template and the files it includes.
+
+    Includes are found as the template compiler finds them: relative to the 
+    working directory, then to the template directory, then to any directory in
+    PDSTEMPLATE_INCLUDES.
+
+    Args:
+        local_path (Path): Local path to the template.
+        stamps (list, optional): Stamps found so far, to which more are added.
+
+    Returns:
+        tuple: (path, mtime) for the template and each included file, in order.
+    """
+    stamps = [] if stamps is None else stamps
+    stamps.append((local_path.as_posix(), local_path.stat().st_mtime_ns))
+
+    include_dirs = [local_path.parent] + \
+                   [Path(d) for d in os.getenv('PDSTEMPLATE_INCLUDES', '').split(':') if d]
+    for name in _INCLUDE_REGEX.findall(local_path.read_text(encoding='latin-1')):
+        name = name[1:-1]
+        for path in [Path(name)] + [d / name for d in include_dirs]:
+            if path.is_file():
+                _template_stamps(path.resolve(), stamps)
+                break
+
+    return tuple(stamps)
+
+#===============================================================================
+def _table_functions(filepath, records=None, record_bytes=None, summary=None,
+                     pds3_table=None):
+    """Template functions that describe a table using known statistics rather 
+    than by reading it.
+
+    Each function falls back to the standard one for any other file.
+
+    Args:
+        filepath (str|Path|FCPath): Path to the table.
+        records (int, optional): Number of records in the table.
+        record_bytes (int, optional): 
+            Length of the longest record, including the line terminator.
+        summary (TableSummary, optional): Summary of the table rows.
+        pds3_table (Pds3Table, optional): 
+            Analysis of a template made by the PDS3 table preprocessor.  If 
+            given, LABEL_VALUE refers to it and to the analyzed table.
+
+    Returns:
+        dict: Template functions keyed by name.
+    """
+    table_path = FCPath(filepath).as_posix()
+    if summary is not None:
+        records = summary.rows
+        record_bytes = summary.record_bytes
+
+    #-------------------------------------------------
+    # Test whether a path refers to the table
+    #-------------------------------------------------
+    def is_table(path):
+        return FCPath(path).as_posix() == table_path
+
+    #-------------------------------------------------
+    # Template functions
+    #-------------------------------------------------
+    def file_records(path):
+        return records if is_table(path) else PdsTemplate.FILE_RECORDS(path)
+
+    def record_bytes_(path):
+        return record_bytes if is_table(path) else PdsTemplate.RECORD_BYTES(path)
+
+    def analyze_table(path, **kwargs):
+        if not summary or not is_table(path):
+            table = AsciiTable(path, **kwargs)
+        else:
+            try:
+                table = SummaryTable(path, summary, **kwargs)
+            except Exception:
+                table = AsciiTable(path, **kwargs)
+
+        # The new table becomes the one referenced by the template
+        if pds3_table:
+            pds3_table.assign_to(table)
+
+    def label_value(name, column=0):
+        try:
+            return pds3_table.lookup(name, column)
+        except Exception as err:
+            raise TemplateError(err) from err
+
+    functions = {}
+    if records is not None:
+        functions['FILE_RECORDS'] = file_records
+    if record_bytes is not None:
+        functions['RECORD_BYTES'] = record_bytes_
+    if summary or pds3_table:
+        functions['ANALYZE_TABLE'] = analyze_table
+    if pds3_table:
+        functions['LABEL_VALUE'] = label_value
+
+    return functions
+
+################################################################################
+# TableSummary class
+################################################################################
+class TableSummary(object):
+    """Class describing the rows of a table, accumulated as they are written.
+
+    A label needs, for each column, its width, its format, and its minimum and
+    maximum values.  Rather than keeping every row, the summary keeps one 
+    example of each distinct shape of cell in each column, which determines 
+    the format, and the few smallest and largest distinct values, which 
+    determine the extremes once any invalid constants are excluded.  These 
+    cells, along with the first and last rows, form a small table with the 
+    same columns as the full one.
+    """
+
+    # Number of extreme values kept at each end of each column
+    EXTREMES = 8
+
+    # Fields, separated by commas outside of quotes
+    _FIELD_REGEX = re.compile(r'([^",]*| *"[^"]*" *)(?:,|$)')
+
+    # Characters that cannot occur in a number or date
+    _STRING_REGEX = re.compile(r'[^0-9 +\-.eETZ:"]')
+
+    # Digits are interchangeable within a shape
+    _DIGITS = str.maketrans('123456789', '000000000')
+
+    #===========================================================================
+    def __init__(self):
+        """Constructor for a TableSummary object."""
+        self.rows = 0
+        self.record_bytes = 0
+        self.first = None
+        self.last = None
+
+        # For each column, example cells keyed by shape, and the lowest and 
+        # highest (value, cell) pairs in order
+        self.shapes = []
+        self.lows = []
+        self.highs = []
+
+    #===============================================================================
+    def __bool__(self):
+        return self.rows > 0
+
+    #===============================================================================
+    def add(self, lines):
+        """Add rows to the summary.
+
+        Args:
+            lines (list): Formatted lines, with no terminators.
+
+        Returns:
+            None.
+        """
+        for line in lines:
+            if self.first is None:
+                self.first = line
+            self.last = line
+            self.rows += 1
+            self.record_bytes = max(self.record_bytes, len(line) + 2)
+
+            cells = TableSummary._FIELD_REGEX.split(line)[1:-2:2]
+            while len(self.shapes) < len(cells):
+                self.shapes.append({})
+                self.lows.append([])
+                self.highs.append([])
+
+            for (k, cell) in enumerate(cells):
+                self.shapes[k].setdefault(TableSummary._shape(cell), cell)
+                key = TableSummary._key(cell)
+                TableSummary._extreme(self.lows[k], key, cell, low=True)
+                TableSummary._extreme(self.highs[k], key, cell, low=False)
+
+    #===============================================================================
+    def merge(self, other):
+        """Add the rows of another summary, as if they followed these rows.
+
+        Args:
+            other (TableSummary): Summary of the following rows.
+
+        Returns:
+            None.
+        """
+        if not other:
+            return
+
+        if self.first is None:
+            self.first = other.first
+        self.last = other.last
+        self.rows += other.rows
+        self.record_bytes = max(self.record_bytes, other.record_bytes)
+
+        while len(self.shapes) < len(other.shapes):
+            self.shapes.append({})
+            self.lows.append([])
+            self.highs.append([])
+
+        for k in range(len(other.shapes)):
+            for (shape, cell) in other.shapes[k].items():
+                self.shapes[k].setdefault(shape, cell)
+            for (key, cell) in other.lows[k]:
+                TableSummary._extreme(self.lows[k], key, cell, low=True)
+            for (key, cell) in other.highs[k]:
+                TableSummary._extreme(self.highs[k], key, cell, low=False)
+
+    #===============================================================================
+    def to_dict(self):
+        """Representation of the summary that can be saved as JSON.
+
+        Returns:
+            dict: Summary attributes; each column is reduced to its cells.
+        """
+        return {'rows'        : self.rows,
+                'record_bytes': self.record_bytes,
+                'first'       : self.first,
+                'last'        : self.last,
+                'shapes'      : [list(shapes.values()) for shapes in self.shapes],
+                'lows'        : [[cell for (_, cell) in lows] for lows in self.lows],
+                'highs'       : [[cell for (_, cell) in highs] for highs in self.highs]}
+
+    #===============================================================================
+    @staticmethod
+    def from_dict(d):
+        """Summary restored from the representation made by to_dict().
+
+        Args:
+            d (dict): Summary attributes.
+
+        Returns:
+            TableSummary: Restored summary.
+        """
+        summary = TableSummary()
+        summary.rows = d['rows']
+        summary.record_bytes = d['record_bytes']
+        summary.first = d['first']
+        summary.last = d['last']
+        summary.shapes = [{TableSummary._shape(cell): cell for cell in cells}
+                          for cells in d['shapes']]
+        summary.lows = [[(TableSummary._key(cell), cell) for cell in cells]
+                        for cells in d['lows']]
+        summary.highs = [[(TableSummary._key(cell), cell) for cell in cells]
+                         for cells in d['highs']]
+        return summary
+
+    #===============================================================================
+    def records(self):
+        """Records of a small table with the same column formats and extremes.
+
+        Returns:
+            list: Records as byte strings, including the line terminators.
+        """
+        columns = []
+        for (shapes, lows, highs) in zip(self.shapes, self.lows, self.highs):
+            cells = list(shapes.values())
+            cells += [cell for (_, cell) in lows + highs]
+            columns.append(cells)
+
+        lines = [self.first]
+        for i in range(max([len(cells) for cells in columns] + [0])):
+            lines.append(','.join(cells[i % len(cells)] for cells in columns))
+        lines.append(self.last)
+
+        return [(line + '\r\n').encode('utf-8') for line in lines]
+
+    #===============================================================================
+    @staticmethod
+    def _extreme(extremes, key, cell, low=True):
+        """Add a cell to the extreme values of a column if it belongs there.
+
+        Args:
+            extremes (list): (key, cell) pairs for the column, in order of key.
+            key (tuple): Sort key of the cell.
+            cell (str): Cell to add.
+            low (bool, optional): 
+                True to keep the lowest values; False to keep the highest.
+
+        Returns:
+            None.
+        """
+        limit = TableSummary.EXTREMES
+        if len(extremes) >= limit:
+            if (key >= extremes[-1][0]) if low else (key <= extremes[0][0]):
+                return
+
+        # Values are distinct
+        i = bisect.bisect_left(extremes, (key,))
+        if i < len(extremes) and extremes[i][0] == key:
+            return
+
+        extremes.insert(i, (key, cell))
+        if len(extremes) > limit:
+            if low:
+                del extremes[limit:]
+            else:
+                del extremes[:-limit]
+
+    #===============================================================================
+    @staticmethod
+    def _key(cell):
+        """Sort key of a cell: (0, number) for numbers; (1, string) otherwise."""
+        value = cell.strip()
+        try:
+            return (0, float(value))
+        except ValueError:
+            return (1, value.strip('"').strip())
+
+    #===============================================================================
+    @staticmethod
+    def _shape(cell):
+        """Shape of a cell, which determines its format in the label."""
+        if TableSummary._STRING_REGEX.search(cell):
+            return (cell.startswith('"') and cell.endswith('"'), len(cell))
+        return cell.translate(TableSummary._DIGITS)
+
+################################################################################
+# SummaryTable class
+################################################################################
+class SummaryTable(AsciiTable):
+    """AsciiTable describing a table from its summary rather than its content.
+
+    The table is analyzed from the records of the summary, but reports the 
+    number of rows in the full table.
+    """
+
+    #===========================================================================
+    def __init__(self, filepath, summary, **kwargs):
+        """Constructor for a SummaryTable object.
+
+        Args:
+            filepath (str|Path|FCPath): Path to the table.
+            summary (TableSummary): Summary of the table rows.
+            kwargs: Additional AsciiTable arguments.
+        """
+        self.summary = summary
+        super().__init__(filepath, summary.records(), **kwargs)
+
+    #===============================================================================
+    def lookup(self, name, column=0):
+        """Lookup function for information about the table; see 
+        AsciiTable.lookup().
+        """
+        if name == 'ROWS':
+            return self.summary.rows
+        return super().lookup(name, column)
+
+    TABLE_VALUE = lookup
+
 ################################################################################
@@ -0,0 +1,376 @@
+################################################################################
+# query_support.py - Tools for random-access queries of cumulative tables.
+################################################################################
+"""Query indexes for cumulative geometry tables.
+
+A query index is a NumPy structured array saved in .npy format alongside a
+table, e.g., GO_0999_body_summary_query.npy next to GO_0999_body_summary.tab.
+For each key, VOLUME_ID, FILE_SPECIFICATION_NAME, SYSTEM_NAME, BODY_NAME (body 
+tables only), and TIME, it contains a field of the key values in sorted order 
+and a field <key>_ROW of the corresponding row numbers.  The key columns are 
+located using the table's label.  The OFFSET field contains the byte offset of
+each row in the table.  The index is memory-mapped, so a lookup is a binary 
+search:
+
+    with QueryIndex('GO_0999_body_summary.tab') as index:
+        rows = index.rows('BODY_NAME', 'EUROPA')
+        rows = index.rows('TIME', '1996-06-27', '1996-06-28')
+"""
+import os
+import mmap
+import julian
+import numpy as np
+import pdstable
+
+import metadata_tools as meta
+
+from filecache import FCPath
+
+QUERY_SUFFIX = '_query.npy'
+ROW_SUFFIX = '_ROW'
+
+# Keys taken from the quoted columns of a geometry table; a table is indexed by
+# those among its columns
+KEY_COLUMNS = ['VOLUME_ID', 'FILE_SPECIFICATION_NAME', 'SYSTEM_NAME', 'BODY_NAME']
+SPEC_KEY = 'FILE_SPECIFICATION_NAME'
+TIME_KEY = 'TIME'
+
+#===============================================================================
+def get_query_path(filename):
+    """Query index path for a table.
+
+    Args:
+        filename (str, Path, or FCPath): Path to the table file.
+
+    Returns:
+        FCPath: Path to the query index.
+    """
+    filename = FCPath(filename)
+    return filename.with_name(filename.stem + QUERY_SUFFIX)
+
+#===============================================================================
+def write_query_index(filename, index_filename=None, parts=None):
+    """Write the query index for a geometry table.
+
+    Args:
+        filename (str, Path, or FCPath): Path to the table file.
+        index_filename (str, Path, or FCPath, optional):
+            Path to an index table with FILE_SPECIFICATION_NAME and START_TIME
+            columns, e.g., the cumulative supplemental index, from which the
+            event time of each row is taken.  If not given, there is no TIME
+            key.
+        parts (list, optional):
+            Dictionaries describing consecutive parts of the table, with the 
+            byte "offset" and "nbytes" of each.  The rows of a part whose 
+            dictionary also contains "rows", as returned by read_query_rows() 
+            for those rows with offsets relative to the start of the part, are
+            not read again.  If not given, the whole table is read.
+
+    Raises:
+        FileNotFoundError: If the table has no label.
+
+    Returns:
+        None.
+    """
+    logger = meta.get_logger()
+
+    filename = FCPath(filename)
+    times = _read_times(index_filename) if index_filename else None
+    columns = _key_columns(filename)
+    splits = max(columns.values()) + 1 if columns else 0
+    local_path = filename.retrieve()
+    if parts is None:
+        parts = [{'offset': 0, 'nbytes': os.path.getsize(local_path)}]
+
+    # Read the keys and the offset of each row
+    offsets = []
+    values = {key: [] for key in list(columns) + [TIME_KEY]}
+    with open(local_path, 'rb') as f:
+        for part in parts:
+
+            # Carry forward the keys of known rows
+            rows = part.get('rows')
+            if rows is not None:
+                offsets += (rows['OFFSET'] + part['offset']).tolist()
+                for key in columns:
+                    if key in rows:
+                        values[key] += rows[key].tolist()
+                if times is not None and SPEC_KEY in rows:
+                    values[TIME_KEY] += [times.get(_file_key(spec.decode()), np.nan)
+                                         for spec in rows[SPEC_KEY]]
+                continue
+
+            # Otherwise, read the rows
+            offset = part['offset']
+            end = offset + part['nbytes']
+            f.seek(offset)
+            while offset < end:
+                line = f.readline()
+                if not line:
+                    break
+                offsets.append(offset)
+                offset += len(line)
+
+                fields = line.split(b',', splits)
+                for (key, colno) in columns.items():
+                    field = fields[colno].strip() if colno < len(fields) else b''
+                    if field.startswith(b'"'):
+                        values[key].append(field.strip(b'" \r\n'))
+
+                if times is not None and SPEC_KEY in columns:
+                    spec = _file_key(fields[columns[SPEC_KEY]].strip(b'" ').decode())
+                    values[TIME_KEY].append(times.get(spec, np.nan))
+
+    # Use only the keys present in every row
+    rows = len(offsets)
+    keys = [key for key in values if values[key] and len(values[key]) == rows]
+
+    # Sort each key
+    dtype = [('OFFSET', 'int64')]
+    columns = {'OFFSET': np.array(offsets, dtype='int64')}
+    for key in keys:
+        column = np.array(values[key])
+        order = np.argsort(column, kind='stable')
+        dtype += [(key, column.dtype), (key + ROW_SUFFIX, 'int64')]
+        columns[key] = column[order]
+        columns[key + ROW_SUFFIX] = order
+
+    array = np.empty(rows, dtype=dtype)
+    for name in columns:
+        array[name] = columns[name]
+
+    query_path = get_query_path(filename)
+    logger.info('Writing query index', query_path)
+    local_path = query_path.get_local_path()
+    np.save(local_path, array, allow_pickle=False)
+    query_path.upload()
+
+#===============================================================================
+def read_query_rows(filename):
+    """Key values of each row of a table, in table order, from its query index.
+
+    Args:
+        filename (str, Path, or FCPath): Path to the table file.
+
+    Returns:
+        dict: Array of values in table order for each key, and the array of 
+              row offsets as "OFFSET"; None if the table has no query index.
+    """
+    query_path = get_query_path(filename)
+    if not query_path.exists():
+        return None
+
+    array = np.load(query_path.retrieve(), allow_pickle=False)
+    rows = {'OFFSET': array['OFFSET']}
+    for name in array.dtype.names:
+        if name + ROW_SUFFIX in array.dtype.names:
+            column = np.empty_like(array[name])
+            column[array[name + ROW_SUFFIX]] = array[name]
+            rows[name] = column
+
+    return rows
+
+#===============================================================================
+def _key_columns(filename):
+    """Column numbers of the key columns of a table, from its label.
+
+    Args:
+        filename (FCPath): Path to the table file.
+
+    Returns:
+        dict: Column number, starting from zero, keyed by the name of each key
+              column present in the table.
+    """
+    label_path = filename.with_suffix('.lbl')
+    info = pdstable.Pds3TableInfo(label_path.retrieve())
+    return {name: info.column_info_dict[name].colno for name in KEY_COLUMNS
+                                                    if name in info.column_info_dict}
+
+#===============================================================================
+def _read_times(index_filename):
+    """Event times from an index table.
+
+    Args:
+        index_filename (str, Path, or FCPath): Path to the index table.
+
+    Returns:
+        dict: TAI start time keyed by the file specification name without its
+              extension.
+    """
+    index_filename = FCPath(index_filename)
+    label_path = index_filename.with_suffix('.lbl')
+    local_label_path = label_path.retrieve()
+    index_filename.retrieve()
+
+    table = pdstable.PdsTable(local_label_path,
+                              columns=['FILE_SPECIFICATION_NAME', 'START_TIME'])
+    specs = table.column_values['FILE_SPECIFICATION_NAME']
+    start_times = table.column_values['START_TIME']
+
+    times = {}
+    for (spec, start_time) in zip(specs, start_times):
+        times[_file_key(spec)] = _tai(start_time)
+
+    return times
+
+#===============================================================================
+def _file_key(spec):
+    """File specification name without its extension, for matching a table to
+    an index.
+
+    Args:
+        spec (str): File specification name.
+
+    Returns:
+        str: Matching key.
+    """
+    return os.path.splitext(spec.strip())[0].upper()
+
+#===============================================================================
+def _tai(time):
+    """TAI seconds for a time.
+
+    Args:
+        time (str or float): ISO time string, or TAI seconds.
+
+    Returns:
+        float: TAI seconds, or NaN if the time is not valid.
+    """
+    if not isinstance(time, str):
+        return float(time)
+
+    try:
+        return julian.tai_from_iso(time.strip().rstrip('Z'))
+    except Exception:
+        return np.nan
+
+################################################################################
+# QueryIndex class
+################################################################################
+class QueryIndex(object):
+    """Random-access queries of a table by key, using its query index.
+
+    The table and its query index are memory-mapped until close() is called,
+    or until the end of a with block.
+    """
+
+    #===========================================================================
+    def __init__(self, filename):
+        """Constructor for a QueryIndex object.
+
+        Args:
+            filename (str, Path, or FCPath): Path to the table file.
+        """
+        filename = FCPath(filename)
+        self.array = np.load(get_query_path(filename).retrieve(), mmap_mode='r')
+        self.keys = [name for name in self.array.dtype.names
+                              if name + ROW_SUFFIX in self.array.dtype.names]
+
+        with open(filename.retrieve(), 'rb') as f:
+            self.table = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    #===========================================================================
+    def __enter__(self):
+        return self
+
+    #===========================================================================
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    #===========================================================================
+    def close(self):
+        """Unmap the table and release the query index.
+
+        The query index is unmapped once no arrays taken from it remain.  
+        Closing an index that is already closed has no effect.
+        """
+        if self.table is not None:
+            self.table.close()
+        self.table = None
+        self.array = None
+
+    #===========================================================================
+    def _check_open(self):
+        """Raise ValueError if the index has been closed."""
+        if self.table is None:
+            raise ValueError('Query index is closed')
+
+    #===========================================================================
+    def find(self, key, value, stop=None):
+        """Numbers of the rows matching a key value or range, in table order.
+
+        Args:
+            key (str): 
+                VOLUME_ID, FILE_SPECIFICATION_NAME, SYSTEM_NAME, BODY_NAME, or 
+                TIME.
+            value (str or float):
+                Key value, or the start of the range if stop is given.  Times
+                are ISO strings or TAI seconds.
+            stop (str or float, optional):
+                End of the range, inclusive.
+
+        Returns:
+            np.ndarray: Row numbers.
+        """
+        self._check_open()
+        if key not in self.keys:
+            raise KeyError('No query index for %s' % key)
+
+        start = self._value(key, value)
+        stop = start if stop is None else self._value(key, stop)
+
+        column = self.array[key]
+        i = np.searchsorted(column, start, side='left')
+        j = np.searchsorted(column, stop, side='right')
+        return np.sort(self.array[key + ROW_SUFFIX][i:j])
+
+    #===========================================================================
+    def rows(self, key, value, stop=None):
+        """Rows matching a key value or range, in table order.
+
+        Args:
+            key (str): 
+                VOLUME_ID, FILE_SPECIFICATION_NAME, SYSTEM_NAME, BODY_NAME, or 
+                TIME.
+            value (str or float):
+                Key value, or the start of the range if stop is given.
+            stop (str or float, optional):
+                End of the range, inclusive.
+
+        Returns:
+            list: Rows as strings, without terminators.
+        """
+        return [self.row(i) for i in self.find(key, value, stop)]
+
+    #===========================================================================
+    def row(self, i):
+        """A row of the table.
+
+        Args:
+            i (int): Row number.
+
+        Returns:
+            str: Row, without its terminator.
+        """
+        self._check_open()
+        offsets = self.array['OFFSET']
+        start = offsets[i]
+        end = offsets[i+1] if i+1 < len(offsets) else len(self.table)
+        return self.table[start:end].decode('utf-8').rstrip('\r\n')
+
+    #===========================================================================
+    def _value(self, key, value):
+        """Key value in the form stored in the index.
+
+        Args:
+            key (str): Key name.
+            value (str or float): Key value.
+
+        Returns:
+            bytes or float: Stored value.
+        """
+        if key == TIME_KEY:
+            return _tai(value)
+        return value.strip().encode('utf-8')
+
+################################################################################
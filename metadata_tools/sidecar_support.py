@@ -0,0 +1,164 @@
+################################################################################
+# sidecar_support.py - Tools for columnar binary sidecars to metadata tables.
+################################################################################
+"""Columnar binary sidecars.
+
+A sidecar is a NumPy structured array saved in .npy format alongside a table,
+e.g., GO_0017_body_summary.npy next to GO_0017_body_summary.tab.  It contains
+one field per table column, named as in the PDS3 label, and a boolean field
+<name>_MASK for each column, True where the value is null or invalid.  The
+file can be loaded with a single memory map:
+
+    array = np.load('GO_0999_body_summary.npy', mmap_mode='r')
+"""
+import numpy as np
+import pdstable
+
+import metadata_tools as meta
+
+from filecache import FCPath
+
+MASK_SUFFIX = '_MASK'
+
+#===============================================================================
+def get_sidecar_path(filename):
+    """Sidecar path for a table.
+
+    Args:
+        filename (str, Path, or FCPath): Path to the table file.
+
+    Returns:
+        FCPath: Path to the sidecar.
+    """
+    return FCPath(filename).with_suffix('.npy')
+
+#===============================================================================
+def read_sidecar(filename, mmap=True):
+    """Read the sidecar for a table.
+
+    Args:
+        filename (str, Path, or FCPath): Path to the table or sidecar file.
+        mmap (bool, optional): If True, the array is memory-mapped.
+
+    Returns:
+        np.ndarray: Structured array of columns and masks.
+    """
+    local_path = get_sidecar_path(filename).retrieve()
+    return np.load(local_path, mmap_mode='r' if mmap else None)
+
+#===============================================================================
+def write_sidecar(filename, array=None):
+    """Write the sidecar for a table.
+
+    Args:
+        filename (str, Path, or FCPath): Path to the table file.
+        array (np.ndarray, optional):
+            Structured array to write.  If not given, it is built from the table
+            and its label.
+
+    Returns:
+        None.
+    """
+    logger = meta.get_logger()
+
+    if array is None:
+        array = table_to_array(filename)
+
+    sidecar_path = get_sidecar_path(filename)
+    logger.info('Writing sidecar', sidecar_path)
+    local_path = sidecar_path.get_local_path()
+    np.save(local_path, array, allow_pickle=False)
+    sidecar_path.upload()
+
+#===============================================================================
+def table_to_array(filename):
+    """Build the sidecar array for a table from its label.
+
+    Args:
+        filename (str, Path, or FCPath): Path to the table file.
+
+    Returns:
+        np.ndarray: Structured array of columns and masks.
+    """
+    filename = FCPath(filename)
+    label_path = filename.with_suffix('.lbl')
+
+    local_label_path = label_path.retrieve()
+    filename.retrieve()
+    table = pdstable.PdsTable(local_label_path)
+
+    # Build the dtype from the columns
+    names = table.get_keys()
+    dtype = []
+    for name in names:
+        values = np.asarray(table.column_values[name])
+        dtype += [(name, values.dtype, values.shape[1:]),
+                  (name + MASK_SUFFIX, 'bool', values.shape[1:])]
+
+    # Fill in the columns
+    array = np.zeros(table.info.rows, dtype=dtype)
+    for name in names:
+        array[name] = table.column_values[name]
+        mask = table.column_masks.get(name)
+        if mask is not None:
+            array[name + MASK_SUFFIX] = mask
+
+    return array
+
+#===============================================================================
+def concatenate_sidecars(sources, output):
+    """Concatenate the sidecars for a set of tables into a single sidecar.
+
+    String fields are widened as needed to hold the longest value.
+
+    Args:
+        sources (list): 
+            Paths to the tables whose sidecars to concatenate, or, for tables
+            whose rows are already at hand, structured arrays of those rows.
+        output (str, Path, or FCPath): Path to the cumulative table file.
+
+    Returns:
+        bool: True if the sidecar was written; False if any input sidecar was
+              missing or the column layouts differ.
+    """
+    logger = meta.get_logger()
+
+    # Map the inputs
+    arrays = []
+    for source in sources:
+        if isinstance(source, np.ndarray):
+            arrays.append(source)
+            continue
+        if not get_sidecar_path(source).exists():
+            logger.warn('Missing sidecar', get_sidecar_path(source))
+            return False
+        arrays.append(read_sidecar(source))
+
+    if not arrays:
+        return False
+
+    # Promote the field types across inputs
+    names = arrays[0].dtype.names
+    if any(array.dtype.names != names for array in arrays):
+        logger.warn('Inconsistent sidecar columns for', output)
+        return False
+
+    dtype = []
+    for name in names:
+        field_dtype = arrays[0].dtype[name]
+        for array in arrays[1:]:
+            field_dtype = np.promote_types(field_dtype.base, array.dtype[name].base)
+        dtype += [(name, field_dtype.base, arrays[0].dtype[name].shape)]
+
+    # Copy the inputs
+    result = np.empty(sum(len(array) for array in arrays), dtype=dtype)
+    start = 0
+    for array in arrays:
+        for name in names:
+            result[name][start:start+len(array)] = array[name]
+        start += len(array)
+
+    write_sidecar(output, result)
+    return True
+
+################################################################################
@@ -1,8 +1,13 @@
 ################################################################################
 # util.py: Utility functions
 ################################################################################
+import io
 import os
 import re
+import pickle
+import hashlib
+import tempfile
+import threading
 import numpy as np
 
 from pathlib                import Path
@@ -301,6 +306,598 @@ def write_txt_file(filespec, content, terminator='\r\n'):        ### move to uti
     # Write file
     filespec.write_text(content, encoding='utf-8')
 
+#===============================================================================
+def append_txt_file(filespec, f, chunk_size=2**24, summary=None):
+    """Append a text file to an open binary file with CRLF line terminators,
+    copying the bytes a chunk at a time.
+
+    Lines are copied unchanged if they already end in CRLF; otherwise their 
+    terminators are replaced.  A missing terminator at the end of the file is
+    added.
+
+    Args:
+        filespec (str, Path, or FCPath): Path to the file to append.
+        f (file): Binary file object to write.
+        chunk_size (int, optional): Number of bytes to read at a time.
+        summary (label_support.TableSummary, optional): 
+            If given, the lines are added to this summary as they are copied.
+
+    Returns:
+        tuple: (records, record_bytes, nbytes, digest), the number of lines 
+               written, the length of the longest including its terminator, the
+               number of bytes written, and their SHA-1 hex digest.
+    """
+    records = 0
+    record_bytes = 0
+    nbytes = 0
+    sha1 = hashlib.sha1()
+
+    local_path = expandvars(FCPath(filespec)).retrieve()
+    with open(local_path, 'rb') as g:
+        tail = b''
+        while True:
+            chunk = g.read(chunk_size)
+            if not chunk and not tail:
+                break
+
+            # Copy the complete lines, carrying over any partial line; 
+            # terminate a final partial line
+            chunk = tail + chunk if chunk else tail.rstrip(b'\r') + b'\r\n'
+            end = chunk.rfind(b'\n') + 1
+            tail = chunk[end:]
+            if end:
+                (block, n, length) = _crlf_block(chunk[:end])
+                f.write(block)
+                sha1.update(block)
+                records += n
+                record_bytes = max(record_bytes, length)
+                nbytes += len(block)
+                if summary is not None:
+                    summary.add(block.decode('utf-8').split('\r\n')[:-1])
+
+    return (records, record_bytes, nbytes, sha1.hexdigest())
+
+#===============================================================================
+def _crlf_block(block):
+    """Ensure that every line of a block of text ends in CRLF.
+
+    Args:
+        block (bytes): Complete lines of text, ending in LF.
+
+    Returns:
+        tuple: (block, records, record_bytes), where block is the text with CRLF 
+               terminators, records is the number of lines, and record_bytes is
+               the length of the longest, including its terminator.
+    """
+    lines = block.split(b'\n')[:-1]
+
+    # Replace any terminators other than CRLF
+    if block.count(b'\r\n') != len(lines):
+        lines = [line.rstrip(b'\r') + b'\r' for line in lines]
+        block = b'\n'.join(lines) + b'\n'
+
+    return (block, len(lines), max(len(line) for line in lines) + 1)
+
+#===============================================================================
+# Partial file reads
+#===============================================================================
+
+# Running totals for header-only reads: files, bytes read, and full file sizes
+_PARTIAL_READS = {'files': 0, 'bytes': 0, 'file_bytes': 0}
+_PARTIAL_READS_LOCK = threading.Lock()
+
+# VICAR labels read ahead of use, keyed by path
+_PREFETCHED_VICAR_LABELS = {}
+_MAX_PREFETCHED_VICAR_LABELS = 256
+
+# Remote sources for range reads, keyed by scheme, bucket, and anonymity
+_RANGE_SOURCES = {}
+
+#===============================================================================
+class RangeFile(io.RawIOBase):
+    """Read-only, seekable file object that reads only the requested bytes of a 
+    local or remote file.
+
+    Remote files are read using range requests, a block at a time, through the
+    same storage clients FileCache uses to retrieve them.  A remote file already
+    in the local cache is read from there.  Reads beyond the end of the file 
+    return no bytes.
+    """
+
+    #===========================================================================
+    def __init__(self, filespec, block_size=4096):
+        """Constructor for a RangeFile object.
+
+        Args:
+            filespec (str, Path, or FCPath): Path to the file.
+            block_size (int, optional): Minimum number of bytes per request.
+        """
+        self.filespec = expandvars(FCPath(filespec))
+        self.name = self.filespec.as_posix()
+        self.block_size = block_size
+        self.bytes_read = 0
+
+        self.position = 0
+        self.buffer_start = 0
+        self.buffer = b''
+
+    #===========================================================================
+    def readable(self):
+        return True
+
+    #===========================================================================
+    def seekable(self):
+        return True
+
+    #===========================================================================
+    def tell(self):
+        return self.position
+
+    #===========================================================================
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence != io.SEEK_SET:
+            raise io.UnsupportedOperation('only absolute seeks are supported')
+        self.position = offset
+        return self.position
+
+    #===========================================================================
+    def read(self, size=-1):
+        """Read bytes from the current position.
+
+        Args:
+            size (int, optional): Number of bytes; -1 for the rest of the file.
+
+        Returns:
+            bytes: Bytes read.
+        """
+        start = self.position - self.buffer_start
+
+        # The rest of the file extends beyond any buffer
+        if size is None or size < 0:
+            data = self._read_range(self.position)
+            self.bytes_read += len(data)
+            self.position += len(data)
+            return data
+
+        # Fetch a new block if the buffer does not cover the request
+        end = start + size
+        if start < 0 or end > len(self.buffer):
+            self.buffer = self._read_range(self.position, max(size, self.block_size))
+            self.buffer_start = self.position
+            self.bytes_read += len(self.buffer)
+            start = 0
+            end = size
+
+        data = self.buffer[start:end]
+        self.position += len(data)
+        return data
+
+    #===========================================================================
+    def _read_range(self, start, length=None):
+        """Read a range of bytes from the file.
+
+        Args:
+            start (int): Offset of the first byte.
+            length (int, optional): Number of bytes; None for the rest of the file.
+
+        Returns:
+            bytes: Bytes read, possibly fewer than requested at the end of the file.
+        """
+        # Local file, or a remote file already in the cache
+        if self.filespec.is_local():
+            local_path = self.filespec.as_posix()
+        else:
+            local_path = self.filespec.get_local_path()
+            if not os.path.exists(local_path):
+                local_path = None
+
+        if local_path:
+            with open(local_path, 'rb') as f:
+                f.seek(start)
+                return f.read(-1 if length is None else length)
+
+        (source, sub_path) = _range_source(self.filespec)
+        stop = None if length is None else start + length - 1
+        return source.read_range(sub_path, start, stop)
+
+#===============================================================================
+class _RangeSourceGS(object):
+    """Google Storage bucket from which byte ranges are read."""
+
+    #===========================================================================
+    def __init__(self, scheme, remote, anonymous=False):
+        """Constructor for a Google Storage range source.
+
+        Args:
+            scheme (str): URL scheme, "gs".
+            remote (str): Name of the bucket.
+            anonymous (bool, optional): True to access the bucket without 
+                credentials.
+        """
+        from google.cloud import storage
+
+        client = (storage.Client.create_anonymous_client() if anonymous
+                  else storage.Client())
+        self.prefix = '%s://%s/' % (scheme, remote)
+        self.bucket = client.bucket(remote)
+
+    #===========================================================================
+    def read_range(self, sub_path, start, stop=None):
+        """Read a range of bytes from a blob.
+
+        Args:
+            sub_path (str): Path of the blob within the bucket.
+            start (int): Offset of the first byte.
+            stop (int, optional): Offset of the last byte; None for the end.
+
+        Returns:
+            bytes: Bytes read.
+        """
+        import google.cloud.exceptions
+        import google.api_core.exceptions
+
+        try:
+            return self.bucket.blob(sub_path).download_as_bytes(start=start, end=stop)
+        except google.api_core.exceptions.RequestRangeNotSatisfiable:
+            return b''
+        except google.cloud.exceptions.NotFound:
+            raise FileNotFoundError(self.prefix + sub_path)
+
+#===============================================================================
+class _RangeSourceS3(object):
+    """AWS S3 bucket from which byte ranges are read."""
+
+    #===========================================================================
+    def __init__(self, scheme, remote, anonymous=False):
+        """Constructor for an AWS S3 range source.
+
+        Args:
+            scheme (str): URL scheme, "s3".
+            remote (str): Name of the bucket.
+            anonymous (bool, optional): True to access the bucket without 
+                credentials.
+        """
+        import boto3
+        import botocore
+
+        if anonymous:
+            config = botocore.client.Config(signature_version=botocore.UNSIGNED)
+            self.client = boto3.client('s3', config=config)
+        else:
+            self.client = boto3.client('s3')
+        self.prefix = '%s://%s/' % (scheme, remote)
+        self.bucket_name = remote
+
+    #===========================================================================
+    def read_range(self, sub_path, start, stop=None):
+        """Read a range of bytes from an object.
+
+        Args:
+            sub_path (str): Key of the object within the bucket.
+            start (int): Offset of the first byte.
+            stop (int, optional): Offset of the last byte; None for the end.
+
+        Returns:
+            bytes: Bytes read.
+        """
+        client = self.client
+        byte_range = 'bytes=%d-%s' % (start, '' if stop is None else stop)
+        try:
+            response = client.get_object(Bucket=self.bucket_name, Key=sub_path,
+                                         Range=byte_range)
+        except client.exceptions.NoSuchKey:
+            raise FileNotFoundError(self.prefix + sub_path)
+        except client.exceptions.ClientError as err:
+            if err.response['Error']['Code'] == 'InvalidRange':
+                return b''
+            raise
+        return response['Body'].read()
+
+#===============================================================================
+class _RangeSourceHTTP(object):
+    """Web server from which byte ranges are read."""
+
+    #===========================================================================
+    def __init__(self, scheme, remote, anonymous=False):
+        """Constructor for an HTTP range source.
+
+        Args:
+            scheme (str): URL scheme, "http" or "https".
+            remote (str): Name of the server.
+            anonymous (bool, optional): Not used.
+        """
+        self.prefix = '%s://%s/' % (scheme, remote)
+
+    #===========================================================================
+    def read_range(self, sub_path, start, stop=None):
+        """Read a range of bytes from a URL.
+
+        Args:
+            sub_path (str): Path of the file on the server.
+            start (int): Offset of the first byte.
+            stop (int, optional): Offset of the last byte; None for the end.
+
+        Returns:
+            bytes: Bytes read.
+        """
+        import requests
+
+        url = self.prefix + sub_path
+        byte_range = 'bytes=%d-%s' % (start, '' if stop is None else stop)
+        response = requests.get(url, headers={'Range': byte_range}, timeout=30)
+        if response.status_code == 416:
+            return b''
+        if response.status_code == 404:
+            raise FileNotFoundError(url)
+        response.raise_for_status()
+
+        # A server that ignores the range returns the whole file
+        data = response.content
+        if response.status_code == 200:
+            data = data[start:] if stop is None else data[start:stop+1]
+        return data
+
+_RANGE_SOURCE_CLASSES = {'gs': _RangeSourceGS, 's3': _RangeSourceS3,
+                         'http': _RangeSourceHTTP, 'https': _RangeSourceHTTP}
+
+#===============================================================================
+def _range_source(filespec):
+    """Source for range reads of a remote file.
+
+    Sources are shared by all files in the same bucket or on the same server.
+
+    Args:
+        filespec (FCPath): Path to the remote file.
+
+    Returns:
+        tuple: (source, sub_path) where source has a read_range() method and
+        sub_path is the path of the file relative to the source.
+    """
+    (scheme, _, path) = filespec.as_posix().partition('://')
+    (remote, _, sub_path) = path.partition('/')
+    if scheme not in _RANGE_SOURCE_CLASSES:
+        raise ValueError('Range reads are not supported for %s' % filespec)
+
+    anonymous = filespec.filecache.is_anonymous
+    key = (scheme, remote, anonymous)
+    with _PARTIAL_READS_LOCK:
+        if key not in _RANGE_SOURCES:
+            _RANGE_SOURCES[key] = _RANGE_SOURCE_CLASSES[scheme](scheme, remote,
+                                                                anonymous=anonymous)
+        return (_RANGE_SOURCES[key], sub_path)
+
+#===============================================================================
+def read_vicar_label(filespec, prefetch=False):
+    """Read the VICAR label of a file, including any EOL label, without reading
+    the image data.
+
+    Only the label bytes are read, using range requests for remote files.
+
+    Args:
+        filespec (str, Path, or FCPath): Path to the VICAR file.
+        prefetch (bool, optional): 
+            If True, the label is held for a subsequent call for the same file,
+            e.g., from a key function.
+
+    Returns:
+        vicar.VicarLabel: VICAR label.
+
+    Raises:
+        FileNotFoundError: If the file does not exist.
+        vicar.VicarError: If the file does not conform to the VICAR standard.
+    """
+    import vicar
+
+    key = FCPath(filespec).as_posix()
+    with _PARTIAL_READS_LOCK:
+        viclab = _PREFETCHED_VICAR_LABELS.pop(key, None)
+    if viclab is not None:
+        return viclab
+
+    label = cached_label('vicar', filespec, _read_vicar_header)
+    viclab = vicar.VicarLabel(label, strict=False)
+
+    if prefetch:
+        with _PARTIAL_READS_LOCK:
+            if len(_PREFETCHED_VICAR_LABELS) < _MAX_PREFETCHED_VICAR_LABELS:
+                _PREFETCHED_VICAR_LABELS[key] = viclab
+
+    return viclab
+
+#===============================================================================
+def _read_vicar_header(filespec):
+    """Read the text of the VICAR label of a file, including any EOL label.
+
+    Args:
+        filespec (str, Path, or FCPath): Path to the VICAR file.
+
+    Returns:
+        str: Text of the VICAR label.
+    """
+    import vicar
+
+    f = RangeFile(filespec)
+    label = vicar.VicarLabel.read_label(f)
+    viclab = vicar.VicarLabel(label, strict=False)
+
+    # Size of the full file, from the label
+    ndata = viclab['NL'] * (viclab['NS'] if viclab['ORG'] == 'BIP' else viclab['NB'])
+    file_bytes = (viclab['LBLSIZE'] + viclab['RECSIZE'] * (viclab.get('NLB', 0) + ndata)
+                  + viclab.get(('LBLSIZE', 1), 0))
+
+    with _PARTIAL_READS_LOCK:
+        _PARTIAL_READS['files'] += 1
+        _PARTIAL_READS['bytes'] += f.bytes_read
+        _PARTIAL_READS['file_bytes'] += file_bytes
+
+    return label
+
+#===============================================================================
+def partial_read_stats(reset=False):
+    """Totals for the header-only reads made by read_vicar_label().
+
+    Args:
+        reset (bool, optional): If True, the totals are reset.
+
+    Returns:
+        dict: Number of "files", "bytes" read, and full "file_bytes".
+    """
+    with _PARTIAL_READS_LOCK:
+        stats = dict(_PARTIAL_READS)
+        if reset:
+            for key in _PARTIAL_READS:
+                _PARTIAL_READS[key] = 0
+
+    return stats
+
+#===============================================================================
+# Parsed-label cache
+#===============================================================================
+
+# Local directory for cached labels
+LABEL_CACHE_DIR = defs.CACHE_DIR / 'labels'
+
+# Label cache in use by cached_label(), if any
+_LABEL_CACHE = None
+
+#===============================================================================
+class LabelCache(object):
+    """On-disk cache of parsed labels and other values read from files.
+
+    Each value is keyed by its kind, e.g., "pds3", and the path of the file it
+    was read from.  It is valid while the size and modification time of a 
+    local file, or the modification time of a remote file, are unchanged.
+    The cache is a local pickle file, loaded when the object is constructed and
+    rewritten by save().
+    """
+
+    #===========================================================================
+    def __init__(self, input_dir, volume_id, cache_dir=None):
+        """Constructor for a LabelCache object.
+
+        Args:
+            input_dir (str, Path, or FCPath): Directory containing the volume.
+            volume_id (str): Volume ID.
+            cache_dir (str or Path, optional): 
+                Cache directory; default is LABEL_CACHE_DIR.
+        """
+        digest = hashlib.sha1(FCPath(input_dir).as_posix().encode()).hexdigest()
+        self.path = (Path(cache_dir or LABEL_CACHE_DIR) / 
+                     (digest[:12] + '_' + volume_id + '_labels.pickle'))
+
+        self.lock = threading.Lock()
+        self.modified = False
+        self.hits = 0
+        self.misses = 0
+
+        # A missing or unreadable cache is treated as empty
+        self.entries = {}
+        try:
+            with open(self.path, 'rb') as f:
+                self.entries = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pass
+
+    #===========================================================================
+    def get(self, kind, filespec, reader):
+        """Value read from a file, from the cache if the file is unchanged.
+
+        Args:
+            kind (str): Kind of value, e.g., "pds3" or "vicar".
+            filespec (str, Path, or FCPath): Path to the file.
+            reader (function): 
+                Function of the file path that reads the value if it is not
+                cached.
+
+        Returns:
+            Value read from the file.
+        """
+        filespec = FCPath(filespec)
+        key = (kind, filespec.as_posix())
+        stamp = file_stamp(filespec)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and stamp is not None and entry[0] == stamp:
+                self.hits += 1
+                return entry[1]
+
+        value = reader(filespec)
+
+        with self.lock:
+            self.misses += 1
+            if stamp is not None:
+                self.entries[key] = (stamp, value)
+                self.modified = True
+
+        return value
+
+    #===========================================================================
+    def save(self):
+        """Write the cache if it has changed.
+
+        Returns:
+            None.
+        """
+        if not self.modified:
+            return
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        (fd, temp_path) = tempfile.mkstemp(dir=self.path.parent, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(self.entries, f)
+        os.replace(temp_path, self.path)
+        self.modified = False
+
+#===============================================================================
+def use_label_cache(cache):
+    """Set the label cache used by cached_label().
+
+    Args:
+        cache (LabelCache): Label cache, or None to read files directly.
+
+    Returns:
+        None.
+    """
+    global _LABEL_CACHE
+    _LABEL_CACHE = cache
+
+#===============================================================================
+def cached_label(kind, filespec, reader):
+    """Value read from a file, using the label cache if one is in use.
+
+    Args:
+        kind (str): Kind of value, e.g., "pds3" or "vicar".
+        filespec (str, Path, or FCPath): Path to the file.
+        reader (function): Function of the file path that reads the value.
+
+    Returns:
+        Value read from the file.
+    """
+    if _LABEL_CACHE is None:
+        return reader(FCPath(filespec))
+    return _LABEL_CACHE.get(kind, filespec, reader)
+
+#===============================================================================
+def file_stamp(filespec):
+    """Size and modification time of a local file, or the modification time of
+    a remote file.
+
+    Args:
+        filespec (FCPath): Path to the file.
+
+    Returns:
+        tuple or float: Stamp identifying the version of the file, or None if
+                        it cannot be determined.
+    """
+    try:
+        if filespec.is_local():
+            stat = os.stat(filespec.get_local_path())
+            return (stat.st_size, stat.st_mtime_ns)
+        return filespec.modification_time()
+    except FileNotFoundError:
+        return None
+
 #===============================================================================
 def rebase(x, bases, ceil=False):           ### move to utilities
     """Convert a decimal number to a different base.
@@ -0,0 +1,248 @@
+################################################################################
+# tests/test_cumulative_support.py
+################################################################################
+import os
+import pathlib
+import sys
+import tempfile
+import unittest
+
+from unittest import mock
+
+from filecache import FCPath
+
+from tests.test_query_support import write_table
+
+# The cumulative tools read the host configuration, which loads the SPICE kernels
+HOST_DIR = os.path.join(os.path.dirname(__file__), '..',
+                        'metadata_tools', 'hosts', 'GO_0xxx')
+if HOST_DIR not in sys.path:
+    sys.path.append(HOST_DIR)
+
+try:
+    import metadata_tools.cumulative_support as cml
+except Exception as e:
+    cml = None
+    SKIP_REASON = 'Cumulative tools unavailable: %r' % e
+
+@unittest.skipIf(cml is None, cml is None and SKIP_REASON)
+class Test_Find_Volumes(unittest.TestCase):
+
+    #===========================================================================
+    # test the cached list of volumes
+    def test_walk_cache(self):
+
+        with tempfile.TemporaryDirectory() as tempdir, \
+             tempfile.TemporaryDirectory() as cache_dir, \
+             mock.patch.object(cml, 'WALK_CACHE_DIR', pathlib.Path(cache_dir)):
+            tree = FCPath(tempdir)
+            cumulative_dir = tree / 'GO_0999'
+            for name in ['GO_0017', 'GO_0018', 'GO_0999']:
+                os.mkdir((tree / name).path)
+                open((tree / name / 'index.tab').path, 'w').close()
+
+            def find():
+                return [(root.name, files) for (root, files)
+                        in cml._find_volumes(tree, cumulative_dir, 'GO_????',
+                                             walk_cache=True)]
+
+            volumes = find()
+            self.assertEqual(volumes, [('GO_0017', ['index.tab']),
+                                       ('GO_0018', ['index.tab'])])
+
+            # The saved walk is reused while the tree is unchanged...
+            with mock.patch.object(FCPath, 'walk') as walk:
+                self.assertEqual(find(), volumes)
+                walk.assert_not_called()
+
+            # ...but not after a volume is added
+            os.mkdir((tree / 'GO_0019').path)
+            self.assertEqual(find(), volumes + [('GO_0019', [])])
+
+            # ...or after it expires
+            with mock.patch.object(cml, 'WALK_CACHE_MAX_AGE', 0), \
+                 mock.patch.object(FCPath, 'walk', return_value=[]) as walk:
+                self.assertEqual(find(), [])
+                walk.assert_called_once()
+
+
+# Columns of the tables written by Test_Concatenate
+COLUMNS = [('VOLUME_ID', 'CHARACTER', 7),
+           ('FILE_SPECIFICATION_NAME', 'CHARACTER', 9),
+           ('BODY_NAME', 'CHARACTER', 8),
+           ('MINIMUM_PHASE', 'ASCII_REAL', 8)]
+
+@unittest.skipIf(cml is None, cml is None and SKIP_REASON)
+class Test_Concatenate(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.root = FCPath(self.tempdir.name)
+        self.cumulative_file = self.root / 'GO_0999_body_summary.tab'
+        self.tables = {}
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    #===========================================================================
+    def write_table(self, volume_id, count, newline='\r\n'):
+        """Write a volume table with the given number of rows."""
+        lines = ['"%s","C%04d.IMG","EUROPA  ",%8.3f' % (volume_id, 10*i, i + 0.5)
+                 for i in range(count)]
+        table_file = self.root / (volume_id + '_body_summary.tab')
+        with open(table_file.path, 'w', newline='') as f:
+            f.write(''.join(line + newline for line in lines))
+        self.tables[volume_id] = lines
+        return table_file
+
+    #===========================================================================
+    def concatenate(self, volume_ids, verify=False):
+        """Incrementally rebuild the cumulative table; return the names of the 
+        volume tables that were read."""
+        table_files = [self.root / (volume_id + '_body_summary.tab') 
+                       for volume_id in volume_ids]
+
+        read = []
+        append_txt_file = cml.util.append_txt_file
+        def append(table_file, f, **kwargs):
+            read.append(table_file.name[:7])
+            return append_txt_file(table_file, f, **kwargs)
+
+        with mock.patch.object(cml.util, 'append_txt_file', append):
+            (segments, reused) = cml._concatenate(table_files, self.cumulative_file,
+                                                  incremental=True, verify=verify,
+                                                  chunk_size=64)
+        for segment in segments:
+            segment.update({'sidecar': False, 'query': False})
+        cml._write_segments(self.cumulative_file, segments)
+
+        # The table is the concatenation of the volume tables
+        with open(self.cumulative_file.path, newline='') as f:
+            content = f.read()
+        self.assertEqual(content, ''.join(line + '\r\n' for volume_id in volume_ids
+                                          for line in self.tables[volume_id]))
+        self.assertEqual([segment['row'] for segment in segments],
+                         [sum(len(self.tables[v]) for v in volume_ids[:i]) 
+                          for i in range(len(volume_ids))])
+        return (read, segments, reused)
+
+    #===========================================================================
+    # test appending, replacing, and removing volume tables
+    def test_incremental(self):
+
+        # A new table reads every volume table, with any line terminators
+        self.write_table('GO_0017', 3, newline='\n')
+        self.write_table('GO_0018', 5)
+        self.write_table('GO_0019', 2)
+        (read, _, reused) = self.concatenate(['GO_0017', 'GO_0018', 'GO_0019'])
+        self.assertEqual(read, ['GO_0017', 'GO_0018', 'GO_0019'])
+        self.assertEqual(reused, [None, None, None])
+
+        # Append: only the new volume table is read
+        self.write_table('GO_0020', 4)
+        (read, segments, reused) = self.concatenate(['GO_0017', 'GO_0018', 
+                                                     'GO_0019', 'GO_0020'])
+        self.assertEqual(read, ['GO_0020'])
+        self.assertEqual(segments[3]['records'], 4)
+        self.assertEqual(cml.lab.TableSummary.from_dict(segments[3]['summary']).rows, 4)
+
+        # Replace: only the changed volume table is read
+        table_file = self.write_table('GO_0018', 6)
+        stamp = os.stat(table_file.path).st_mtime + 10
+        os.utime(table_file.path, (stamp, stamp))
+        (read, _, reused) = self.concatenate(['GO_0017', 'GO_0018', 
+                                              'GO_0019', 'GO_0020'])
+        self.assertEqual(read, ['GO_0018'])
+        self.assertEqual([bool(segment) for segment in reused], 
+                         [True, False, True, True])
+
+        # Remove: no volume table is read
+        (read, _, _) = self.concatenate(['GO_0017', 'GO_0019', 'GO_0020'])
+        self.assertEqual(read, [])
+
+    #===========================================================================
+    # test a segment whose last row has changed
+    def test_ends(self):
+
+        self.write_table('GO_0017', 3)
+        self.write_table('GO_0018', 3)
+        self.concatenate(['GO_0017', 'GO_0018'])
+
+        # While the cumulative table is unchanged, its segments are not read
+        with mock.patch.object(cml, '_segment_ends', 
+                               wraps=cml._segment_ends) as ends:
+            (read, _, _) = self.concatenate(['GO_0017', 'GO_0018'])
+        self.assertEqual(read, [])
+        self.assertEqual(ends.call_count, 0)
+
+        # Overwrite bytes of the second segment without changing its size
+        with open(self.cumulative_file.path, 'r+b') as f:
+            f.seek(-5, os.SEEK_END)
+            f.write(b'99999')
+
+        (read, _, reused) = self.concatenate(['GO_0017', 'GO_0018'])
+        self.assertEqual(read, ['GO_0018'])
+        self.assertIsNone(reused[1])
+
+    #===========================================================================
+    # test a segment whose bytes no longer match its digest
+    def test_digest(self):
+
+        self.write_table('GO_0017', 3)
+        self.write_table('GO_0018', 3)
+        self.concatenate(['GO_0017', 'GO_0018'])
+
+        # Overwrite a middle row of the second segment, restoring the stamp of 
+        # the table; only the digest detects the change
+        stat = os.stat(self.cumulative_file.path)
+        line = len(self.tables['GO_0017'][0]) + 2
+        with open(self.cumulative_file.path, 'r+b') as f:
+            f.seek(4 * line + line - 7)
+            f.write(b'99999')
+        os.utime(self.cumulative_file.path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        (read, _, reused) = self.concatenate(['GO_0017', 'GO_0018'], verify=True)
+        self.assertEqual(read, ['GO_0018'])
+        self.assertIsNone(reused[1])
+
+    #===========================================================================
+    # test that segments are saved only for incremental updates
+    def test_segments_file(self):
+
+        table_file = self.write_table('GO_0017', 3)
+        segments_path = cml._get_segments_path(self.cumulative_file)
+        self.concatenate(['GO_0017'])
+        self.assertTrue(segments_path.exists())
+
+        cml._concatenate([table_file], self.cumulative_file, incremental=False)
+        self.assertFalse(segments_path.exists())
+
+    #===========================================================================
+    # test the query index carried forward from reused segments
+    def test_query_index(self):
+
+        # The label locates the key columns
+        write_table(self.cumulative_file.path, COLUMNS, [('', '', '', 0.)])
+
+        for volume_id in ['GO_0017', 'GO_0018', 'GO_0019']:
+            self.write_table(volume_id, 3)
+        (_, segments, reused) = self.concatenate(['GO_0017', 'GO_0018', 'GO_0019'])
+        cml._write_query_index(self.cumulative_file, None, segments, reused)
+        self.assertTrue(all(segment['query'] for segment in segments))
+        cml._write_segments(self.cumulative_file, segments)
+
+        # Remove a volume; the keys of the other volumes are carried forward
+        (_, segments, reused) = self.concatenate(['GO_0017', 'GO_0019'])
+        with mock.patch.object(cml.query, 'write_query_index', 
+                               wraps=cml.query.write_query_index) as write:
+            cml._write_query_index(self.cumulative_file, None, segments, reused)
+        self.assertTrue(all('rows' in part for part in write.call_args.kwargs['parts']))
+        carried = cml.query.read_query_rows(self.cumulative_file)
+
+        cml.query.write_query_index(self.cumulative_file)
+        rows = cml.query.read_query_rows(self.cumulative_file)
+        self.assertEqual(sorted(carried), sorted(rows))
+        for key in rows:
+            self.assertEqual(carried[key].tolist(), rows[key].tolist(), key)
+
+################################################################################
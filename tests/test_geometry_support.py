@@ -0,0 +1,750 @@
+################################################################################
+# tests/test_geometry_support.py
+################################################################################
+import os
+import inspect
+import json
+import pathlib
+import subprocess
+import sys
+import tempfile
+import types
+import unittest
+import warnings
+
+from unittest import mock
+
+import numpy as np
+
+from filecache import FCPath
+
+# The geometry tools read the host configuration, which loads the SPICE kernels
+HOST_DIR = os.path.join(os.path.dirname(__file__), '..',
+                        'metadata_tools', 'hosts', 'GO_0xxx')
+if HOST_DIR not in sys.path:
+    sys.path.append(HOST_DIR)
+
+try:
+    import metadata_tools.geometry_support as geom
+except Exception as e:
+    geom = None
+    SKIP_REASON = 'Geometry tools unavailable: %r' % e
+
+if geom is not None:
+    class Counting_Suite(geom.Suite):
+        """Suite whose observations need no geometry, but leave a marker file."""
+        def process(self, index):
+            open(self.output_dir.joinpath('obs%d' % index).path, 'w').close()
+            return True
+
+    class Row_Suite(geom.Suite):
+        """Suite whose observations need no geometry, but add one row to each
+        table unless they are marked as failing."""
+        def process(self, index):
+            basename = self.observations[index].basename
+            if basename.endswith('FAIL'):
+                return False
+            for table in self.tables:
+                table.rows.append('"%s","%s"' % (self.volume_id, basename))
+            return True
+
+@unittest.skipIf(geom is None, geom is None and SKIP_REASON)
+class Test_MaskCache(unittest.TestCase):
+
+    #===========================================================================
+    # test the normalized mask keys
+    def test_key(self):
+        cache = geom.MaskCache(None, 'JUPITER')
+
+        # Codes are sorted and duplicates removed
+        self.assertEqual(cache.key('IO', ('PP', '', '')), ('IO', 'P', '', '', None))
+        self.assertEqual(cache.key('IO', ('MP', 'P', 'DN'), blocker='EUROPA'),
+                         ('IO', 'MP', 'P', 'DN', 'EUROPA'))
+
+        # Rings only apply to Saturn
+        self.assertEqual(cache.key('IO', ('PR', 'R', '')), ('IO', 'P', '', '', None))
+        saturn = geom.MaskCache(None, 'SATURN')
+        self.assertEqual(saturn.key('MIMAS', ('RP', 'R', '')),
+                         ('MIMAS', 'PR', 'R', '', None))
+
+        # "M" needs a blocker other than the target, which is otherwise dropped
+        self.assertEqual(cache.key('IO', ('PM', '', '')), ('IO', 'P', '', '', None))
+        self.assertEqual(cache.key('IO', ('PM', '', ''), blocker='IO'),
+                         ('IO', 'P', '', '', None))
+        self.assertEqual(cache.key('IO', ('P', '', ''), blocker='EUROPA'),
+                         ('IO', 'P', '', '', None))
+        self.assertEqual(cache.key('IO', ('P', 'M', ''), blocker='EUROPA'),
+                         ('IO', 'P', 'M', '', 'EUROPA'))
+
+        # Shadow and face codes are dropped if shadows are ignored
+        self.assertEqual(cache.key('IO', ('P', 'PM', 'D'), blocker='EUROPA',
+                                   ignore_shadows=True),
+                         ('IO', 'P', '', '', None))
+        self.assertEqual(cache.key('IO', ('P', '', 'DX')), ('IO', 'P', '', 'D', None))
+
+    #===========================================================================
+    # test that equivalent requests share a mask
+    def test_get(self):
+        cache = geom.MaskCache(None, 'JUPITER')
+        with mock.patch.object(geom.Record, '_construct_excluded_mask',
+                               side_effect=lambda *args, **kwargs: object()) as build:
+            mask = cache.get('IO', ('PP', '', ''))
+            self.assertIs(cache.get('IO', ('P', '', 'X')), mask)
+            self.assertIs(cache.get('IO', ('PM', '', '')), mask)
+            self.assertIsNot(cache.get('EUROPA', ('P', '', '')), mask)
+
+        self.assertEqual(build.call_count, 2)
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+
+@unittest.skipIf(geom is None, geom is None and SKIP_REASON)
+class Test_Record(unittest.TestCase):
+
+    class Backplane(object):
+        """Backplane returning fixed arrays of values."""
+        def __init__(self, values):
+            self.values = values
+        def evaluate(self, event_key):
+            return self.values[event_key]
+
+    #===========================================================================
+    # test column results for all tiles at once
+    def test_segmented_results(self):
+
+        rng = np.random.default_rng(17)
+        shape = (12, 16)
+        values = {}
+        for name in ['distance', 'declination', 'right_ascension', 'longitude']:
+            vals = rng.uniform(-3., 3., shape)
+            values[(name, 'IO')] = geom.oops.Scalar(vals, rng.random(shape) < 0.2)
+        backplane = Test_Record.Backplane(values)
+        excluded_mask_dict = {('IO', 'P', '', ''): rng.random(shape) < 0.3}
+
+        # Three disjoint tiles, one of them empty, and pixels in no tile
+        tiles = np.zeros(shape, dtype='int')
+        tiles[:6, :8] = 1
+        tiles[6:, :8] = 2
+        tiles[6:, 8:] = 3
+        subregion_masks = [np.zeros(shape, dtype='bool')]
+        for indx in range(1, 5):
+            subregion_masks.append(tiles != indx)
+
+        labels = geom.Record._label_tiles(subregion_masks)
+        self.assertTrue(np.all(labels == tiles))
+
+        column_descs = [(('distance', 'IO'), ('P', '', '')),
+                        (('declination', 'IO'), ('P', '', '')),
+                        (('right_ascension', 'IO'), ('P', '', '')),
+                        (('longitude', 'IO'), ('P', '', ''), '-180')]
+        for column_desc in column_descs:
+            format = geom.Record._column_format(column_desc)
+            segmented = geom.Record._segmented_results(backplane, column_desc,
+                                                       labels, 4, excluded_mask_dict)
+            self.assertEqual(len(segmented), 5)
+
+            # The results are those of each tile reduced separately
+            for indx in range(1, 5):
+                tile_values = (values[column_desc[0]]
+                               .mask_where(excluded_mask_dict[('IO', 'P', '', '')])
+                               .mask_where(subregion_masks[indx]))
+                expected = geom.Record._column_results(tile_values, format)
+                (results, found) = segmented[indx]
+                self.assertEqual(found, not np.all(tile_values.mask))
+                np.testing.assert_allclose(np.asarray(results, dtype='float'),
+                                           np.asarray(expected, dtype='float'),
+                                           err_msg=str((column_desc, indx)))
+            self.assertFalse(segmented[4][1])
+
+        # Overlapping tiles cannot be labeled
+        self.assertIsNone(geom.Record._label_tiles(subregion_masks[:2] + 
+                                                   [np.zeros(shape, dtype='bool')] * 2))
+
+        # Null columns and mismatched shapes are left to the per-tile reduction
+        self.assertIsNone(geom.Record._segmented_results(
+                                backplane, (('distance', geom.defs.NULL), ('P', '', '')),
+                                labels, 4, excluded_mask_dict))
+        self.assertIsNone(geom.Record._segmented_results(
+                                backplane, column_descs[0], labels[:6], 4,
+                                excluded_mask_dict))
+
+
+@unittest.skipIf(geom is None, geom is None and SKIP_REASON)
+class Test_Occlusion(unittest.TestCase):
+
+    PLANET = 'TEST_OCCLUSION_PLANET'
+    MOONS = ['TEST_OCCLUSION_SHADOWED', 'TEST_OCCLUSION_BEHIND', 
+             'TEST_OCCLUSION_CLEAR', 'TEST_OCCLUSION_OUTSIDE']
+
+    #===========================================================================
+    @staticmethod
+    def scene():
+        """Snapshot of a planet with a moon in its shadow, a moon partially
+        behind it, a moon clear of both, and a moon outside the field of view.
+
+        Returns:
+            oops.Backplane: Backplane of the snapshot.
+        """
+        oops = geom.oops
+        planet_name = Test_Occlusion.PLANET
+        if not oops.Body.exists('SUN'):
+            oops.Body('SUN', 'SSB', 'J2000')
+
+        # The planet moves, so that its apparent position is defined; the Sun
+        # is along -x
+        if not oops.Body.exists(planet_name):
+            path = oops.path.CirclePath(1.e9, 0., 1.e-8, 0., 'SSB', 'J2000')
+            planet = oops.Body(planet_name, path, 'J2000')
+            planet.apply_surface(oops.surface.Spheroid(planet.path, planet.frame,
+                                                       (70000., 66500.)), 70000.)
+        planet = oops.Body.lookup(planet_name)
+
+        offsets = [(2.e5, 0., 4.e4), (9.e4, 1.e6, 0.), (-2.e5, 0., 1.e5), 
+                   (0., 0., 1.e6)]
+        for (name, offset, radius) in zip(Test_Occlusion.MOONS, offsets, 
+                                          [12000., 20000., 10000., 12000.]):
+            if not oops.Body.exists(name):
+                path = oops.path.FixedPath(offset, planet.path, 'J2000')
+                moon = oops.Body(name, path, 'J2000', parent=planet)
+                moon.apply_surface(oops.surface.Spheroid(moon.path, moon.frame, 
+                                                         (radius, 0.95*radius)), 
+                                   radius)
+
+        # Camera 2 million km from the planet, looking along +y
+        path = oops.path.FixedPath((0., -2.e6, 0.), planet.path, 'J2000')
+        frame = oops.frame.Cmatrix([[1,0,0], [0,0,-1], [0,1,0]])
+        fov = oops.fov.FlatFOV(0.0025, (100, 100))
+        obs = oops.obs.Snapshot(('v','u'), 0., 1., fov, path, frame)
+        return oops.backplane.Backplane(obs)
+
+    #===========================================================================
+    # test the masks against the per-body backplane calculations
+    def test_excluded_mask(self):
+        backplane = Test_Occlusion.scene()
+        planet = Test_Occlusion.PLANET
+        occlusion = geom.Occlusion(backplane, planet, bodies=Test_Occlusion.MOONS,
+                                   blocker=Test_Occlusion.MOONS[1])
+
+        # The default matches the docstring
+        self.assertFalse(inspect.signature(occlusion.excluded_mask)
+                            .parameters['ignore_shadows'].default)
+
+        nonempty = 0
+        for target in [planet] + Test_Occlusion.MOONS:
+            for mask_desc in [('P', '', ''), ('PM', 'P', ''), ('', 'PM', 'D'),
+                              ('M', 'M', 'N'), ('PRM', 'PRM', 'DN')]:
+                for blocker in [None, Test_Occlusion.MOONS[1]]:
+                    for ignore_shadows in [False, True]:
+                        expected = geom.Record._construct_excluded_mask(
+                                        backplane, target, planet, mask_desc, 
+                                        blocker=blocker, 
+                                        ignore_shadows=ignore_shadows)
+                        mask = occlusion.excluded_mask(
+                                        target, mask_desc, blocker=blocker,
+                                        ignore_shadows=ignore_shadows)
+                        msg = str((target, mask_desc, blocker, ignore_shadows))
+                        self.assertEqual(type(mask), type(expected), msg)
+                        np.testing.assert_array_equal(mask, expected, err_msg=msg)
+                        nonempty += np.any(expected)
+
+        # The scene exercises both shadows and obscuration
+        self.assertTrue(np.any(occlusion.in_back(Test_Occlusion.MOONS[1], [planet])))
+        self.assertTrue(np.any(occlusion.inside_shadow(Test_Occlusion.MOONS[0], 
+                                                       [planet])))
+        self.assertGreater(nonempty, 0)
+
+        # Targets that do not exist are never excluded
+        self.assertIs(occlusion.excluded_mask('NOT_A_BODY', ('P', 'P', 'D')), True)
+
+    #===========================================================================
+    # test the coverage and nearest-surface rasters
+    def test_rasters(self):
+        backplane = Test_Occlusion.scene()
+        planet = Test_Occlusion.PLANET
+        occlusion = geom.Occlusion(backplane, planet, bodies=Test_Occlusion.MOONS)
+        self.assertEqual(occlusion.surfaces, [planet] + Test_Occlusion.MOONS)
+
+        # The coverage contains every intercepted pixel, and nothing of the
+        # body outside the field of view
+        coverage = occlusion.coverage()
+        self.assertEqual(coverage.shape, backplane.shape + (5,))
+        for (i, name) in enumerate(occlusion.surfaces):
+            intercepted = np.isfinite(occlusion.range(name))
+            self.assertFalse(np.any(intercepted & ~coverage[..., i]), name)
+        self.assertFalse(np.any(occlusion.footprint(Test_Occlusion.MOONS[3])))
+        self.assertFalse(occlusion.overlaps(planet, Test_Occlusion.MOONS[3]))
+
+        # The nearest surface has the smallest range, and the sky is zero
+        nearest = occlusion.nearest()
+        ranges = np.array([occlusion.range(name) for name in occlusion.surfaces])
+        sky = np.all(np.isinf(ranges), axis=0)
+        self.assertTrue(np.all((nearest == 0) == sky))
+        np.testing.assert_array_equal(nearest[~sky],
+                                      np.argmin(ranges, axis=0)[~sky] + 1)
+
+    #===========================================================================
+    # test that calculations that cannot affect a mask are skipped
+    def test_skipped(self):
+        backplane = Test_Occlusion.scene()
+        planet = Test_Occlusion.PLANET
+        (shadowed, behind, clear, outside) = Test_Occlusion.MOONS
+        occlusion = geom.Occlusion(backplane, planet, bodies=Test_Occlusion.MOONS)
+
+        # Only the planet can shadow the moon behind it
+        shadowers = occlusion.shadowers()
+        self.assertNotIn(planet, shadowers[shadowed])
+        self.assertIn(planet, shadowers[clear])
+        self.assertIn(shadowed, shadowers[planet])
+
+        with mock.patch.object(backplane, 'where_inside_shadow', 
+                               wraps=backplane.where_inside_shadow) as shadow:
+            self.assertFalse(np.any(occlusion.inside_shadow(clear, [planet])))
+            self.assertEqual(shadow.call_count, 0)
+            self.assertTrue(np.any(occlusion.inside_shadow(shadowed, [planet])))
+            self.assertEqual(shadow.call_count, 1)
+
+        # The body outside the field of view is never ranged
+        with mock.patch.object(backplane, 'distance', 
+                               wraps=backplane.distance) as distance:
+            self.assertFalse(np.any(occlusion.in_back(planet, [outside])))
+            self.assertEqual(distance.call_count, 0)
+
+
+@unittest.skipIf(geom is None, geom is None and SKIP_REASON)
+class Test_Context(unittest.TestCase):
+
+    #===========================================================================
+    # test the cone test that prefilters the inventory
+    def test_prefilter(self):
+        observation = Test_Occlusion.scene().obs
+        names = [Test_Occlusion.PLANET] + Test_Occlusion.MOONS
+        outside = Test_Occlusion.MOONS[3]
+
+        logger = mock.Mock()
+        with mock.patch.object(geom.meta, '_LOGGER', logger):
+            survivors = geom.Context._prefilter(observation, names)
+        logger.info.assert_called_once_with(
+                                'Inventory prefilter eliminated 1 of 5 bodies')
+
+        # Every body in the inventory survives; the body outside the field of
+        # view does not
+        self.assertEqual(survivors, [name for name in names if name != outside])
+        inventory = observation.inventory(names, cache=False)
+        self.assertTrue(set(inventory) <= set(survivors))
+        self.assertNotIn(outside, inventory)
+
+        # The body survives once the field of view is expanded enough to reach it
+        with mock.patch.object(geom.meta, '_LOGGER', logger):
+            self.assertEqual(geom.Context._prefilter(observation, names, expand=0.4),
+                             names)
+
+
+@unittest.skipIf(geom is None, geom is None and SKIP_REASON)
+class Test_GeometryTable(unittest.TestCase):
+
+    #===========================================================================
+    # test vectorized formatting against the formatting of single values
+    def test_format_values(self):
+
+        cases = [
+            # Standard, overflow, clipped, and unformattable values
+            (('', 2, 10, '%10.5f', '%10.4e', -999.),
+             [1.5, -1.5, 0., 123456.7, -123456.7, 1e120, -1e120, np.nan, np.inf]),
+            (('', 2, 12, '%12.3f', '%12.5e', -99999.),
+             [12.25, 1e9, -1e9, 1e100, -1e101, -np.inf]),
+            # No overflow format
+            (('-180', 2, 8, '%8.3f', None, -999.), [12.345, -179.9, 123456., np.nan]),
+            (('', 2, 1, '%1d', None, 0), [0., 1., 12.])]
+
+        for (format, values) in cases:
+            values = np.array(values)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                (strings, errors) = geom.GeometryTable._format_values(
+                                        values, np.zeros(len(values), dtype='bool'),
+                                        format)
+            self.assertEqual(len(strings), len(values))
+
+            for (i, value) in enumerate(values):
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore')
+                    try:
+                        expected = geom.Record._format_results([value], format)
+                    except (RuntimeError, TypeError):
+                        expected = None
+
+                # A value that the baseline cannot format is reported as an error
+                if expected is None:
+                    self.assertIn(i, errors, (format, value))
+                else:
+                    self.assertNotIn(i, errors, (format, value))
+                    self.assertEqual(strings[i], expected, (format, value))
+                    self.assertLessEqual(len(strings[i]), format[2])
+
+        # Clipping and non-finite values are reported as in the baseline
+        format = cases[0][0]
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            geom.GeometryTable._format_values(np.array([1e120, np.nan]), 
+                                              np.zeros(2, dtype='bool'), format)
+        messages = [str(w.message) for w in caught]
+        self.assertIn('NaN encountered', messages)
+        self.assertTrue(any(' clipped to ' in message for message in messages))
+
+    #===========================================================================
+    # test formatting of times and string nulls
+    def test_format_times(self):
+        format = geom.FORMAT_DICT['event_time']
+        tai = geom.julian.tai_from_iso('1996-06-27T12:34:56.789')
+        values = np.array([tai, 0., tai + 1.])
+        nulls = np.array([False, True, False])
+
+        (strings, errors) = geom.GeometryTable._format_values(values, nulls, format)
+        self.assertEqual(errors, {})
+
+        # Times match the baseline; string nulls are written as they are
+        expected = geom.Record._format_results([tai, tai + 1.], format).split(',')
+        self.assertEqual(list(strings), [expected[0], format[3] % format[5], expected[1]])
+        self.assertEqual(strings[1].strip(), '"UNK"')
+
+
+@unittest.skipIf(geom is None, geom is None and SKIP_REASON)
+class Test_Suite(unittest.TestCase):
+
+    #===========================================================================
+    # test suite construction
+    def test_suite(self):
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            tempdir = FCPath(tempdir)
+
+            # A volume without an index has no tables
+            suite = geom.Suite(tempdir, tempdir, selection='SD',
+                               glob='*_index.lbl', sidecar=True)
+            self.assertTrue(suite.sidecar)
+            self.assertEqual(suite.levels, ['summary', 'detailed'])
+            self.assertFalse(hasattr(suite, 'tables'))
+
+            # Tables inherit the suite options
+            suite.volume_id = 'GO_0017'
+            suite.tables = []
+            for level in suite.levels:
+                suite.add_tables(tempdir, level)
+            self.assertEqual(len(suite.tables), 6)
+            for table in suite.tables:
+                self.assertTrue(table.sidecar)
+                self.assertEqual(table.volume_id, 'GO_0017')
+
+    #===========================================================================
+    # test the observation limit in parallel mode
+    def test_first_parallel(self):
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            tempdir = FCPath(tempdir)
+
+            suite = Counting_Suite(tempdir, tempdir, glob='*_index.lbl',
+                                   first=3, jobs=2)
+            suite.observations = list(range(10))
+            suite.tables = []
+            suite.results = {}
+            suite.merged = 0
+            suite.completed = {}
+            suite.journal = geom.Journal(tempdir, 'GO_0017', {})
+            suite.journal.open()
+
+            # Only enough observations to reach the limit are dispatched
+            suite._create_parallel(list(range(10)), count=1)
+            suite._merge(final=True)
+            self.assertEqual(suite.completed, {0: True, 1: True})
+            self.assertEqual(sorted(p.name for p in pathlib.Path(tempdir.path).glob('obs*')),
+                             ['obs0', 'obs1'])
+            suite.journal.remove()
+
+    #===========================================================================
+    # test that the records for all levels share one geometry context
+    def test_make_records(self):
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            tempdir = FCPath(tempdir)
+            suite = geom.Suite(tempdir, tempdir, selection='SD', glob='*_index.lbl',
+                               occlusion=True)
+            suite.volume_id = 'GO_0017'
+            suite.observations = ['observation']
+            suite.meshgrids = {}
+
+        context = types.SimpleNamespace(observation='observation', primary='JUPITER',
+                                        secondaries=[], target='IO', prefixes=[],
+                                        backplane=object(), mask_cache=object(),
+                                        bodies=['IO'], blocker=None,
+                                        rings_present=False, ring_tile_dict={},
+                                        body_tile_dict={})
+        with mock.patch.object(geom, 'Context', return_value=context) as Context:
+            records = suite.make_records(0)
+
+        # The context is built once, and each record is a view on it
+        Context.assert_called_once_with('observation', 'GO_0017', suite.meshgrids,
+                                        occlusion=True)
+        self.assertEqual([record.level for record in records], ['summary', 'detailed'])
+        for record in records:
+            self.assertIs(record.context, context)
+            self.assertIs(record.backplane, context.backplane)
+            self.assertIs(record.mask_cache, context.mask_cache)
+            self.assertIs(record.bodies, context.bodies)
+
+        # Only the column dictionaries depend on the level
+        self.assertIs(records[0].dicts['body'], geom.col.BODY_SUMMARY_DICT)
+        self.assertIs(records[1].dicts['body'], geom.col.BODY_SUMMARY_DETAILED)
+
+    #===========================================================================
+    def create(self, tempdir, names, **kwargs):
+        """Create the tables for observations that need no geometry; return 
+        the suite and the content of each table."""
+        tempdir = FCPath(tempdir)
+        suite = Row_Suite(tempdir, tempdir, glob='*_index.lbl', **kwargs)
+        suite.volume_id = 'GO_0017'
+        suite.observations = [types.SimpleNamespace(basename=name, dict={'NAME': name})
+                              for name in names]
+        suite.tables = [geom.meta.Table(tempdir, volume_id='GO_0017', level='summary', 
+                                        qualifier=qualifier)
+                        for qualifier in ['body', 'ring']]
+
+        with mock.patch.object(geom.Manifest, 'input_digest', return_value='inputs'), \
+             mock.patch.object(geom.meta.lab, 'create'), \
+             mock.patch.object(geom.config, 'cleanup', create=True):
+            suite.create()
+
+        tables = {}
+        for table in suite.tables:
+            with open(table.filename.path, 'rb') as f:
+                tables[table.filename.name] = f.read()
+        return (suite, tables)
+
+    #===========================================================================
+    # test that parallel tables match serial ones, with and without a limit
+    def test_parallel(self):
+
+        names = ['C%04d' % i for i in range(12)]
+        names[2] += 'FAIL'
+        names[5] += 'FAIL'
+
+        for first in [None, 4, 9]:
+            with tempfile.TemporaryDirectory() as serial_dir, \
+                 tempfile.TemporaryDirectory() as parallel_dir:
+                (_, serial) = self.create(serial_dir, names, first=first)
+                (_, parallel) = self.create(parallel_dir, names, first=first, jobs=3)
+                self.assertEqual(parallel, serial, first)
+
+                # Failed observations do not count toward the limit
+                for content in serial.values():
+                    self.assertEqual(content.count(b'\r\n'), first or 10)
+
+    #===========================================================================
+    # test removal of the journal once the tables are written
+    def test_journal_removed(self):
+
+        for incremental in [False, True]:
+            with tempfile.TemporaryDirectory() as tempdir:
+                (suite, _) = self.create(tempdir, ['C0001', 'C0002'], 
+                                         incremental=incremental)
+                self.assertFalse(suite.journal.path.exists())
+
+                # The manifest is written only for incremental runs
+                manifest = geom.Manifest(tempdir, 'GO_0017')
+                self.assertEqual(manifest.path.exists(), incremental)
+
+
+@unittest.skipIf(geom is None, geom is None and SKIP_REASON)
+class Test_Daemon(unittest.TestCase):
+
+    #===========================================================================
+    # test recovered, invalid, and stopping jobs
+    def test_serve(self):
+
+        # A daemon on this host that no longer exists
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+        host = geom._daemon_owner().rpartition('-')[0]
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            queue_dir = pathlib.Path(tempdir)
+            jobs = {'a.%s-%d.running' % (host, process.pid): '{"volume": "GO_0001"}',
+                    'b.%s.running' % geom._daemon_owner(): '{"volume": "GO_0002"}',
+                    'c.other-host-1.running': '{"volume": "GO_0003"}',
+                    'd.json': '["GO_0004"]',
+                    'e.json': '{"volume":',
+                    'z.json': '{"stop": true}'}
+            for (name, job) in jobs.items():
+                (queue_dir / name).write_text(job)
+
+            args = mock.Mock(sampling=8)
+            with mock.patch.object(geom, '_find_volumes', return_value=[]), \
+                 mock.patch.object(geom, 'get_meshgrids'):
+                geom.serve(args, '*_index.lbl', queue_dir)
+
+            # Only the job of the exited daemon is recovered and run
+            self.assertEqual(sorted(path.name for path in queue_dir.iterdir()),
+                             ['a.done', 'b.%s.running' % geom._daemon_owner(),
+                              'c.other-host-1.running', 'd.done', 'e.done'])
+
+            results = {name: json.loads((queue_dir / name).read_text())
+                       for name in ['a.done', 'd.done', 'e.done']}
+            self.assertEqual(results['a.done']['error'], 'Volume not found: GO_0001')
+            self.assertEqual(results['d.done']['error'], 'Job is not a JSON object')
+            self.assertTrue(results['e.done']['error'].startswith('Invalid JSON'))
+            for result in results.values():
+                self.assertEqual(result['status'], 'failed')
+
+
+@unittest.skipIf(geom is None, geom is None and SKIP_REASON)
+class Test_Meshgrids(unittest.TestCase):
+
+    #===========================================================================
+    # test the meshgrid cache key
+    def test_key(self):
+        key = geom._meshgrid_key(8)
+        self.assertEqual(key, geom._meshgrid_key(8))
+        self.assertNotEqual(key, geom._meshgrid_key(4))
+
+        # A new OOPS version invalidates the cache
+        with mock.patch.object(geom.oops, '__version__', 'other', create=True):
+            self.assertNotEqual(key, geom._meshgrid_key(8))
+
+    #===========================================================================
+    # test rebuilding after a corrupt cache entry
+    def test_corrupt(self):
+
+        calls = []
+        def meshgrids(sampling):
+            calls.append(sampling)
+            return {}
+
+        with tempfile.TemporaryDirectory() as tempdir, \
+             mock.patch.object(geom.config, 'meshgrids', meshgrids):
+            directory = pathlib.Path(tempdir) / geom._meshgrid_key(8)
+            directory.mkdir()
+            with open(directory / 'meshgrids.pickle', 'wb') as f:
+                f.write(b'not a pickle')
+
+            # The meshgrids are rebuilt and the corrupt entry is replaced
+            geom._MESHGRID_CACHE.clear()
+            self.assertEqual(geom.get_meshgrids(8, cache_dir=tempdir), {})
+            self.assertEqual(calls, [8])
+            with open(directory / 'meshgrids.pickle', 'rb') as f:
+                self.assertEqual(geom.pickle.load(f), {})
+            geom._MESHGRID_CACHE.clear()
+
+
+@unittest.skipIf(geom is None, geom is None and SKIP_REASON)
+class Test_Journal(unittest.TestCase):
+
+    #===========================================================================
+    # test writing, resuming, and removing a journal
+    def test_journal(self):
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            header = {'sampling': 8, 'levels': ['summary']}
+            journal = geom.Journal(tempdir, 'GO_0017', header)
+            self.assertEqual(journal.path, pathlib.Path(tempdir) / 'GO_0017_journal.pickle')
+            self.assertEqual(journal.read(), [])
+
+            records = [(0, True, {'body_summary': ['row0']}),
+                       (1, False, {}),
+                       (2, True, {'body_summary': ['row2a', 'row2b']})]
+            journal.open()
+            for record in records:
+                journal.append(record)
+
+            # Each record is on disk as soon as it is appended
+            self.assertEqual(geom.Journal(tempdir, 'GO_0017', header).read(), records)
+
+            # A run with different parameters does not resume
+            self.assertEqual(geom.Journal(tempdir, 'GO_0017', {'sampling': 4}).read(), [])
+
+            # A resumed journal retains the given records
+            resumed = geom.Journal(tempdir, 'GO_0017', header)
+            resumed.open(records[:2])
+            resumed.append((3, True, {}))
+            self.assertEqual(resumed.read(), records[:2] + [(3, True, {})])
+
+            resumed.remove()
+            self.assertFalse(resumed.path.exists())
+            self.assertEqual(resumed.read(), [])
+            journal.remove()
+
+    #===========================================================================
+    # test a journal cut off in the middle of a record
+    def test_truncated(self):
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            journal = geom.Journal(tempdir, 'GO_0017', {})
+            journal.open()
+            journal.append((0, True, {'body_summary': ['row0']}))
+            journal.append((1, True, {'body_summary': ['row1' * 100]}))
+            journal.file.close()
+            journal.file = None
+
+            size = journal.path.stat().st_size
+            with open(journal.path, 'r+b') as f:
+                f.truncate(size - 50)
+            self.assertEqual(journal.read(), [(0, True, {'body_summary': ['row0']})])
+
+    #===========================================================================
+    # test the location of the journal for a remote output directory
+    def test_remote(self):
+
+        with tempfile.TemporaryDirectory() as tempdir, \
+             mock.patch.object(geom, 'JOURNAL_DIR', pathlib.Path(tempdir)):
+            journal = geom.Journal('gs://bucket/volumes', 'GO_0017', {})
+            self.assertEqual(journal.path.parent, pathlib.Path(tempdir))
+            self.assertTrue(journal.path.name.endswith('_GO_0017_journal.pickle'))
+            self.assertNotEqual(journal.path,
+                                geom.Journal('gs://bucket/other', 'GO_0017', {}).path)
+
+
+@unittest.skipIf(geom is None, geom is None and SKIP_REASON)
+class Test_Manifest(unittest.TestCase):
+
+    #===========================================================================
+    # test reading and writing
+    def test_read_write(self):
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            manifest = geom.Manifest(tempdir, 'GO_0017')
+            self.assertIsNone(manifest.read())
+
+            manifest.write('abc', {'C0001.IMG': '123'})
+            self.assertEqual(manifest.read(), {'inputs': 'abc', 
+                                               'observations': {'C0001.IMG': '123'}})
+
+            # An invalid manifest is ignored
+            manifest.path.write_text('{')
+            self.assertIsNone(manifest.read())
+
+    #===========================================================================
+    # test the input digest
+    def test_input_digest(self):
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            column_file = pathlib.Path(tempdir) / 'COLUMNS_TEST.py'
+            column_file.write_text('TEST_COLUMNS = []\n')
+
+            with mock.patch.object(geom.defs, 'COLUMN_DIR', pathlib.Path(tempdir)):
+                digest = geom.Manifest.input_digest(8, ['summary'], False)
+                self.assertEqual(digest, 
+                                 geom.Manifest.input_digest(8, ['summary'], False))
+                self.assertNotEqual(digest,
+                                    geom.Manifest.input_digest(4, ['summary'], False))
+
+                # Column dictionaries modified in memory do not matter...
+                geom.col.BODY_SUMMARY_DICT['TEST'] = 1
+                try:
+                    self.assertEqual(digest, 
+                                     geom.Manifest.input_digest(8, ['summary'], False))
+                finally:
+                    del geom.col.BODY_SUMMARY_DICT['TEST']
+
+                # ...but changes to the definitions do
+                column_file.write_text('TEST_COLUMNS = [1]\n')
+                self.assertNotEqual(digest, 
+                                    geom.Manifest.input_digest(8, ['summary'], False))
+
+################################################################################
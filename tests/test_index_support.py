@@ -0,0 +1,180 @@
+################################################################################
+# tests/test_index_support.py
+################################################################################
+import os
+import sys
+import time
+import unittest
+
+from unittest import mock
+
+# The index tools read the host configuration
+HOST_DIR = os.path.join(os.path.dirname(__file__), '..',
+                        'metadata_tools', 'hosts', 'GO_0xxx')
+if HOST_DIR not in sys.path:
+    sys.path.append(HOST_DIR)
+
+try:
+    import metadata_tools.index_support as idx
+except Exception as e:
+    idx = None
+    SKIP_REASON = 'Index tools unavailable: %r' % e
+
+@unittest.skipIf(idx is None, idx is None and SKIP_REASON)
+class Test_ColumnEncoder(unittest.TestCase):
+
+    #===========================================================================
+    def encode(self, format, values, items=None):
+        """Encode values with a new encoder; return the encoder, the formatted
+        values, and the warnings logged."""
+        encoder = idx.ColumnEncoder({'NAME': 'TEST', 'FORMAT': '"%s"' % format, 
+                                     'ITEMS': items})
+        logger = mock.Mock()
+        with mock.patch.object(idx.meta, 'get_logger', return_value=logger):
+            results = [encoder.encode(value) for value in values]
+        warnings = [call.args[0] for call in logger.warn.call_args_list]
+        return (encoder, results, warnings)
+
+    #===========================================================================
+    # test character columns
+    def test_character(self):
+        (encoder, results, warnings) = \
+            self.encode('A10', ['  Io  moon ', 'a"b"', 'toolongstringvalue', 5])
+        self.assertEqual((encoder.width, encoder.data_type), (12, 'CHARACTER'))
+        self.assertEqual(results, ['"Io moon   "', '"ab        "', 
+                                   '"toolongstr"', '"5         "'])
+        self.assertEqual(warnings, [])
+
+    #===========================================================================
+    # test real columns
+    def test_real(self):
+        (encoder, results, warnings) = \
+            self.encode('F8.3', [1.5, -12.25, 123456.0, 'x'])
+        self.assertEqual((encoder.width, encoder.data_type), (8, 'ASCII_REAL'))
+        self.assertEqual(results, ['   1.500', ' -12.250', '********', '********'])
+        self.assertEqual(warnings, ['Format error for TEST: 123456.0',
+                                    'Invalid format: TEST x F8.3',
+                                    'Format error for TEST: x'])
+
+        # A three-digit exponent is not a valid number
+        (encoder, results, warnings) = self.encode('E10.3', [12345.0, 1.5e-300])
+        self.assertEqual((encoder.width, encoder.data_type), (10, 'ASCII_REAL'))
+        self.assertEqual(results, [' 0.123E+05', ' 0.150-299'])
+        self.assertEqual(warnings, ['Format error for TEST: 1.5e-300'])
+
+    #===========================================================================
+    # test integer columns
+    def test_integer(self):
+        (encoder, results, warnings) = self.encode('I4', [7, -12, 12345])
+        self.assertEqual((encoder.width, encoder.data_type), (4, 'ASCII_INTEGER'))
+        self.assertEqual(results, ['   7', ' -12', '****'])
+        self.assertEqual(warnings, ['Format error for TEST: 12345'])
+
+    #===========================================================================
+    # test columns with multiple items
+    def test_items(self):
+        (encoder, results, warnings) = self.encode('I3', [[1, 2, 3], 4], items=3)
+        self.assertEqual(encoder.count, 3)
+        self.assertEqual(results, ['  1,  2,  3', '  4,  4,  4'])
+        self.assertRaises(AssertionError, encoder.encode, [1, 2])
+
+
+@unittest.skipIf(idx is None, idx is None and SKIP_REASON)
+class Test_IndexTable(unittest.TestCase):
+
+    #===========================================================================
+    def table(self, names):
+        """Index table with the given columns, without a volume."""
+        table = idx.IndexTable()
+        table.volume_id = 'GO_0017'
+        table.usage = {}
+        table.rows = []
+        table.columns = []
+        table.timing = {'(label)': 0.}
+        for name in names:
+            column_stub = {'NAME': name, 'FORMAT': '"A12"', 'ITEMS': None,
+                           'NULL_CONSTANT': 'NULL'}
+            table.columns.append((column_stub,
+                                  idx.IndexTable._get_key_function(name),
+                                  idx.ColumnEncoder(column_stub)))
+            table.timing[name] = 0.
+        return table
+
+    #===========================================================================
+    # test the key functions resolved for each column
+    def test_key_functions(self):
+        host_fn = mock.Mock(return_value='HOST')
+        with mock.patch.object(idx.config, 'key__test_column', host_fn, create=True), \
+             mock.patch.object(idx.config, 'key__volume_id', create=True):
+
+            # Built-in key functions take precedence over the host's
+            self.assertIs(idx.IndexTable._get_key_function('VOLUME_ID'), 
+                          idx.key__volume_id)
+            self.assertIs(idx.IndexTable._get_key_function('TEST_COLUMN'), host_fn)
+            self.assertIsNone(idx.IndexTable._get_key_function('TARGET_NAME'))
+
+            table = self.table(['TEST_COLUMN', 'TARGET_NAME', 'MISSION_NAME'])
+
+        # Each row calls the resolved functions, and takes the other values 
+        # from the label; nothing is looked up per row
+        with mock.patch.object(idx.IndexTable, '_get_key_function') as resolve:
+            table.add(idx.FCPath('/volumes/GO_0017'), 'C0001.LBL', 
+                      label={'TARGET_NAME': 'IO'})
+        resolve.assert_not_called()
+        host_fn.assert_called_once_with(idx.FCPath('/volumes/GO_0017/C0001.LBL'),
+                                        {'TARGET_NAME': 'IO'})
+        self.assertEqual(table.rows, ['"HOST        ","IO          ","NULL        "'])
+        self.assertEqual(table.usage, {'TEST_COLUMN': True, 'TARGET_NAME': True,
+                                       'MISSION_NAME': False})
+
+        # The time spent on each column is reported
+        self.assertEqual(sorted(table.timing), ['(label)', 'MISSION_NAME', 
+                                                'TARGET_NAME', 'TEST_COLUMN'])
+        table.timing = {'(label)': 1., 'TEST_COLUMN': 3., 'TARGET_NAME': 0., 
+                        'MISSION_NAME': 0.}
+        logger = mock.Mock()
+        with mock.patch.object(idx.meta, 'get_logger', return_value=logger):
+            table._report_timing(max_columns=2)
+        messages = [call.args[0] for call in logger.info.call_args_list]
+        self.assertEqual(messages[0], 'GO_0017 index time: 4.00 s')
+        self.assertEqual([message.split()[0] for message in messages[1:]],
+                         ['TEST_COLUMN', '(label)'])
+
+    #===========================================================================
+    # test that prefetched labels are returned in order, with bounded read-ahead
+    def test_prefetch(self):
+        paths = ['C%04d.LBL' % i for i in range(40)]
+        started = []
+
+        def get_label(path):
+            started.append(path)
+            return {'PATH': path}
+
+        for (io_threads, prefetch_bytes) in [(1, 10**6), (3, 10**6), (3, 150)]:
+            table = self.table([])
+            table.io_threads = io_threads
+            window = idx.PREFETCH_FILES_PER_THREAD * io_threads
+            started.clear()
+            consumed = []
+            with mock.patch.object(table, '_get_label', get_label), \
+                 mock.patch.object(idx.config, 'prefetch', create=True,
+                                   return_value=100) as prefetch, \
+                 mock.patch.object(idx, 'PREFETCH_BYTES', prefetch_bytes):
+                for label in table._iter_labels(paths):
+                    consumed.append(label['PATH'])
+
+                    # Reading ahead never exceeds the window and, once the size
+                    # of a read is known, the bytes awaiting the writer
+                    ahead = len(started) - len(consumed)
+                    self.assertLessEqual(ahead, window)
+                    if io_threads == 1:
+                        self.assertEqual(ahead, 0)
+                    elif len(consumed) > window:
+                        self.assertLessEqual(ahead, -(-prefetch_bytes // 100))
+                    time.sleep(0.002)
+
+            self.assertEqual(consumed, paths)
+            self.assertEqual(sorted(started), paths)
+            self.assertEqual(prefetch.call_count, len(paths) if io_threads > 1 else 0)
+
+################################################################################
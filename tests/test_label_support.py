@@ -0,0 +1,234 @@
+################################################################################
+# tests/test_label_support.py
+################################################################################
+import os
+import json
+import random
+import tempfile
+import time
+import unittest
+
+from pdstemplate            import PdsTemplate
+from pdstemplate.asciitable import AsciiTable
+from pdstemplate.pds3table  import pds3_table_preprocessor
+
+import metadata_tools.label_support as lab
+
+TABLE_PATH = os.path.join(os.path.dirname(__file__), '..', 'metadata_tools',
+                          'hosts', 'GO_0xxx', 'gs:', 'gcs-bucket-joe-spitale',
+                          'GO_0017', 'GO_0017_supplemental_index.tab')
+
+TEMPLATE = """PDS_VERSION_ID          = PDS3
+RECORD_TYPE             = FIXED_LENGTH
+RECORD_BYTES            = 0
+FILE_RECORDS            = 0
+^TABLE                  = "T_0001_test.tab"
+OBJECT                  = TABLE
+  INTERCHANGE_FORMAT    = ASCII
+  ROWS                  = 0
+  COLUMNS               = 3
+  ROW_BYTES             = 0
+  OBJECT                = COLUMN
+    NAME                = BODY_NAME
+    DATA_TYPE           = CHARACTER
+    START_BYTE          = 1
+    BYTES               = 1
+  END_OBJECT            = COLUMN
+  OBJECT                = COLUMN
+    NAME                = LATITUDE
+    DATA_TYPE           = ASCII_REAL
+    START_BYTE          = 1
+    BYTES               = 1
+    FORMAT              = "F8.3"
+    NULL_CONSTANT       = -999.
+    MINIMUM_VALUE       = $LABEL_VALUE("MINIMUM_VALUE", 2)$
+    MAXIMUM_VALUE       = $LABEL_VALUE("MAXIMUM_VALUE", 2)$
+  END_OBJECT            = COLUMN
+  OBJECT                = COLUMN
+    NAME                = COUNT
+    DATA_TYPE           = ASCII_INTEGER
+    START_BYTE          = 1
+    BYTES               = 1
+    MINIMUM_VALUE       = $LABEL_VALUE("MINIMUM_VALUE", 3)$
+    MAXIMUM_VALUE       = $LABEL_VALUE("MAXIMUM_VALUE", 3)$
+  END_OBJECT            = COLUMN
+END_OBJECT              = TABLE
+END
+"""
+
+class Test_TableSummary(unittest.TestCase):
+
+    #===========================================================================
+    # test table analysis from a summary
+    def test_summary_table(self):
+
+        with open(TABLE_PATH, 'rb') as f:
+            content = f.read()
+        lines = content.decode('utf-8').split('\r\n')[:-1]
+
+        # Rows may be added in any number of batches
+        summary = lab.TableSummary()
+        summary.add(lines[:100])
+        summary.add(lines[100:])
+        self.assertEqual(summary.rows, len(lines))
+        self.assertEqual(summary.record_bytes, len(lines[0]) + 2)
+        self.assertLess(len(summary.records()), len(lines))
+
+        # The summary describes the table exactly as the full content does
+        table = AsciiTable(TABLE_PATH, content)
+        summary_table = lab.SummaryTable(TABLE_PATH, summary)
+        for name in ['ROWS', 'ROW_BYTES', 'COLUMNS', 'TERMINATORS']:
+            self.assertEqual(summary_table.lookup(name), table.lookup(name))
+
+        for column in range(table.lookup('COLUMNS')):
+            for name in ['WIDTH', 'PDS3_FORMAT', 'PDS4_FORMAT', 'PDS3_DATA_TYPE',
+                         'PDS4_DATA_TYPE', 'QUOTES', 'START_BYTE', 'BYTES',
+                         'MINIMUM', 'MAXIMUM', 'FIRST', 'LAST']:
+                self.assertEqual(summary_table.lookup(name, column),
+                                 table.lookup(name, column), (name, column))
+
+    #===========================================================================
+    # test summaries of consecutive parts of a table
+    def test_merge(self):
+
+        with open(TABLE_PATH, 'rb') as f:
+            lines = f.read().decode('utf-8').split('\r\n')[:-1]
+
+        summary = lab.TableSummary()
+        summary.add(lines)
+
+        # Summaries of the parts, saved and restored, combine into the whole
+        merged = lab.TableSummary()
+        merged.merge(lab.TableSummary())
+        for part in [lines[:1], lines[1:200], [], lines[200:]]:
+            part_summary = lab.TableSummary()
+            part_summary.add(part)
+            saved = json.loads(json.dumps(part_summary.to_dict()))
+            merged.merge(lab.TableSummary.from_dict(saved))
+
+        self.assertEqual(merged.to_dict(), summary.to_dict())
+        self.assertEqual(merged.records(), summary.records())
+
+    #===========================================================================
+    # test summaries made while copying a table
+    def test_append_txt_file(self):
+
+        with open(TABLE_PATH, 'rb') as f:
+            lines = f.read().decode('utf-8').split('\r\n')[:-1]
+
+        summary = lab.TableSummary()
+        summary.add(lines)
+
+        appended = lab.TableSummary()
+        with tempfile.TemporaryFile() as f:
+            lab.util.append_txt_file(TABLE_PATH, f, chunk_size=1000, summary=appended)
+        self.assertEqual(appended.to_dict(), summary.to_dict())
+
+    #===========================================================================
+    # test labels made from a summary
+    def test_label(self):
+
+        random.seed(17)
+        names = ['IO', 'EUROPA', 'GANYMEDE', 'CALLISTO', 'AMALTHEA']
+        lines = ['"%-8s",%8.3f,%5d' % (random.choice(names),
+                                       random.choice([-999., random.uniform(-90, 90)]),
+                                       random.randint(-100, 100))
+                 for _ in range(500)]
+
+        summary = lab.TableSummary()
+        summary.add(lines)
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            template_path = os.path.join(tempdir, 'T_0001_test.lbl.tmpl')
+            with open(template_path, 'w', newline='') as f:
+                f.write(TEMPLATE.replace('\n', '\r\n'))
+
+            # Label the same table by reading it and from its summary alone
+            labels = []
+            for (name, table_summary) in [('read', None), ('summary', summary)]:
+                directory = os.path.join(tempdir, name)
+                os.mkdir(directory)
+                table_path = os.path.join(directory, 'T_0001_test.tab')
+                with open(table_path, 'w', newline='') as f:
+                    if table_summary is None:
+                        f.write('\r\n'.join(lines) + '\r\n')
+
+                template = PdsTemplate(template_path, crlf=True,
+                                       preprocess=pds3_table_preprocessor,
+                                       kwargs={'formats':True, 'numbers':True,
+                                               'validate':False})
+                label_path = table_path.replace('.tab', '.lbl')
+                template.write(lab._table_functions(table_path, summary=table_summary),
+                               label_path=label_path)
+                with open(label_path) as f:
+                    labels.append(f.read())
+
+            self.assertEqual(labels[0], labels[1])
+            self.assertIn('FILE_RECORDS            = 500', labels[1])
+            self.assertNotIn('MINIMUM_VALUE       = -999', labels[1])
+
+
+class Test_Templates(unittest.TestCase):
+
+    #===========================================================================
+    # test the compiled template cache
+    def test_template_cache(self):
+
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tempdir:
+            os.chdir(tempdir)
+            try:
+                self._test_template_cache(tempdir)
+            finally:
+                os.chdir(cwd)
+
+    def _test_template_cache(self, tempdir):
+
+        # Two templates, one of which includes the description of a column
+        with open('count.lbl', 'w', newline='') as f:
+            f.write('    DESCRIPTION         = "Count"\r\n')
+        with open('T_0001_a.lbl', 'w', newline='') as f:
+            f.write(TEMPLATE.replace('\n', '\r\n'))
+        with open('T_0001_b.lbl', 'w', newline='') as f:
+            f.write(TEMPLATE.replace('    BYTES               = 1\n'
+                                     '    MINIMUM_VALUE       = $LABEL_VALUE("MINIMUM_VALUE", 3)$\n',
+                                     '    BYTES               = 1\n'
+                                     '$INCLUDE("count.lbl")\n')
+                            .replace('\n', '\r\n'))
+
+        # Tables with different rows
+        lines = {'a': ['"IO      ",  12.000,    5', '"EUROPA  ",-999.000,   -3'],
+                 'b': ['"CALLISTO",  45.500,   17']}
+        for (name, table_lines) in lines.items():
+            os.mkdir(name)
+            with open(os.path.join(name, 'T_0001_test.tab'), 'w', newline='') as f:
+                f.write('\r\n'.join(table_lines) + '\r\n')
+
+        # Label the tables alternately with cached templates
+        def label(name):
+            (template, pds3_table) = lab._get_template(
+                                        lab.FCPath(tempdir) / ('T_0001_%s.lbl' % name), True)
+            table_path = os.path.join(name, 'T_0001_test.tab')
+            template.write(lab._table_functions(table_path, pds3_table=pds3_table),
+                           label_path=table_path.replace('.tab', '.lbl'))
+            with open(table_path.replace('.tab', '.lbl')) as f:
+                return (template, f.read())
+
+        (template_a, label_a) = label('a')
+        (template_b, label_b) = label('b')
+        self.assertEqual(label('a'), (template_a, label_a))
+        self.assertEqual(label('b'), (template_b, label_b))
+        self.assertIn('MINIMUM_VALUE       = 12.', label_a)
+        self.assertIn('MAXIMUM_VALUE       = 45.5', label_b)
+        self.assertIn('DESCRIPTION         = "Count"', label_b)
+
+        # A change to an included file invalidates the compiled template
+        with open('count.lbl', 'w', newline='') as f:
+            f.write('    DESCRIPTION         = "Number"\r\n')
+        stamp = time.time() + 10
+        os.utime('count.lbl', (stamp, stamp))
+        (template, label_b) = label('b')
+        self.assertIsNot(template, template_b)
+        self.assertIn('DESCRIPTION         = "Number"', label_b)
+
+################################################################################
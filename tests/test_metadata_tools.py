@@ -0,0 +1,150 @@
+################################################################################
+# tests/test_metadata_tools.py
+################################################################################
+import os
+import tempfile
+import unittest
+
+from unittest import mock
+
+from filecache import FCPath
+
+import metadata_tools as meta
+
+#===============================================================================
+def write_volume(output_dir, volume_id):
+    """Process one volume by writing a file named after it; volumes ending in
+    "9" fail."""
+    if volume_id.endswith('9'):
+        raise ValueError('Bad volume %s' % volume_id)
+
+    with open(os.path.join(output_dir, volume_id + '.tab'), 'w') as f:
+        f.write(volume_id + '\n')
+    return volume_id.lower()
+
+
+class Test_ProcessVolumes(unittest.TestCase):
+
+    #===========================================================================
+    def process(self, max_volumes):
+        """Process a set of volumes; return the results, the files written, and
+        the messages logged."""
+        with tempfile.TemporaryDirectory() as tempdir:
+            volumes = [(volume_id, {'output_dir': tempdir, 'volume_id': volume_id})
+                       for volume_id in ['GO_0017', 'GO_0018', 'GO_0019',
+                                         'GO_0020', 'GO_0029']]
+            logger = mock.Mock()
+            with mock.patch.object(meta, '_LOGGER', logger):
+                results = meta.process_volumes(volumes, write_volume,
+                                               max_volumes=max_volumes)
+
+            files = {}
+            for name in os.listdir(tempdir):
+                with open(os.path.join(tempdir, name)) as f:
+                    files[name] = f.read()
+
+        infos = [call.args[0] for call in logger.info.call_args_list]
+        errors = [call.args[0] for call in logger.error.call_args_list]
+        return (results, files, infos, errors)
+
+    #===========================================================================
+    # test that concurrent volumes give the same output and failures as serial
+    def test_volume_jobs(self):
+
+        (results, files, infos, errors) = self.process(1)
+        self.assertEqual(results, {'GO_0017': 'go_0017', 'GO_0018': 'go_0018',
+                                   'GO_0020': 'go_0020'})
+        self.assertEqual(sorted(files), ['GO_0017.tab', 'GO_0018.tab', 'GO_0020.tab'])
+
+        # Each failure is logged with the traceback from the process function
+        traces = [error for error in errors if error.startswith('Traceback')]
+        self.assertEqual(len(traces), 2)
+        for (trace, volume_id) in zip(traces, ['GO_0019', 'GO_0029']):
+            self.assertIn('in write_volume', trace)
+            self.assertIn("ValueError: Bad volume %s" % volume_id, trace)
+        self.assertEqual(errors[-1], 'Volumes failed: GO_0019, GO_0029')
+
+        # Strip the completion counts, which depend on the order of completion
+        def outcomes(messages):
+            return sorted(message.partition(' (')[0] + message.partition(')')[2]
+                          for message in messages)
+
+        for max_volumes in [2, 3]:
+            (results_, files_, infos_, errors_) = self.process(max_volumes)
+            self.assertEqual(results_, results)
+            self.assertEqual(list(results_), list(results))
+            self.assertEqual(files_, files)
+            self.assertEqual(outcomes(infos_), outcomes(infos))
+            self.assertEqual(outcomes(errors_), outcomes(errors))
+
+
+class Test_Table(unittest.TestCase):
+
+    ROWS = ['"GO_0017","C0001.LBL",   1.500',
+            '"GO_0017","C0002.LBL",  12.250',
+            '"GO_0017","C0003.LBL",-100.000']
+
+    #===========================================================================
+    def write(self, output_dir, stream):
+        """Write a table, adding and flushing one row at a time; return the 
+        table and the names of the files in the directory after each flush."""
+        table = meta.Table(FCPath(output_dir), volume_id='GO_0017', 
+                           level='summary', qualifier='body', stream=stream)
+        listings = []
+        with mock.patch.object(meta.lab, 'create') as create:
+            for row in Test_Table.ROWS:
+                table.rows.append(row)
+                table.flush()
+                listings.append(sorted(os.listdir(output_dir)))
+            table.write()
+
+        # The label is made from the summary of the rows written
+        create.assert_called_once_with(table.filename, table_type='body_summary',
+                                       use_global_template=False, 
+                                       summary=table.summary)
+        return (table, listings)
+
+    #===========================================================================
+    # test that a streamed table matches one written at once
+    def test_stream(self):
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            (table, listings) = self.write(tempdir, stream=False)
+            with open(table.filename.path, 'rb') as f:
+                content = f.read()
+            os.remove(table.filename.path)
+            self.assertEqual(listings[-1], [])
+
+            (table, listings) = self.write(tempdir, stream=True)
+            with open(table.filename.path, 'rb') as f:
+                self.assertEqual(f.read(), content)
+
+            # Rows are released as they are flushed, to a temporary file that 
+            # is moved into place at the end
+            self.assertEqual(table.rows, [])
+            for listing in listings:
+                self.assertEqual(len(listing), 1)
+                self.assertTrue(listing[0].startswith('.GO_0017_body_summary.tab.'))
+            self.assertEqual(os.listdir(tempdir), ['GO_0017_body_summary.tab'])
+
+            # The rows are counted as they are written
+            self.assertEqual(content, ''.join(row + '\r\n' 
+                                              for row in Test_Table.ROWS).encode())
+            self.assertEqual(table.summary.rows, 3)
+            self.assertEqual(table.summary.record_bytes, 
+                             max(len(row) for row in Test_Table.ROWS) + 2)
+
+    #===========================================================================
+    # test that a streamed table without rows is not written
+    def test_stream_empty(self):
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            table = meta.Table(FCPath(tempdir), volume_id='GO_0017', 
+                               level='summary', qualifier='body', stream=True)
+            with mock.patch.object(meta.lab, 'create') as create:
+                table.flush()
+                table.write()
+            create.assert_not_called()
+            self.assertEqual(os.listdir(tempdir), [])
+
+################################################################################
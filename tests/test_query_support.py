@@ -0,0 +1,169 @@
+################################################################################
+# tests/test_query_support.py
+################################################################################
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import metadata_tools.query_support as query
+
+BODY_COLUMNS = [('VOLUME_ID', 'CHARACTER', 7),
+                ('FILE_SPECIFICATION_NAME', 'CHARACTER', 17),
+                ('SYSTEM_NAME', 'CHARACTER', 8),
+                ('BODY_NAME', 'CHARACTER', 8),
+                ('MINIMUM_PHASE', 'ASCII_REAL', 8)]
+
+BODY_ROWS = [('GO_0017', 'GO_0017/C0001.IMG', 'JUPITER', 'EUROPA',   12.5),
+             ('GO_0017', 'GO_0017/C0001.IMG', 'JUPITER', 'IO',       30.0),
+             ('GO_0017', 'GO_0017/C0002.IMG', 'JUPITER', 'IO',       31.0),
+             ('GO_0018', 'GO_0018/C0003.IMG', 'JUPITER', 'CALLISTO', 40.0),
+             ('GO_0018', 'GO_0018/C0004.IMG', 'JUPITER', 'EUROPA',   50.0)]
+
+INDEX_COLUMNS = [('FILE_SPECIFICATION_NAME', 'CHARACTER', 17),
+                 ('START_TIME', 'CHARACTER', 23)]
+
+INDEX_ROWS = [('GO_0017/C0001.IMG', '1996-06-27T12:00:00.000'),
+              ('GO_0017/C0002.IMG', '1996-06-27T13:00:00.000'),
+              ('GO_0018/C0003.IMG', '1996-06-28T12:00:00.000'),
+              ('GO_0018/C0004.IMG', '1996-06-29T12:00:00.000')]
+
+#===============================================================================
+def write_table(path, columns, rows):
+    """Write an ASCII table and a minimal PDS3 label describing it.
+
+    Args:
+        path (str): Path to the table file.
+        columns (list): Tuple (name, data_type, bytes) for each column;
+                        CHARACTER columns are quoted.
+        rows (list): Tuple of values for each row.
+    """
+    fields = []
+    label_columns = []
+    start = 1
+    for (name, data_type, width) in columns:
+        quoted = data_type == 'CHARACTER'
+        fields.append(('"%%-%ds"' if quoted else '%%%d.3f') % width)
+        label_columns += ['  OBJECT = COLUMN',
+                          '    NAME = %s' % name,
+                          '    DATA_TYPE = %s' % data_type,
+                          '    START_BYTE = %d' % (start + quoted),
+                          '    BYTES = %d' % width,
+                          '  END_OBJECT = COLUMN']
+        start += width + 2*quoted + 1
+
+    lines = [','.join(fields) % row for row in rows]
+    with open(path, 'w', newline='') as f:
+        f.write(''.join(line + '\r\n' for line in lines))
+
+    label = (['PDS_VERSION_ID = PDS3',
+              'RECORD_TYPE = FIXED_LENGTH',
+              'RECORD_BYTES = %d' % (len(lines[0]) + 2),
+              'FILE_RECORDS = %d' % len(lines),
+              '^TABLE = "%s"' % os.path.basename(path),
+              'OBJECT = TABLE',
+              '  INTERCHANGE_FORMAT = ASCII',
+              '  ROWS = %d' % len(lines),
+              '  COLUMNS = %d' % len(columns),
+              '  ROW_BYTES = %d' % (len(lines[0]) + 2)]
+             + label_columns + ['END_OBJECT = TABLE', 'END'])
+    with open(os.path.splitext(path)[0] + '.lbl', 'w', newline='') as f:
+        f.write(''.join(line + '\r\n' for line in label))
+
+
+class Test_QueryIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.body_file = os.path.join(self.tempdir.name, 'GO_0999_body_summary.tab')
+        self.ring_file = os.path.join(self.tempdir.name, 'GO_0999_ring_summary.tab')
+        self.index_file = os.path.join(self.tempdir.name,
+                                       'GO_0999_supplemental_index.tab')
+
+        write_table(self.body_file, BODY_COLUMNS, BODY_ROWS)
+        write_table(self.ring_file, BODY_COLUMNS[:3] + BODY_COLUMNS[4:],
+                    [row[:3] + row[4:] for row in BODY_ROWS])
+        write_table(self.index_file, INDEX_COLUMNS, INDEX_ROWS)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    #===========================================================================
+    # test queries of a body table by each key
+    def test_body(self):
+        query.write_query_index(self.body_file, self.index_file)
+        index = query.QueryIndex(self.body_file)
+        self.assertEqual(sorted(index.keys), ['BODY_NAME', 'FILE_SPECIFICATION_NAME',
+                                              'SYSTEM_NAME', 'TIME', 'VOLUME_ID'])
+
+        self.assertEqual(index.find('VOLUME_ID', 'GO_0018').tolist(), [3, 4])
+        self.assertEqual(index.find('FILE_SPECIFICATION_NAME',
+                                    'GO_0017/C0001.IMG').tolist(), [0, 1])
+        self.assertEqual(index.find('SYSTEM_NAME', 'JUPITER').tolist(),
+                         [0, 1, 2, 3, 4])
+        self.assertEqual(index.find('BODY_NAME', 'EUROPA').tolist(), [0, 4])
+        self.assertEqual(index.find('BODY_NAME', 'IO').tolist(), [1, 2])
+        self.assertEqual(index.find('BODY_NAME', 'JUPITER').tolist(), [])
+
+        # Ranges of values and of times are inclusive
+        self.assertEqual(index.find('BODY_NAME', 'CALLISTO', 'EUROPA').tolist(),
+                         [0, 3, 4])
+        self.assertEqual(index.find('TIME', '1996-06-27T12:30:00',
+                                            '1996-06-28T12:00:00').tolist(), [2, 3])
+        tai = query._tai('1996-06-27T13:00:00')
+        self.assertEqual(index.find('TIME', tai).tolist(), [2])
+
+        # Rows are returned as they appear in the table
+        with open(self.body_file) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(index.rows('BODY_NAME', 'EUROPA'), [lines[0], lines[4]])
+        self.assertEqual(index.rows('TIME', '1996-06-29', '1996-06-30'), [lines[4]])
+        self.assertEqual(index.row(2), lines[2])
+
+        self.assertRaises(KeyError, index.find, 'MINIMUM_PHASE', 12.5)
+
+    #===========================================================================
+    # test a ring table, which has no body names
+    def test_ring(self):
+        query.write_query_index(self.ring_file)
+        index = query.QueryIndex(self.ring_file)
+        self.assertEqual(sorted(index.keys), ['FILE_SPECIFICATION_NAME',
+                                              'SYSTEM_NAME', 'VOLUME_ID'])
+        self.assertEqual(index.find('FILE_SPECIFICATION_NAME',
+                                    'GO_0018/C0004.IMG').tolist(), [4])
+        self.assertRaises(KeyError, index.find, 'BODY_NAME', 'IO')
+
+    #===========================================================================
+    # test closing the index, directly and at the end of a with block
+    def test_close(self):
+        query.write_query_index(self.body_file, self.index_file)
+        with query.QueryIndex(self.body_file) as index:
+            self.assertEqual(index.find('BODY_NAME', 'IO').tolist(), [1, 2])
+            table = index.table
+        self.assertTrue(table.closed)
+        self.assertIsNone(index.array)
+        self.assertRaises(ValueError, index.find, 'BODY_NAME', 'IO')
+        self.assertRaises(ValueError, index.row, 0)
+        index.close()
+
+        # The table can be replaced once the index is closed
+        index = query.QueryIndex(self.body_file)
+        index.close()
+        query.write_query_index(self.body_file, self.index_file)
+
+    #===========================================================================
+    # test the key values of each row
+    def test_read_query_rows(self):
+        self.assertIsNone(query.read_query_rows(self.body_file))
+
+        query.write_query_index(self.body_file, self.index_file)
+        rows = query.read_query_rows(self.body_file)
+        self.assertEqual(rows['BODY_NAME'].tolist(),
+                         [row[3].encode() for row in BODY_ROWS])
+        row_bytes = os.path.getsize(self.body_file) // len(BODY_ROWS)
+        self.assertEqual(rows['OFFSET'].tolist(),
+                         [i * row_bytes for i in range(len(BODY_ROWS))])
+        self.assertTrue(np.all(np.diff(rows['TIME']) >= 0))
+
+################################################################################
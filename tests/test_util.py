@@ -0,0 +1,211 @@
+################################################################################
+# tests/test_util.py
+################################################################################
+import os
+import tempfile
+import unittest
+
+from unittest import mock
+
+import metadata_tools.util as util
+
+class Test_RangeFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, 'test.dat')
+        self.content = bytes(range(256)) * 40
+        with open(self.path, 'wb') as f:
+            f.write(self.content)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    #===========================================================================
+    # test reads and seeks
+    def test_read(self):
+        f = util.RangeFile(self.path, block_size=1024)
+        self.assertTrue(f.readable())
+        self.assertTrue(f.seekable())
+
+        # Reads within a block use the buffer
+        self.assertEqual(f.read(10), self.content[:10])
+        self.assertEqual(f.read(20), self.content[10:30])
+        self.assertEqual(f.tell(), 30)
+        self.assertEqual(f.bytes_read, 1024)
+
+        # Reads outside the block fetch a new one
+        self.assertEqual(f.seek(5000), 5000)
+        self.assertEqual(f.read(100), self.content[5000:5100])
+        self.assertEqual(f.seek(0), 0)
+        self.assertEqual(f.read(2000), self.content[:2000])
+        self.assertEqual(f.bytes_read, 1024 + 1024 + 2000)
+
+        # Only absolute seeks are supported
+        self.assertRaises(OSError, f.seek, 0, os.SEEK_END)
+
+    #===========================================================================
+    # test reads to the end of the file
+    def test_read_all(self):
+        f = util.RangeFile(self.path, block_size=1024)
+
+        # read(-1) returns everything past the position, not just the buffer
+        f.read(10)
+        self.assertEqual(f.read(), self.content[10:])
+        self.assertEqual(f.tell(), len(self.content))
+        self.assertEqual(f.read(), b'')
+
+        f.seek(len(self.content) - 100)
+        self.assertEqual(f.read(-1), self.content[-100:])
+
+        # Reads beyond the end return no bytes
+        f.seek(len(self.content) + 10)
+        self.assertEqual(f.read(10), b'')
+        self.assertEqual(f.read(), b'')
+
+    #===========================================================================
+    # test a missing file
+    def test_missing(self):
+        f = util.RangeFile(os.path.join(self.tempdir.name, 'missing.dat'))
+        self.assertRaises(FileNotFoundError, f.read, 10)
+
+    #===========================================================================
+    # test remote reads through the range sources
+    def test_remote(self):
+
+        calls = []
+        def read_range(source, sub_path, start, stop=None):
+            calls.append((sub_path, start, stop))
+            return self.content[start:] if stop is None else self.content[start:stop+1]
+
+        with mock.patch.object(util._RangeSourceHTTP, 'read_range', read_range):
+            f = util.RangeFile('https://example.com/volumes/test.dat', block_size=1024)
+            self.assertEqual(f.read(10), self.content[:10])
+            self.assertEqual(f.read(), self.content[10:])
+            self.assertEqual(calls, [('volumes/test.dat', 0, 1023),
+                                     ('volumes/test.dat', 10, None)])
+
+            # Files on the same server share a source
+            (source, sub_path) = util._range_source(util.FCPath('https://example.com/x'))
+            self.assertIs(source, util._range_source(util.FCPath('https://example.com/y'))[0])
+            self.assertEqual(sub_path, 'x')
+            self.assertIsInstance(source, util._RangeSourceHTTP)
+            self.assertEqual(source.prefix, 'https://example.com/')
+
+    #===========================================================================
+    # test HTTP range reads, including servers that ignore the range
+    def test_http_range(self):
+
+        source = util._RangeSourceHTTP('https', 'example.com')
+        for (status, content) in [(206, self.content[5:15]), (200, self.content)]:
+            response = mock.Mock(status_code=status, content=content)
+            with mock.patch('requests.get', return_value=response) as get:
+                self.assertEqual(source.read_range('x.dat', 5, 14), self.content[5:15])
+                self.assertEqual(get.call_args.args, ('https://example.com/x.dat',))
+                self.assertEqual(get.call_args.kwargs['headers'], {'Range': 'bytes=5-14'})
+
+        with mock.patch('requests.get', return_value=mock.Mock(status_code=416)):
+            self.assertEqual(source.read_range('x.dat', 10**9), b'')
+        with mock.patch('requests.get', return_value=mock.Mock(status_code=404)):
+            self.assertRaises(FileNotFoundError, source.read_range, 'x.dat', 0)
+
+
+class Test_LabelCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tempdir.name, 'cache')
+        self.path = os.path.join(self.tempdir.name, 'C0001.LBL')
+        self.write('A')
+
+    def tearDown(self):
+        util.use_label_cache(None)
+        self.tempdir.cleanup()
+
+    #===========================================================================
+    def write(self, value, mtime_ns=None):
+        """Write the label file, optionally setting its modification time."""
+        with open(self.path, 'w') as f:
+            f.write(value)
+        if mtime_ns is not None:
+            os.utime(self.path, ns=(mtime_ns, mtime_ns))
+
+    #===========================================================================
+    def cache(self, input_dir='/volumes/GO_0017'):
+        """New label cache for a volume."""
+        return util.LabelCache(input_dir, 'GO_0017', cache_dir=self.cache_dir)
+
+    #===========================================================================
+    # test reuse while the file is unchanged, and across runs
+    def test_get(self):
+        def read(path):
+            with open(path.path) as f:
+                return {'VALUE': f.read()}
+        reader = mock.Mock(side_effect=read)
+
+        cache = self.cache()
+        self.assertEqual(cache.get('pds3', self.path, reader), {'VALUE': 'A'})
+        self.assertEqual(cache.get('pds3', self.path, reader), {'VALUE': 'A'})
+        self.assertEqual(reader.call_count, 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # Each kind of value is cached separately
+        self.assertEqual(cache.get('vicar', self.path, reader), {'VALUE': 'A'})
+        self.assertEqual(reader.call_count, 2)
+
+        # The cache is written only if it has changed
+        cache.save()
+        self.assertTrue(cache.path.exists())
+        self.assertFalse(cache.modified)
+        with mock.patch.object(util.pickle, 'dump') as dump:
+            cache.save()
+        dump.assert_not_called()
+
+        # A new run reads nothing while the file is unchanged...
+        cache = self.cache()
+        self.assertEqual(cache.get('pds3', self.path, reader), {'VALUE': 'A'})
+        self.assertEqual(reader.call_count, 2)
+
+        # ...but rereads the file once it changes, even with the same size
+        stat = os.stat(self.path)
+        self.write('B', mtime_ns=stat.st_mtime_ns + 10**9)
+        self.assertEqual(cache.get('pds3', self.path, reader), {'VALUE': 'B'})
+        self.assertEqual(reader.call_count, 3)
+
+        # Each volume has its own cache
+        self.assertNotEqual(self.cache('/volumes/GO_0018').path, cache.path)
+
+    #===========================================================================
+    # test files that cannot be cached, and unreadable caches
+    def test_uncached(self):
+        missing = os.path.join(self.tempdir.name, 'MISSING.LBL')
+        reader = mock.Mock(return_value={})
+
+        cache = self.cache()
+        cache.get('pds3', missing, reader)
+        cache.get('pds3', missing, reader)
+        self.assertEqual(reader.call_count, 2)
+        self.assertEqual(cache.entries, {})
+
+        os.makedirs(self.cache_dir)
+        with open(cache.path, 'wb') as f:
+            f.write(b'not a pickle')
+        self.assertEqual(self.cache().entries, {})
+
+    #===========================================================================
+    # test the cache shared by the key functions
+    def test_cached_label(self):
+        reader = mock.Mock(return_value={'VALUE': 'A'})
+
+        util.cached_label('pds3', self.path, reader)
+        util.cached_label('pds3', self.path, reader)
+        self.assertEqual(reader.call_count, 2)
+
+        cache = self.cache()
+        util.use_label_cache(cache)
+        util.cached_label('pds3', self.path, reader)
+        util.cached_label('pds3', self.path, reader)
+        self.assertEqual(reader.call_count, 3)
+        self.assertEqual(cache.hits, 1)
+
+################################################################################